@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import User, Course, Enrollment, Progress, Achievement, Lesson, Quiz, Question, Option, QuizAttempt, Payment, Certificate, Notification, SupportTicket, Service, TeamMember
+from .models import User, Course, Enrollment, Progress, Achievement, Lesson, Quiz, Question, Option, QuizAttempt, Payment, Certificate, CertificateJob, CertificateTemplate, Notification, SupportTicket, Service, TeamMember, EmailOutbox, CourseRating, PaymentWebhookEvent, ChatSession, ChatMessage, SyncEvent
 
 # Register your models here.
 admin.site.register(User)
@@ -14,7 +14,23 @@ admin.site.register(Option)
 admin.site.register(QuizAttempt)
 admin.site.register(Payment)
 admin.site.register(Certificate)
+admin.site.register(CertificateJob)
+admin.site.register(CertificateTemplate)
 admin.site.register(Notification)
 admin.site.register(SupportTicket)
 admin.site.register(Service)
 admin.site.register(TeamMember)
+admin.site.register(CourseRating)
+admin.site.register(ChatSession)
+admin.site.register(ChatMessage)
+admin.site.register(SyncEvent)
+
+@admin.register(EmailOutbox)
+class EmailOutboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'subject', 'status', 'attempts', 'next_attempt_at', 'sent_at')
+    list_filter = ('status',)
+
+@admin.register(PaymentWebhookEvent)
+class PaymentWebhookEventAdmin(admin.ModelAdmin):
+    list_display = ('id', 'provider', 'reference', 'event', 'status', 'attempts', 'next_attempt_at', 'received_at', 'processed_at')
+    list_filter = ('status', 'provider')
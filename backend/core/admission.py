@@ -0,0 +1,188 @@
+import functools
+import math
+import time
+import uuid
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.cache import caches
+from django.http import JsonResponse
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework_simplejwt.authentication import JWTAuthentication
+
+from .ai_cache import AI_CACHE_ALIAS
+
+# (requests, seconds) refill rate per caller, plus how many may arrive back to back
+AI_USER_RATE = getattr(settings, 'AI_USER_RATE', (20, 60))
+AI_ANON_RATE = getattr(settings, 'AI_ANON_RATE', (5, 60))
+AI_RATE_BURST = getattr(settings, 'AI_RATE_BURST', 5)
+# Upstream calls in flight across all workers, and how many more may wait for one
+AI_MAX_ACTIVE = getattr(settings, 'AI_MAX_ACTIVE', 32)
+AI_MAX_QUEUED = getattr(settings, 'AI_MAX_QUEUED', 64)
+AI_QUEUE_TIMEOUT = getattr(settings, 'AI_QUEUE_TIMEOUT', 10)
+QUEUE_POLL = 0.05
+# Every slot and queue place is a lease, a cache key of its own with an expiry, so a
+# worker killed while holding one cannot leak it for long. Streams renew their lease
+# as chunks arrive, other callers hold theirs for one upstream call at most.
+AI_SLOT_LEASE_SECONDS = getattr(settings, 'AI_SLOT_LEASE_SECONDS', 120)
+
+ACTIVE_PREFIX = 'ai:admission:active'
+QUEUED_PREFIX = 'ai:admission:queued'
+
+
+class Rejected(Exception):
+    def __init__(self, message, retry_after):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+def _shared():
+    return caches[AI_CACHE_ALIAS]
+
+
+def _lease(prefix, places, timeout):
+    # Takes a free place out of `places`, returns its (key, token) or None when all are taken
+    shared = _shared()
+    keys = [f'{prefix}:{n}' for n in range(places)]
+    taken = shared.get_many(keys)
+    token = uuid.uuid4().hex
+    for key in keys:
+        # add() only succeeds for one caller, a lost race moves on to the next place
+        if key not in taken and shared.add(key, token, timeout):
+            return key, token
+    return None
+
+
+def _release(lease):
+    if lease is None:
+        return
+    key, token = lease
+    shared = _shared()
+    if shared.get(key) == token:
+        shared.delete(key)
+
+
+def request_user(request):
+    # The AI views are plain Django views, so bearer tokens are checked here
+    try:
+        authenticated = JWTAuthentication().authenticate(request)
+    except AuthenticationFailed:
+        authenticated = None
+    if authenticated is not None:
+        return authenticated[0]
+    return request.user
+
+
+def client_identity(user, address):
+    if user is not None and user.is_authenticated:
+        return f'user:{user.pk}', AI_USER_RATE
+    return f'ip:{address}', AI_ANON_RATE
+
+
+def check_rate(identity, rate, burst=None):
+    # GCRA token bucket. The stored value is the theoretical arrival time in ms and is
+    # only moved with incr/decr, so concurrent workers cannot both spend the last token.
+    requests, period = rate
+    burst = burst or AI_RATE_BURST
+    interval = int(period * 1000 / requests)
+    key = f'ai:rate:{identity}'
+    shared = _shared()
+    now = int(time.time() * 1000)
+    timeout = math.ceil(burst * interval / 1000) + 1
+    try:
+        tat = shared.incr(key, interval)
+    except ValueError:
+        tat = None
+    if tat is None or tat - interval < now:
+        # Idle long enough for the bucket to be full again
+        tat = now + interval
+        shared.set(key, tat, timeout)
+    allow_at = tat - burst * interval
+    if now < allow_at:
+        shared.decr(key, interval)
+        raise Rejected('Too many AI requests, slow down.', (allow_at - now) / 1000)
+    shared.touch(key, timeout)
+
+
+def acquire_slot():
+    # Returns the lease to hand back to release_slot()
+    lease = _lease(ACTIVE_PREFIX, AI_MAX_ACTIVE, AI_SLOT_LEASE_SECONDS)
+    if lease is not None:
+        return lease
+    place = _lease(QUEUED_PREFIX, AI_MAX_QUEUED, AI_QUEUE_TIMEOUT + 1)
+    if place is None:
+        raise Rejected('The AI tutor is busy, try again shortly.', 1)
+    try:
+        deadline = time.monotonic() + AI_QUEUE_TIMEOUT
+        while time.monotonic() < deadline:
+            time.sleep(QUEUE_POLL)
+            lease = _lease(ACTIVE_PREFIX, AI_MAX_ACTIVE, AI_SLOT_LEASE_SECONDS)
+            if lease is not None:
+                return lease
+    finally:
+        _release(place)
+    raise Rejected('The AI tutor is busy, try again shortly.', 1)
+
+
+def renew_slot(lease):
+    # Long streams push their lease back while they are still sending
+    _shared().touch(lease[0], AI_SLOT_LEASE_SECONDS)
+
+
+def release_slot(lease):
+    _release(lease)
+
+
+class LeasedStream:
+    # Async iterator over `chunks` that holds a slot lease: renewed while chunks
+    # flow, released when the stream ends, fails or is cancelled, and by close(),
+    # which Django calls on a response even when its content was never read.
+    def __init__(self, chunks, lease):
+        self.chunks = chunks
+        self.lease = lease
+        self.renewed = time.monotonic()
+
+    def __aiter__(self):
+        return self._stream()
+
+    async def _stream(self):
+        try:
+            async for chunk in self.chunks:
+                if time.monotonic() - self.renewed > AI_SLOT_LEASE_SECONDS / 3:
+                    self.renewed = time.monotonic()
+                    await sync_to_async(renew_slot, thread_sensitive=False)(self.lease)
+                yield chunk
+        finally:
+            await sync_to_async(self.close, thread_sensitive=False)()
+
+    def close(self):
+        lease, self.lease = self.lease, None
+        release_slot(lease)
+
+
+def admit(request):
+    # Returns the caller and its slot once it is within its rate, the caller must release_slot()
+    user = request_user(request)
+    identity, rate = client_identity(user, request.META.get('REMOTE_ADDR', ''))
+    check_rate(identity, rate)
+    return user, acquire_slot()
+
+
+def too_many_requests(rejected):
+    response = JsonResponse({'error': str(rejected)}, status=429)
+    response['Retry-After'] = str(max(1, math.ceil(rejected.retry_after)))
+    return response
+
+
+def admission_controlled(view):
+    @functools.wraps(view)
+    def wrapped(request, *args, **kwargs):
+        try:
+            request.ai_user, lease = admit(request)
+        except Rejected as rejected:
+            return too_many_requests(rejected)
+        try:
+            return view(request, *args, **kwargs)
+        finally:
+            release_slot(lease)
+    return wrapped
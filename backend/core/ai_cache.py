@@ -0,0 +1,204 @@
+import hashlib
+import re
+import threading
+import time
+import unicodedata
+import uuid
+from collections import Counter, OrderedDict
+from concurrent.futures import Future
+
+from django.conf import settings
+from django.core.cache import caches
+
+AI_CACHE_ALIAS = getattr(settings, 'AI_CACHE_ALIAS', 'default')
+AI_CACHE_TIMEOUT = getattr(settings, 'AI_CACHE_TIMEOUT', 60 * 60 * 24)
+AI_CACHE_LOCAL_SIZE = getattr(settings, 'AI_CACHE_LOCAL_SIZE', 1000)
+AI_CACHE_LOCAL_TIMEOUT = getattr(settings, 'AI_CACHE_LOCAL_TIMEOUT', 60 * 5)
+# The lock outlives a slow upstream call (retries included), followers give up a bit earlier
+SINGLE_FLIGHT_LOCK_TIMEOUT = 30
+SINGLE_FLIGHT_WAIT = 25
+SINGLE_FLIGHT_POLL = 0.1
+
+STATS_KEYS = ('hits', 'local_hits', 'misses')
+STATS_FLUSH_EVERY = 100
+STATS_FLUSH_SECONDS = 5
+WHITESPACE_RE = re.compile(r'\s+')
+
+
+def normalize_prompt(prompt):
+    # "What is a variable?" and "  what is a  VARIABLE " share one entry
+    text = unicodedata.normalize('NFKC', str(prompt)).casefold()
+    return WHITESPACE_RE.sub(' ', text).strip().rstrip('?!. ')
+
+
+def prompt_cache_key(prompt, language='en'):
+    digest = hashlib.sha256(f'{language}\x00{normalize_prompt(prompt)}'.encode()).hexdigest()
+    return f'ai:response:{digest}'
+
+
+class LRUCache:
+    # Size bounded, per-process LRU with a TTL. It sits in front of the shared
+    # cache so the hottest prompts cost no network round trip at all.
+    def __init__(self, max_entries, timeout):
+        self.max_entries = max_entries
+        self.timeout = timeout
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            expires, value = entry
+            if expires < time.monotonic():
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return value
+
+    def set(self, key, value):
+        with self.lock:
+            self.entries[key] = (time.monotonic() + self.timeout, value)
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+
+
+local_cache = LRUCache(AI_CACHE_LOCAL_SIZE, AI_CACHE_LOCAL_TIMEOUT)
+
+
+def _shared():
+    return caches[AI_CACHE_ALIAS]
+
+
+class StatsCounter:
+    # Lookups are counted in process memory and added to the shared counters in
+    # batches, so a local hit still costs no network round trip. Counts not yet
+    # flushed when a worker exits are lost, the stats are only a ratio.
+    def __init__(self, flush_every, flush_seconds):
+        self.flush_every = flush_every
+        self.flush_seconds = flush_seconds
+        self.pending = Counter()
+        self.next_flush = time.monotonic() + flush_seconds
+        self.lock = threading.Lock()
+
+    def add(self, name):
+        with self.lock:
+            self.pending[name] += 1
+            due = sum(self.pending.values()) >= self.flush_every or time.monotonic() >= self.next_flush
+        if due:
+            self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending, self.pending = self.pending, Counter()
+            self.next_flush = time.monotonic() + self.flush_seconds
+        shared = _shared()
+        for name, n in pending.items():
+            key = f'ai:stats:{name}'
+            try:
+                shared.incr(key, n)
+            except ValueError:
+                if not shared.add(key, n, None):
+                    shared.incr(key, n)
+
+    def clear(self):
+        with self.lock:
+            self.pending.clear()
+
+
+stats_counter = StatsCounter(STATS_FLUSH_EVERY, STATS_FLUSH_SECONDS)
+
+
+def get_cached_response(prompt, language='en'):
+    key = prompt_cache_key(prompt, language)
+    # Callers get their own copy, what they add must not reach other requests
+    result = local_cache.get(key)
+    if result is not None:
+        stats_counter.add('local_hits')
+        return dict(result)
+    result = _shared().get(key)
+    if result is not None:
+        local_cache.set(key, dict(result))
+        stats_counter.add('hits')
+        return result
+    stats_counter.add('misses')
+    return None
+
+
+def set_cached_response(prompt, result, language='en'):
+    # Errors are never cached, the next request retries upstream
+    if not result.get('text') or 'error' in result:
+        return
+    key = prompt_cache_key(prompt, language)
+    _shared().set(key, result, AI_CACHE_TIMEOUT)
+    local_cache.set(key, dict(result))
+
+
+_in_flight = {}
+_in_flight_lock = threading.Lock()
+
+
+def _compute_across_workers(key, compute):
+    shared = _shared()
+    lock_key = f'{key}:lock'
+    token = uuid.uuid4().hex
+    if shared.add(lock_key, token, SINGLE_FLIGHT_LOCK_TIMEOUT):
+        try:
+            # Another worker may have stored the answer between our miss and the lock
+            result = shared.get(key)
+            return result if result is not None else compute()
+        finally:
+            if shared.get(lock_key) == token:
+                shared.delete(lock_key)
+    # Another worker is asking upstream, wait for its answer to land in the cache
+    deadline = time.monotonic() + SINGLE_FLIGHT_WAIT
+    while time.monotonic() < deadline:
+        time.sleep(SINGLE_FLIGHT_POLL)
+        result = shared.get(key)
+        if result is not None:
+            return result
+        if shared.get(lock_key) is None:
+            # It finished without caching anything, i.e. it failed
+            break
+    return compute()
+
+
+def single_flight(key, compute):
+    # Concurrent callers with the same key share one compute(): threads in this
+    # process wait on the leader's future, other workers on a short-lived cache lock.
+    # compute() is expected to store successful results under `key`.
+    with _in_flight_lock:
+        future = _in_flight.get(key)
+        leader = future is None
+        if leader:
+            future = _in_flight[key] = Future()
+    if not leader:
+        result = future.result(timeout=SINGLE_FLIGHT_WAIT + SINGLE_FLIGHT_LOCK_TIMEOUT)
+        # Followers get a copy of the leader's answer, not the object it returns
+        return dict(result) if isinstance(result, dict) else result
+    try:
+        result = _compute_across_workers(key, compute)
+        future.set_result(result)
+        return result
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _in_flight_lock:
+            _in_flight.pop(key, None)
+
+
+def cache_stats():
+    # Shared totals, including what this process has not flushed yet
+    stats_counter.flush()
+    values = _shared().get_many([f'ai:stats:{name}' for name in STATS_KEYS])
+    stats = {name: values.get(f'ai:stats:{name}', 0) for name in STATS_KEYS}
+    lookups = sum(stats.values())
+    stats['hit_ratio'] = round((stats['hits'] + stats['local_hits']) / lookups, 4) if lookups else 0.0
+    return stats
@@ -0,0 +1,74 @@
+import hashlib
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+
+CATALOG_VERSION_KEY = 'catalog:version'
+# Without a shared cache (CACHE_REDIS_URL) a bumped version only reaches the
+# worker that bumped it, so every worker caches for LOCAL_CACHE_TIMEOUT at most
+LOCAL_CACHE_TIMEOUT = getattr(settings, 'LOCAL_CACHE_TIMEOUT', 30)
+
+
+def is_shared_cache(alias='default'):
+    return not settings.CACHES[alias]['BACKEND'].endswith('.LocMemCache')
+
+
+def cache_timeout(timeout, alias='default'):
+    return timeout if is_shared_cache(alias) else min(timeout, LOCAL_CACHE_TIMEOUT)
+
+
+# With a shared cache entries are never stale (any change bumps the version),
+# the timeout only lets payloads of old versions fall out of the cache
+CATALOG_CACHE_TIMEOUT = cache_timeout(getattr(settings, 'CATALOG_CACHE_TIMEOUT', 60 * 60 * 24))
+
+
+COUNTS_THROTTLE_KEY = 'catalog:counts-bumped'
+COUNTS_DIRTY_KEY = 'catalog:counts-dirty'
+# Enrollments change the cached students_count far more often than anything else
+# the catalog shows, so their bumps are spread at least this many seconds apart
+CATALOG_COUNTS_BUMP_SECONDS = getattr(settings, 'CATALOG_COUNTS_BUMP_SECONDS', 60)
+
+
+def catalog_version():
+    values = cache.get_many([CATALOG_VERSION_KEY, COUNTS_DIRTY_KEY])
+    version = values.get(CATALOG_VERSION_KEY)
+    if COUNTS_DIRTY_KEY in values and cache.add(COUNTS_THROTTLE_KEY, 1, CATALOG_COUNTS_BUMP_SECONDS):
+        # Counts changed during the last window, the first read after it catches up
+        cache.delete(COUNTS_DIRTY_KEY)
+        bump_catalog_version()
+        version = cache.get(CATALOG_VERSION_KEY)
+    if version is None:
+        # Start from the clock rather than 1, so a version key lost to eviction or a
+        # cache restart can never come back to a number that still has payloads cached
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+        version = cache.get(CATALOG_VERSION_KEY)
+    return version
+
+
+def bump_catalog_version():
+    try:
+        cache.incr(CATALOG_VERSION_KEY)
+    except ValueError:
+        cache.add(CATALOG_VERSION_KEY, int(time.time() * 1000), None)
+
+
+def bump_catalog_counts():
+    # Bumps right away at most once per window, later changes are picked up by catalog_version()
+    if cache.add(COUNTS_THROTTLE_KEY, 1, CATALOG_COUNTS_BUMP_SECONDS):
+        bump_catalog_version()
+    else:
+        cache.set(COUNTS_DIRTY_KEY, 1, None)
+
+
+def catalog_cache_key(kind, request):
+    # The absolute URI covers pagination cursors, ?fields/?expand and the host used in next/previous links
+    digest = hashlib.md5(request.build_absolute_uri().encode()).hexdigest()
+    return f'catalog:{catalog_version()}:{kind}:{digest}'
+
+
+def uses_public_catalog(user):
+    # Anonymous users and students all see the same published-course payloads
+    if not user.is_authenticated:
+        return True
+    return not (user.is_staff or getattr(user, 'role', None) in ('admin', 'instructor'))
@@ -0,0 +1,301 @@
+import logging
+import unicodedata
+import zlib
+from collections import OrderedDict, namedtuple
+from string import Formatter
+
+from django.conf import settings
+from PIL import Image
+from reportlab.pdfbase.pdfmetrics import stringWidth
+from reportlab.pdfbase.ttfonts import TTFontFile, makeToUnicodeCMap
+
+logger = logging.getLogger(__name__)
+
+# Certificates are written as small PDFs directly. What a template draws the
+# same way on every certificate (borders, headings, logo) is compiled once per
+# template version into a form XObject and kept serialized, a certificate only
+# adds its own text stream and the cross-reference table.
+PAGE_SIZE = (612, 792)
+PLACEHOLDERS = ('name', 'course', 'date', 'verification')
+MAX_LAYERS = 16
+
+# The standard PDF fonts, which need no embedding
+FONTS = (
+    'Helvetica', 'Helvetica-Bold', 'Helvetica-Oblique', 'Helvetica-BoldOblique',
+    'Times-Roman', 'Times-Bold', 'Times-Italic', 'Times-BoldItalic', 'Courier', 'Courier-Bold',
+)
+FONT_RESOURCES = {font: f'F{i + 1}' for i, font in enumerate(FONTS)}
+
+# A TrueType font with the characters WinAnsi lacks (the Hausa hooked letters
+# among them). Fields that need it are drawn with a subset of it embedded in
+# that certificate only. Without one those letters fall back to plain ones.
+CERTIFICATE_FONT = getattr(settings, 'CERTIFICATE_FONT', '')
+PLAIN_LETTERS = str.maketrans('ɓƁɗƊƙƘƴƳʼ', 'bBdDkKyY\'')
+
+# Same page as certificates had before templates, plus the verification id
+DEFAULT_LAYOUT = {
+    'background': [
+        {'type': 'text', 'text': 'Certificate of Completion', 'x': 300, 'y': 700, 'font': 'Helvetica-Bold', 'size': 24},
+    ],
+    'fields': [
+        {'text': 'Awarded to: {name}', 'x': 300, 'y': 650, 'size': 16},
+        {'text': 'For completing the course: {course}', 'x': 300, 'y': 620, 'size': 16},
+        {'text': 'Date: {date}', 'x': 300, 'y': 580, 'size': 12},
+        {'text': 'Verification ID: {verification}', 'x': 300, 'y': 80, 'size': 9, 'color': '#555555'},
+    ],
+}
+
+# What pool processes are given to find or compile a layer, key is (template id, version)
+TemplateSpec = namedtuple('TemplateSpec', 'key layout logo_path font_path', defaults=('',))
+DEFAULT_SPEC = TemplateSpec(('default', 1), DEFAULT_LAYOUT, '', CERTIFICATE_FONT)
+
+
+def validate_layout(layout):
+    if not isinstance(layout, dict) or not isinstance(layout.get('fields', []), list) or not isinstance(layout.get('background', []), list):
+        raise ValueError('A layout has a "background" and a "fields" list.')
+    for element in layout.get('background', []):
+        if element.get('type') not in ('text', 'rect', 'line', 'logo'):
+            raise ValueError(f'Unknown background element: {element.get("type")!r}.')
+    for element in layout.get('background', []) + layout.get('fields', []):
+        if element.get('font', 'Helvetica') not in FONT_RESOURCES:
+            raise ValueError(f'Unsupported font: {element["font"]!r}, use one of {", ".join(FONTS)}.')
+    for field in layout.get('fields', []):
+        try:
+            names = {name for _, name, _, _ in Formatter().parse(field['text']) if name is not None}
+        except (KeyError, ValueError, TypeError) as e:
+            raise ValueError(f'Invalid field: {e}') from e
+        if not names <= set(PLACEHOLDERS):
+            raise ValueError(f'Fields may only use {{{"}, {".join(PLACEHOLDERS)}}}.')
+
+
+def _color(value, operator):
+    value = value.lstrip('#')
+    r, g, b = (int(value[i:i + 2], 16) / 255 for i in (0, 2, 4))
+    return f'{r:.3f} {g:.3f} {b:.3f} {operator}'
+
+
+def _winansi(text):
+    try:
+        text.encode('cp1252')
+    except UnicodeEncodeError:
+        return False
+    return True
+
+
+def _plain(text):
+    # What the standard fonts can show of text WinAnsi lacks: hooked letters and
+    # accents dropped, anything else still prints as '?'
+    if _winansi(text):
+        return text
+    plain = unicodedata.normalize('NFKC', ''.join(
+        c for c in unicodedata.normalize('NFKD', text.translate(PLAIN_LETTERS)) if not unicodedata.combining(c)
+    ))
+    logger.warning('Certificate text %r has characters the standard fonts lack, set CERTIFICATE_FONT to print them', text)
+    return plain
+
+
+def _pdf_string(raw):
+    return b'(' + raw.replace(b'\\', b'\\\\').replace(b'(', b'\\(').replace(b')', b'\\)') + b')'
+
+
+def _text(element, text, subset=None):
+    # subset is the certificate's UnicodeSubset, used for text WinAnsi lacks
+    size, x = element.get('size', 12), element['x']
+    if subset is not None and not _winansi(text):
+        # Hex, as the subset's codes include line ends a literal string would not keep
+        resource, string, width = 'FU', b'<%s>' % subset.encode(text).hex().encode(), subset.width(text, size)
+    else:
+        font = element.get('font', 'Helvetica')
+        text = _plain(text)
+        resource, string, width = FONT_RESOURCES[font], _pdf_string(text.encode('cp1252', 'replace')), stringWidth(text, font, size)
+    align = element.get('align', 'center')
+    if align != 'left':
+        x -= width / 2 if align == 'center' else width
+    return b''.join((
+        f'BT {_color(element.get("color", "#000000"), "rg")} /{resource} {size} Tf {x:.2f} {element["y"]:.2f} Td '.encode(),
+        string,
+        b' Tj ET\n',
+    ))
+
+
+def _background(element, logo):
+    kind = element['type']
+    if kind == 'text':
+        return _text(element, element['text'])
+    if kind == 'logo':
+        if not logo:
+            return b''
+        return f'q {element["width"]} 0 0 {element["height"]} {element["x"]} {element["y"]} cm /Logo Do Q\n'.encode()
+    ops = [f'q {element.get("line_width", 1)} w {_color(element.get("stroke", "#000000"), "RG")}']
+    if kind == 'line':
+        ops.append(f'{element["x1"]} {element["y1"]} m {element["x2"]} {element["y2"]} l S Q\n')
+    else:
+        fill = element.get('fill')
+        if fill:
+            ops.append(_color(fill, 'rg'))
+        paint = ('B' if element.get('stroke') else 'f') if fill else 'S'
+        ops.append(f'{element["x"]} {element["y"]} {element["width"]} {element["height"]} re {paint} Q\n')
+    return ' '.join(ops).encode()
+
+
+def _dict(entries):
+    return b'<< ' + b' '.join(entries) + b' >>'
+
+
+def _object(number, body):
+    return b'%d 0 obj\n%s\nendobj\n' % (number, body)
+
+
+def _stream(entries, data, compress=True):
+    if compress:
+        data = zlib.compress(data)
+        entries = entries + [b'/Filter /FlateDecode']
+    return _dict(entries + [b'/Length %d' % len(data)]) + b'\nstream\n' + data + b'\nendstream'
+
+
+class UnicodeSubset:
+    # The characters of a certificate's fields WinAnsi lacks, given one byte
+    # codes in a subset of CERTIFICATE_FONT embedded in that certificate
+    def __init__(self, face, texts):
+        self.face = face
+        chars = sorted({c for text in texts for c in text})[:255]
+        self.codes = {c: i + 1 for i, c in enumerate(chars)}
+        missing = ''.join(c for c in chars if ord(c) not in face.charToGlyph)
+        if missing:
+            logger.warning('The certificate font has no glyph for %r', missing)
+
+    def encode(self, text):
+        return bytes(self.codes.get(c, 0) for c in text)
+
+    def width(self, text, size):
+        return sum(self.face.charWidths.get(ord(c), self.face.defaultWidth) for c in text) * size / 1000
+
+    def objects(self, number):
+        # Font, descriptor, font file and ToUnicode map, numbered from number
+        face, chars = self.face, [0] + [ord(c) for c in self.codes]
+        name = b'AAAAAA+' + face.name
+        data = face.makeSubset(chars)
+        widths = b' '.join(b'%d' % round(face.charWidths.get(c, face.defaultWidth)) for c in chars)
+        return {
+            number: _dict([
+                b'/Type /Font /Subtype /TrueType /BaseFont /%s /FirstChar 0 /LastChar %d' % (name, len(chars) - 1),
+                b'/Widths [%s] /FontDescriptor %d 0 R /ToUnicode %d 0 R' % (widths, number + 1, number + 3),
+            ]),
+            number + 1: _dict([
+                b'/Type /FontDescriptor /FontName /%s /Flags %d' % (name, face.flags),
+                b'/FontBBox [%s]' % b' '.join(b'%d' % round(v) for v in face.bbox),
+                b'/ItalicAngle %d /Ascent %d /Descent %d' % (face.italicAngle, round(face.ascent), round(face.descent)),
+                b'/CapHeight %d /StemV %d /FontFile2 %d 0 R' % (round(face.capHeight), round(face.stemV), number + 2),
+            ]),
+            number + 2: _stream([b'/Length1 %d' % len(data)], data),
+            number + 3: _stream([], makeToUnicodeCMap(name.decode(), chars).encode()),
+        }
+
+
+_faces = {}
+
+
+def _face(path):
+    if path not in _faces:
+        _faces[path] = TTFontFile(path)
+    return _faces[path]
+
+
+class StaticLayer:
+    # Serialized catalog, fonts, background form and logo. The page and its
+    # content stream are left out, a certificate may embed a font subset the
+    # page has to list, so they and that font come last.
+    def __init__(self, layout, logo_path='', font_path=''):
+        validate_layout(layout)
+        self.fields = layout.get('fields', [])
+        self.face = _face(font_path) if font_path else None
+        fonts = {font: 5 + i for i, font in enumerate(FONTS)}
+        self.fonts = [b'/%s %d 0 R' % (FONT_RESOURCES[f].encode(), n) for f, n in fonts.items()]
+        objects = {}
+        number = 5 + len(FONTS)
+        form_resources = [b'/Font ' + _dict(self.fonts)]
+        has_logo = bool(logo_path) and any(e['type'] == 'logo' for e in layout.get('background', []))
+        if has_logo:
+            form_resources.append(b'/XObject << /Logo %d 0 R >>' % number)
+            objects.update(self._logo(number, logo_path))
+            number += len(objects)
+        self.content_number = number
+        width, height = PAGE_SIZE
+        objects[1] = b'<< /Type /Catalog /Pages 2 0 R >>'
+        objects[2] = b'<< /Type /Pages /Kids [3 0 R] /Count 1 >>'
+        objects[4] = _stream(
+            [b'/Type /XObject /Subtype /Form /BBox [0 0 %d %d]' % (width, height), b'/Resources ' + _dict(form_resources)],
+            b''.join(_background(element, has_logo) for element in layout.get('background', [])),
+        )
+        for font, n in fonts.items():
+            objects[n] = b'<< /Type /Font /Subtype /Type1 /BaseFont /%s /Encoding /WinAnsiEncoding >>' % font.encode()
+        data, self.offsets = [b'%PDF-1.4\n%\xe2\xe3\xcf\xd3\n'], {}
+        size = len(data[0])
+        for n in sorted(objects):
+            self.offsets[n] = size
+            data.append(_object(n, objects[n]))
+            size += len(data[-1])
+        self.data = b''.join(data)
+
+    @staticmethod
+    def _logo(number, logo_path):
+        with Image.open(logo_path) as image:
+            image = image.convert('RGBA')
+        entries = [b'/Type /XObject /Subtype /Image /Width %d /Height %d /BitsPerComponent 8' % image.size]
+        alpha = image.getchannel('A')
+        if alpha.getextrema() == (255, 255):
+            return {number: _stream(entries + [b'/ColorSpace /DeviceRGB'], image.convert('RGB').tobytes())}
+        return {
+            number: _stream(entries + [b'/ColorSpace /DeviceRGB /SMask %d 0 R' % (number + 1)], image.convert('RGB').tobytes()),
+            number + 1: _stream(entries + [b'/ColorSpace /DeviceGray'], alpha.tobytes()),
+        }
+
+    def render(self, values):
+        texts = [field['text'].format_map(values) for field in self.fields]
+        unicode = [text for text in texts if not _winansi(text)]
+        subset = UnicodeSubset(self.face, unicode) if self.face and unicode else None
+        fonts, width, height = self.fonts, *PAGE_SIZE
+        objects = {self.content_number: _stream([], b'q /Background Do Q\n' + b''.join(
+            _text(field, text, subset) for field, text in zip(self.fields, texts)
+        ), compress=False)}
+        if subset is not None:
+            fonts = fonts + [b'/FU %d 0 R' % (self.content_number + 1)]
+            objects.update(subset.objects(self.content_number + 1))
+        objects[3] = _dict([
+            b'/Type /Page /Parent 2 0 R /MediaBox [0 0 %d %d]' % (width, height),
+            b'/Resources ' + _dict([b'/Font ' + _dict(fonts), b'/XObject << /Background 4 0 R >>']),
+            b'/Contents %d 0 R' % self.content_number,
+        ])
+        data, offsets = [self.data], dict(self.offsets)
+        size = len(self.data)
+        for n in sorted(objects):
+            offsets[n] = size
+            data.append(_object(n, objects[n]))
+            size += len(data[-1])
+        count = max(offsets) + 1
+        xref = b'xref\n0 %d\n0000000000 65535 f \n' % count
+        xref += b''.join(b'%010d 00000 n \n' % offsets[n] for n in range(1, count))
+        trailer = b'trailer\n<< /Size %d /Root 1 0 R >>\nstartxref\n%d\n%%%%EOF\n' % (count, size)
+        return b''.join(data) + xref + trailer
+
+
+_layers = OrderedDict()
+
+
+def static_layer(spec):
+    # Compiled on first use in each process and kept until the template changes version
+    layer = _layers.get(spec.key)
+    if layer is None:
+        layer = _layers[spec.key] = StaticLayer(spec.layout, spec.logo_path, spec.font_path)
+        while len(_layers) > MAX_LAYERS:
+            _layers.popitem(last=False)
+    else:
+        _layers.move_to_end(spec.key)
+    return layer
+
+
+def template_spec(template):
+    if template is None:
+        return DEFAULT_SPEC
+    logo_path = template.logo.path if template.logo else ''
+    return TemplateSpec((template.pk, template.version), template.layout or DEFAULT_LAYOUT, logo_path, CERTIFICATE_FONT)
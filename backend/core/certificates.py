@@ -0,0 +1,155 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.crypto import salted_hmac
+
+from .certificate_templates import DEFAULT_SPEC, static_layer, template_spec
+from .email_utils import build_outbox_entry
+from .models import Certificate, CertificateJob, CertificateTemplate, Course, EmailOutbox, Enrollment
+
+logger = logging.getLogger(__name__)
+
+# Certificates are issued by `manage.py issue_certificates`, which renders the
+# PDFs in a process pool and saves files, rows and emails one chunk at a time.
+# Each pool process compiles a template's static layer once, see certificate_templates.
+CERTIFICATE_CHUNK_SIZE = getattr(settings, 'CERTIFICATE_CHUNK_SIZE', 200)
+# A running job whose worker has not finished a chunk for this long is presumed dead
+CERTIFICATE_JOB_LEASE_SECONDS = getattr(settings, 'CERTIFICATE_JOB_LEASE_SECONDS', 600)
+
+
+def render_certificate_pdf(name, course_title, issued_on, verification='', spec=DEFAULT_SPEC):
+    # Only plain arguments and no database access, so it can run in a pool process
+    return static_layer(spec).render({'name': name, 'course': course_title, 'date': issued_on, 'verification': verification})
+
+
+def verification_code(cert):
+    # Derived from the certificate, so it can be checked without storing it
+    digest = salted_hmac('core.certificate', f'{cert.pk}:{cert.user_id}:{cert.course_id}').hexdigest()
+    return f'{cert.pk}-{digest[:10].upper()}'
+
+
+def course_template(course):
+    if course.certificate_template_id:
+        return course.certificate_template
+    return CertificateTemplate.objects.filter(is_default=True).order_by('-id').first()
+
+
+def queue_certificates(course, user_ids, requested_by=None):
+    # Learners already in a queued or running job of the course are left to it, so
+    # double clicks and retries never render (and save over) one certificate twice.
+    # When all of them are, that job is returned instead of a new one.
+    user_ids = list(dict.fromkeys(user_ids))
+    with transaction.atomic():
+        # Jobs of one course are queued one at a time
+        list(Course.objects.select_for_update().filter(pk=course.pk).values_list('pk'))
+        open_jobs = list(CertificateJob.objects.filter(course=course, status__in=('queued', 'running')).order_by('-id'))
+        pending = {user_id for job in open_jobs for user_id in job.user_ids}
+        remaining = [user_id for user_id in user_ids if user_id not in pending]
+        if user_ids and not remaining:
+            return next(job for job in open_jobs if set(job.user_ids) & set(user_ids))
+        return CertificateJob.objects.create(course=course, requested_by=requested_by, user_ids=remaining, total=len(remaining))
+
+
+def completed_students(course):
+    # Completed enrollments that have no certificate file yet
+    issued = Certificate.objects.filter(course=course).exclude(file='').exclude(file=None).values('user_id')
+    return list(
+        Enrollment.objects.filter(course=course, completed=True)
+        .exclude(student_id__in=issued)
+        .order_by('student_id')
+        .values_list('student_id', flat=True)
+        .distinct()
+    )
+
+
+def _claim_job():
+    # The conditional update lets several workers poll the same table. Counters start
+    # over on a reclaimed job, certificates already saved are counted again as issued.
+    now = timezone.now()
+    claimable = Q(status='queued') | Q(status='running', heartbeat_at__lt=now - timedelta(seconds=CERTIFICATE_JOB_LEASE_SECONDS))
+    for job_id in CertificateJob.objects.filter(claimable).order_by('id').values_list('id', flat=True)[:10]:
+        if CertificateJob.objects.filter(claimable, pk=job_id).update(
+            status='running', started_at=now, heartbeat_at=now, issued=0, failed=0,
+        ):
+            return CertificateJob.objects.select_related('course__certificate_template').get(pk=job_id)
+    return None
+
+
+def _issue_chunk(job, user_ids, pool):
+    # Returns (issued, failed). Students that already have their certificate count as issued.
+    course = job.course
+    users = {user.id: user for user in get_user_model().objects.filter(id__in=user_ids)}
+    existing = {}
+    for cert in Certificate.objects.filter(course=course, user_id__in=users).order_by('-id'):
+        existing[cert.user_id] = cert
+    Certificate.objects.bulk_create([Certificate(user_id=user_id, course=course) for user_id in users if user_id not in existing])
+    certs = {}
+    for cert in Certificate.objects.filter(course=course, user_id__in=users).order_by('-id'):
+        certs[cert.user_id] = cert
+    pending = [certs[user_id] for user_id in users if not certs[user_id].file]
+    names = {cert.user_id: users[cert.user_id].get_full_name() or users[cert.user_id].email for cert in pending}
+    spec = template_spec(course_template(course))
+    futures = [
+        (cert, pool.submit(
+            render_certificate_pdf, names[cert.user_id], course.title,
+            timezone.localdate(cert.issued_at).isoformat(), verification_code(cert), spec,
+        ))
+        for cert in pending
+    ]
+    saved, emails, failed = [], [], len(user_ids) - len(users)
+    for cert, future in futures:
+        try:
+            pdf = future.result()
+        except Exception:
+            logger.exception('Rendering the certificate of user %s for course %s failed', cert.user_id, course.id)
+            failed += 1
+            continue
+        # A fixed name, and a file left by an attempt that died before its commit is replaced
+        name = cert.file.field.generate_filename(cert, f'certificate_{cert.user_id}_{course.id}.pdf')
+        cert.file.storage.delete(name)
+        cert.file.save(name.rpartition('/')[2], ContentFile(pdf), save=False)
+        saved.append(cert)
+        name = names[cert.user_id]
+        emails.append(build_outbox_entry(
+            f'Your Certificate for {course.title}',
+            f'Congratulations {name}!\n\nAttached is your certificate for completing {course.title}.',
+            [users[cert.user_id].email],
+            attachments=[(cert.file.name, pdf, 'application/pdf')],
+        ))
+    with transaction.atomic():
+        Certificate.objects.bulk_update(saved, ['file'])
+        EmailOutbox.objects.bulk_create([entry for entry in emails if entry.recipients and entry.recipients[0]])
+        issued = len(user_ids) - failed
+        CertificateJob.objects.filter(pk=job.pk).update(
+            issued=F('issued') + issued, failed=F('failed') + failed, heartbeat_at=timezone.now(),
+        )
+    return issued, failed
+
+
+def run_job(job, pool, chunk_size=CERTIFICATE_CHUNK_SIZE):
+    try:
+        for start in range(0, len(job.user_ids), chunk_size):
+            _issue_chunk(job, job.user_ids[start:start + chunk_size], pool)
+    except Exception as e:
+        logger.exception('Certificate job %s failed', job.pk)
+        CertificateJob.objects.filter(pk=job.pk).update(status='failed', error=str(e), finished_at=timezone.now())
+        return
+    CertificateJob.objects.filter(pk=job.pk).update(status='done', finished_at=timezone.now())
+
+
+# Run queued jobs oldest first, returns the number run
+def process_certificate_jobs(pool, max_jobs=None, chunk_size=CERTIFICATE_CHUNK_SIZE):
+    processed = 0
+    while max_jobs is None or processed < max_jobs:
+        job = _claim_job()
+        if job is None:
+            break
+        run_job(job, pool, chunk_size)
+        processed += 1
+    return processed
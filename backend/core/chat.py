@@ -0,0 +1,82 @@
+import re
+
+from django.conf import settings
+from django.db import transaction
+
+from .models import ChatMessage, ChatSession
+
+# Tokens are estimated at four characters each, close enough for budgeting.
+# History sent upstream stays under CHAT_CONTEXT_TOKENS however long the chat
+# runs: older turns are folded into a summary of at most CHAT_SUMMARY_TOKENS
+# and recent turns fill the rest.
+CHAT_CONTEXT_TOKENS = getattr(settings, 'CHAT_CONTEXT_TOKENS', 2000)
+CHAT_SUMMARY_TOKENS = getattr(settings, 'CHAT_SUMMARY_TOKENS', 400)
+SUMMARY_LINE_CHARS = 200
+SENTENCE_END_RE = re.compile(r'(?<=[.!?])\s')
+SPEAKERS = {'user': 'Learner', 'model': 'Tutor'}
+
+
+def estimate_tokens(text):
+    return max(1, len(text) // 4)
+
+
+def _gist(text):
+    # First sentence of a message, clipped
+    first = SENTENCE_END_RE.split(' '.join(text.split()), 1)[0]
+    return first if len(first) <= SUMMARY_LINE_CHARS else first[:SUMMARY_LINE_CHARS - 1] + '…'
+
+
+def open_session(user, session_id):
+    # 'new' starts a session, otherwise only the user's own sessions are found
+    if session_id == 'new':
+        return ChatSession.objects.create(user=user)
+    try:
+        return ChatSession.objects.get(pk=int(session_id), user=user)
+    except (ValueError, ChatSession.DoesNotExist):
+        return None
+
+
+def build_history(session):
+    # (role, text) turns to send before the new prompt
+    history = []
+    if session.summary:
+        history += [('user', f'Summary of our conversation so far:\n{session.summary}'), ('model', 'Understood.')]
+    history += session.messages.filter(id__gt=session.summarized_until).order_by('id').values_list('role', 'text')
+    return history
+
+
+def compact(session):
+    # Keep the newest messages that fit the budget, fold the rest into the summary
+    messages = list(
+        session.messages.filter(id__gt=session.summarized_until).order_by('-id').values_list('id', 'role', 'text', 'tokens')
+    )
+    used = 0
+    for index, (_, _, _, tokens) in enumerate(messages):
+        if used + tokens > CHAT_CONTEXT_TOKENS - CHAT_SUMMARY_TOKENS:
+            break
+        used += tokens
+    else:
+        return
+    folded = messages[index:][::-1]
+    lines = session.summary.splitlines() + [f'{SPEAKERS[role]}: {_gist(text)}' for _, role, text, _ in folded]
+    # Rolling: the oldest lines drop out once the summary is over budget
+    kept, chars = [], 0
+    for line in reversed(lines):
+        chars += len(line) + 1
+        if chars // 4 > CHAT_SUMMARY_TOKENS:
+            break
+        kept.append(line)
+    session.summary = '\n'.join(reversed(kept))
+    session.summarized_until = folded[-1][0]
+
+
+def record_turn(session, prompt, answer):
+    with transaction.atomic():
+        ChatMessage.objects.bulk_create([
+            ChatMessage(session=session, role='user', text=prompt, tokens=estimate_tokens(prompt)),
+            ChatMessage(session=session, role='model', text=answer, tokens=estimate_tokens(answer)),
+        ])
+        if not session.title:
+            session.title = _gist(prompt)[:200]
+        compact(session)
+        session.save(update_fields=['title', 'summary', 'summarized_until', 'updated_at'])
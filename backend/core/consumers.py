@@ -1,8 +1,14 @@
+import asyncio
 import json
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
 from django.contrib.auth import get_user_model
 from .models import Notification
+from asgiref.sync import sync_to_async
+from .admission import LeasedStream, Rejected, acquire_slot, check_rate, client_identity
+from .chat import build_history, open_session, record_turn
+from .retrieval import ai_grounding
+from .gemini_utils import GeminiError, stream_gemini_response
 
 class NotificationConsumer(AsyncWebsocketConsumer):
     async def connect(self):
@@ -27,4 +33,71 @@ class NotificationConsumer(AsyncWebsocketConsumer):
 
     @database_sync_to_async
     def get_unread_notifications(self):
-        return list(Notification.objects.filter(user_id=self.user_id, read=False).values()) 
\ No newline at end of file
+        return list(Notification.objects.filter(user_id=self.user_id, read=False).values())
+
+class LearnWithAIConsumer(AsyncWebsocketConsumer):
+    # Client sends {"prompt": ..., "lang": ..., "session": ...}, answers stream back as "chunk" messages then "done".
+    # "session" is optional: "new" or the id of one of the user's chat sessions.
+    async def connect(self):
+        self.user = self.scope['user']
+        self.task = None
+        await self.accept()
+
+    async def disconnect(self, close_code):
+        if self.task:
+            self.task.cancel()
+
+    async def receive(self, text_data):
+        try:
+            message = json.loads(text_data)
+        except ValueError:
+            message = {}
+        prompt = message.get('prompt') if isinstance(message, dict) else None
+        if not prompt:
+            await self.error('No prompt provided.')
+            return
+        language = message.get('lang') or getattr(self.user, 'language', 'en')
+        # A new prompt replaces the one still streaming
+        if self.task:
+            self.task.cancel()
+        self.task = asyncio.create_task(self.answer(prompt, language, message.get('session')))
+
+    async def error(self, message, **extra):
+        await self.send(text_data=json.dumps({'type': 'error', 'error': message, **extra}))
+
+    async def answer(self, prompt, language, session_id=None):
+        session, history = None, ()
+        if session_id:
+            if not self.user.is_authenticated:
+                await self.error('Sign in to keep a conversation.')
+                return
+            session = await database_sync_to_async(open_session)(self.user, str(session_id))
+            if session is None:
+                await self.error('Chat session not found.')
+                return
+            history = await database_sync_to_async(build_history)(session)
+            await self.send(text_data=json.dumps({'type': 'session', 'session': session.id}))
+        context = await database_sync_to_async(ai_grounding)(self.user, prompt)
+        client = self.scope.get('client') or ('', 0)
+        identity, rate = client_identity(self.user, client[0])
+        try:
+            await sync_to_async(check_rate, thread_sensitive=False)(identity, rate)
+            lease = await sync_to_async(acquire_slot, thread_sensitive=False)()
+        except Rejected as rejected:
+            await self.error(str(rejected), retry_after=rejected.retry_after)
+            return
+        parts = []
+        # The stream holds the slot and gives it back however it ends, cancellation included
+        stream = LeasedStream(stream_gemini_response(prompt, language=language, history=history, context=context), lease)
+        try:
+            async for text in stream:
+                parts.append(text)
+                await self.send(text_data=json.dumps({'type': 'chunk', 'text': text}))
+        except GeminiError as e:
+            await self.error(str(e))
+            return
+        finally:
+            await sync_to_async(stream.close, thread_sensitive=False)()
+        if session:
+            await database_sync_to_async(record_turn)(session, prompt, ''.join(parts))
+        await self.send(text_data=json.dumps({'type': 'done'}))
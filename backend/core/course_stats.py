@@ -0,0 +1,60 @@
+from django.db import IntegrityError, transaction
+from django.db.models import Count, F, FloatField, Sum
+from django.db.models.functions import Cast, Greatest
+
+from .models import Course, CourseRating, Enrollment
+
+
+def adjust_students_count(course_id, delta):
+    Course.objects.filter(pk=course_id).update(students_count=Greatest(F('students_count') + delta, 0))
+
+
+def adjust_rating(course_id, delta_sum, delta_count):
+    # One UPDATE: every right hand side reads the pre-update row, so the average
+    # is computed from the same sum and count that are being written
+    new_sum = F('rating_sum') + delta_sum
+    new_count = F('rating_count') + delta_count
+    Course.objects.filter(pk=course_id).update(
+        rating_sum=new_sum,
+        rating_count=new_count,
+        rating=Cast(new_sum, FloatField()) / Greatest(new_count, 1),
+    )
+
+
+def rate_course(user, course, score):
+    # Two first ratings by the same user can race on the unique row: the loser's
+    # insert fails, and it tries again as an update of the row the winner wrote
+    for attempt in range(2):
+        try:
+            with transaction.atomic():
+                rating = CourseRating.objects.select_for_update().filter(user=user, course=course).first()
+                if rating is None:
+                    rating = CourseRating.objects.create(user=user, course=course, score=score)
+                    adjust_rating(course.id, score, 1)
+                elif rating.score != score:
+                    adjust_rating(course.id, score - rating.score, 0)
+                    rating.score = score
+                    rating.save(update_fields=['score', 'updated_at'])
+            return rating
+        except IntegrityError:
+            if attempt:
+                raise
+
+
+# Recompute every course's counters in one grouped pass per table, for drift
+# left by bulk operations or edits that bypass the signal handlers
+def recompute_course_stats(batch_size=1000, course_model=Course, enrollment_model=Enrollment, rating_model=CourseRating):
+    students = dict(enrollment_model.objects.values_list('course_id').annotate(n=Count('id')).order_by())
+    ratings = {
+        course_id: (total, n)
+        for course_id, total, n in rating_model.objects.values_list('course_id').annotate(s=Sum('score'), n=Count('id')).order_by()
+    }
+    changed = []
+    for course in course_model.objects.only('id', 'students_count', 'rating', 'rating_sum', 'rating_count').iterator(chunk_size=batch_size):
+        total, n = ratings.get(course.id, (0, 0))
+        values = (students.get(course.id, 0), total, n, total / n if n else 0)
+        if values != (course.students_count, course.rating_sum, course.rating_count, course.rating):
+            course.students_count, course.rating_sum, course.rating_count, course.rating = values
+            changed.append(course)
+    course_model.objects.bulk_update(changed, ['students_count', 'rating_sum', 'rating_count', 'rating'], batch_size=batch_size)
+    return len(changed)
@@ -0,0 +1,140 @@
+import base64
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+
+from .models import EmailOutbox
+
+logger = logging.getLogger(__name__)
+
+OUTBOX_BATCH_SIZE = getattr(settings, 'EMAIL_OUTBOX_BATCH_SIZE', 200)
+OUTBOX_MAX_ATTEMPTS = getattr(settings, 'EMAIL_OUTBOX_MAX_ATTEMPTS', 6)
+OUTBOX_BACKOFF_SECONDS = getattr(settings, 'EMAIL_OUTBOX_BACKOFF_SECONDS', 30)
+OUTBOX_MAX_BACKOFF_SECONDS = getattr(settings, 'EMAIL_OUTBOX_MAX_BACKOFF_SECONDS', 3600)
+# Claimed rows are leased for as long as sending them can take, so no other worker
+# picks them up mid-batch. Without EMAIL_TIMEOUT an SMTP call can block for good,
+# a finite lease then assumes this many seconds per call.
+SEND_TIMEOUT = getattr(settings, 'EMAIL_TIMEOUT', None) or 30
+
+
+def build_outbox_entry(subject, body, recipient_list, content_subtype='plain', attachments=None):
+    # Unsaved row, so callers fanning out to many recipients can bulk_create them
+    return EmailOutbox(
+        subject=subject[:255],
+        body=body,
+        content_subtype=content_subtype,
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        recipients=list(recipient_list),
+        attachments=[
+            [name, base64.b64encode(content).decode('ascii'), mimetype]
+            for name, content, mimetype in (attachments or [])
+        ],
+    )
+
+
+def queue_email(subject, body, recipient_list, content_subtype='plain', attachments=None):
+    # Written on the caller's connection, so the row commits or rolls back with the request
+    recipient_list = [r for r in recipient_list if r]
+    if not recipient_list:
+        return None
+    entry = build_outbox_entry(subject, body, recipient_list, content_subtype, attachments)
+    entry.save()
+    return entry
+
+
+def backoff_delay(attempts):
+    # Exponential backoff with full jitter, capped
+    ceiling = min(OUTBOX_MAX_BACKOFF_SECONDS, OUTBOX_BACKOFF_SECONDS * (2 ** max(attempts - 1, 0)))
+    return timedelta(seconds=random.uniform(ceiling / 2, ceiling))
+
+
+def _to_message(entry, connection):
+    email = EmailMessage(entry.subject, entry.body, entry.from_email, entry.recipients, connection=connection)
+    email.content_subtype = entry.content_subtype
+    for name, content, mimetype in entry.attachments:
+        email.attach(name, base64.b64decode(content), mimetype)
+    return email
+
+
+def lease_duration(count):
+    # Opening the connection, the batch send and, when that fails, one send per message
+    return timedelta(seconds=max(OUTBOX_BACKOFF_SECONDS, SEND_TIMEOUT * (2 * count + 2)))
+
+
+def _claim_batch(batch_size):
+    now = timezone.now()
+    with transaction.atomic():
+        qs = EmailOutbox.objects.filter(status='pending', next_attempt_at__lte=now).order_by('next_attempt_at', 'id')
+        if transaction.get_connection().features.has_select_for_update_skip_locked:
+            qs = qs.select_for_update(skip_locked=True)
+        batch = list(qs[:batch_size])
+        if not batch:
+            return []
+        # Lease the rows so a second worker does not pick them up while we are sending.
+        # Without skip_locked (SQLite) two workers can read the same rows, the update
+        # only takes those still due and the lease time tells which ones we got.
+        lease_until = now + lease_duration(len(batch))
+        ids = [e.id for e in batch]
+        leased = EmailOutbox.objects.filter(id__in=ids, status='pending', next_attempt_at__lte=now).update(
+            next_attempt_at=lease_until
+        )
+        if leased < len(batch):
+            ours = set(EmailOutbox.objects.filter(id__in=ids, next_attempt_at=lease_until).values_list('id', flat=True))
+            batch = [e for e in batch if e.id in ours]
+    return batch
+
+
+def _record_failures(failed):
+    now = timezone.now()
+    for entry, error in failed:
+        entry.attempts += 1
+        entry.last_error = error
+        if entry.attempts >= OUTBOX_MAX_ATTEMPTS:
+            entry.status = 'dead'
+            logger.error("Outbox email %s moved to dead letter after %s attempts: %s", entry.id, entry.attempts, error)
+        else:
+            entry.next_attempt_at = now + backoff_delay(entry.attempts)
+    EmailOutbox.objects.bulk_update([e for e, _ in failed], ['attempts', 'last_error', 'status', 'next_attempt_at'])
+
+
+# Send one batch of queued email over a single connection, returns (sent, failed)
+def drain_outbox(batch_size=OUTBOX_BATCH_SIZE):
+    batch = _claim_batch(batch_size)
+    if not batch:
+        return 0, 0
+    sent, failed = [], []
+    connection = get_connection(fail_silently=False)
+    try:
+        connection.open()
+        messages = [_to_message(entry, connection) for entry in batch]
+        try:
+            connection.send_messages(messages)
+            sent = batch
+        except Exception:
+            # Retry one by one on the same connection to isolate the bad message(s);
+            # delivery is at-least-once, a message sent before the error may go out twice
+            for entry, message in zip(batch, messages):
+                try:
+                    connection.send_messages([message])
+                    sent.append(entry)
+                except Exception as e:
+                    failed.append((entry, str(e)))
+    except Exception as e:
+        # Could not reach the mail server at all
+        sent = []
+        failed = [(entry, str(e)) for entry in batch]
+    finally:
+        try:
+            connection.close()
+        except Exception:
+            pass
+    if sent:
+        EmailOutbox.objects.filter(id__in=[e.id for e in sent]).update(status='sent', sent_at=timezone.now())
+    if failed:
+        _record_failures(failed)
+    return len(sent), len(failed)
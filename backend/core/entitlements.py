@@ -0,0 +1,82 @@
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+from .catalog_cache import cache_timeout
+from .models import Course, Enrollment, Payment
+
+# Invalidation on Payment, Enrollment and Course saves keeps entries current, the
+# timeout is only a safety net for writes that bypass the signals. Without a shared
+# cache, invalidations made by other processes (the payment webhook worker) never
+# arrive, so entries only live for LOCAL_CACHE_TIMEOUT.
+ENTITLEMENTS_TIMEOUT = cache_timeout(getattr(settings, 'ENTITLEMENTS_TIMEOUT', 60 * 60))
+
+
+def _cache_key(user_id):
+    return f'entitlements:{user_id}'
+
+
+class Entitlements:
+    # The course ids a user may access, by role, so access checks are set lookups
+    def __init__(self, instructs=(), enrolled=(), active=(), paid=()):
+        self.instructs = frozenset(instructs)
+        self.enrolled = frozenset(enrolled)
+        # Enrollments that are not completed yet
+        self.active = frozenset(active)
+        self.paid = frozenset(paid)
+        self.courses = self.instructs | self.enrolled
+
+    def role(self, course_id):
+        if course_id in self.instructs:
+            return 'instructor'
+        if course_id in self.enrolled:
+            return 'student'
+        return None
+
+    def __getstate__(self):
+        return (self.instructs, self.enrolled, self.active, self.paid)
+
+    def __setstate__(self, state):
+        self.__init__(*state)
+
+
+def load_entitlements(user_id):
+    enrollments = list(Enrollment.objects.filter(student_id=user_id).values_list('course_id', 'completed'))
+    return Entitlements(
+        instructs=Course.objects.filter(instructor_id=user_id).values_list('id', flat=True),
+        enrolled=[course_id for course_id, _ in enrollments],
+        active=[course_id for course_id, completed in enrollments if not completed],
+        paid=Payment.objects.filter(user_id=user_id, status='paid').values_list('course_id', flat=True),
+    )
+
+
+def get_entitlements(user):
+    if not user.is_authenticated:
+        return Entitlements()
+    # Memoised on the user object for the rest of the request
+    entitlements = getattr(user, '_entitlements', None)
+    if entitlements is None:
+        key = _cache_key(user.pk)
+        entitlements = cache.get(key)
+        if entitlements is None:
+            entitlements = load_entitlements(user.pk)
+            cache.set(key, entitlements, ENTITLEMENTS_TIMEOUT)
+        user._entitlements = entitlements
+    return entitlements
+
+
+def invalidate_entitlements(*users):
+    # Users or user ids. User objects at hand also drop what is memoised on them.
+    user_ids = []
+    for user in users:
+        if hasattr(user, 'pk'):
+            user.__dict__.pop('_entitlements', None)
+            user = user.pk
+        user_ids.append(user)
+    keys = [_cache_key(user_id) for user_id in user_ids if user_id]
+    cache.delete_many(keys)
+    if transaction.get_connection().in_atomic_block:
+        # Other requests still read the old rows until the commit and may cache them again meanwhile
+        transaction.on_commit(partial(cache.delete_many, keys))
@@ -1,32 +1,74 @@
-import requests
-from django.conf import settings
+import hashlib
 
-GEMINI_API_KEY = settings.GEMINI_API_KEY
-GEMINI_API_URL = "https://generativelanguage.googleapis.com/v1/models/{model}:generateContent?key={api_key}"
-GEMINI_MODEL = "gemini-2.0-flash"  # Corrected model name, no 'models/' prefix
+from asgiref.sync import sync_to_async
 
-def get_gemini_response(prompt):
-    if not GEMINI_API_KEY:
-        return {"error": "GEMINI_API_KEY not set in environment."}
+from .ai_cache import get_cached_response, prompt_cache_key, set_cached_response, single_flight
+from .llm_backends import LLMError, get_backend
 
+# Kept under its old name, callers catch it around streamed answers
+GeminiError = LLMError
+
+
+# history is a list of earlier (role, text) turns, role being 'user' or 'model',
+# context a list of lesson passages from core.retrieval to ground the answer in
+def get_gemini_response(prompt, language='en', use_cache=True, history=(), context=()):
+    # Answers that depend on a conversation are not shared
+    if not use_cache or history:
+        return _request_gemini_response(prompt, history, context)
+    language = _cache_tag(language, context)
+    # Learners keep asking the same questions, answer those from the cache
+    cached = get_cached_response(prompt, language)
+    if cached is not None:
+        return dict(cached, cached=True)
+
+    def fetch():
+        result = _request_gemini_response(prompt, context=context)
+        set_cached_response(prompt, result, language)
+        return result
+
+    # A class asking the same thing at once costs one upstream call
+    return single_flight(prompt_cache_key(prompt, language), fetch)
+
+def _cache_tag(language, context):
+    # Learners who can see different lessons get different excerpts, so the excerpts are part of the key
+    if not context:
+        return language
+    digest = hashlib.sha1("\x00".join(passage["text"] for passage in context).encode()).hexdigest()[:16]
+    return f"{language}:{digest}"
+
+def _excerpts(context):
+    return "\n\n".join(
+        f"[{number}] {' - '.join(filter(None, (passage['course_title'], passage['lesson_title'])))}:\n{passage['text']}"
+        for number, passage in enumerate(context, 1)
+    )
+
+def _messages(prompt, history=(), context=()):
     # Prepend tech-only instruction and ask for plain text, no markdown
     instruction = (
     )
     teaching_prompt = f"{instruction}\nUser: {str(prompt)}"
+    if context:
+        teaching_prompt = f"{instruction}\nExcerpts from our lessons, use them where they help:\n{_excerpts(context)}\nUser: {str(prompt)}"
+    return list(history) + [("user", teaching_prompt)]
 
-    url = GEMINI_API_URL.format(model=GEMINI_MODEL, api_key=GEMINI_API_KEY)
-    headers = {"Content-Type": "application/json"}
-    data = {
-        "contents": [
-            {"parts": [{"text": teaching_prompt}]}
-        ]
-    }
+def _request_gemini_response(prompt, history=(), context=()):
     try:
-        response = requests.post(url, headers=headers, json=data, timeout=15)
-        response.raise_for_status()
-        result = response.json()
         return {
-            "text": result.get("candidates", [{}])[0].get("content", {}).get("parts", [{}])[0].get("text", "")
+            "text": get_backend().complete(_messages(prompt, history, context))
         }
-    except Exception as e:
-        return {"error": str(e)} 
\ No newline at end of file
+    except LLMError as e:
+        return {"error": str(e)}
+
+async def stream_gemini_response(prompt, language='en', history=(), context=()):
+    # Yields the answer in chunks as Gemini produces them, raises GeminiError on failure
+    language = _cache_tag(language, context)
+    cached = None if history else await sync_to_async(get_cached_response)(prompt, language)
+    if cached is not None:
+        yield cached["text"]
+        return
+    parts = []
+    async for text in get_backend().stream(_messages(prompt, history, context)):
+        parts.append(text)
+        yield text
+    if not history:
+        await sync_to_async(set_cached_response)(prompt, {"text": "".join(parts)}, language) 
\ No newline at end of file
@@ -0,0 +1,129 @@
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Option, Question
+from .quiz_cache import QUIZ_CACHE_TIMEOUT, quiz_version
+
+# A quiz's answer key is compiled to arrays once per quiz version: every option
+# maps to its question and a bit, and each question has the mask of its correct
+# options. A question counts as correct when exactly those options are chosen,
+# so grading any number of attempts is a scatter of bits and one comparison.
+MAX_OPTIONS_PER_QUESTION = 64
+LOCAL_KEYS = getattr(settings, 'GRADING_LOCAL_KEYS', 256)
+
+
+class AnswerKey:
+    def __init__(self, question_ids, rows):
+        # rows are (question_id, option_id, is_correct) for every option of the quiz
+        self.question_ids = np.array(sorted(question_ids), dtype=np.int64)
+        rows = sorted(rows)
+        question_of = np.searchsorted(self.question_ids, np.array([r[0] for r in rows], dtype=np.int64))
+        bits = np.zeros(len(rows), dtype=np.uint64)
+        self.correct_masks = np.zeros(len(self.question_ids), dtype=np.uint64)
+        seen = np.zeros(len(self.question_ids), dtype=np.int64)
+        for i, (_, _, is_correct) in enumerate(rows):
+            q = question_of[i]
+            if seen[q] == MAX_OPTIONS_PER_QUESTION:
+                raise ValueError(f'Questions can have at most {MAX_OPTIONS_PER_QUESTION} options.')
+            bits[i] = np.uint64(1) << np.uint64(seen[q])
+            seen[q] += 1
+            if is_correct:
+                self.correct_masks[q] |= bits[i]
+        # Sorted by option id for lookups
+        order = np.argsort(np.array([r[1] for r in rows], dtype=np.int64), kind='stable')
+        self.option_ids = np.array([r[1] for r in rows], dtype=np.int64)[order]
+        self.option_question = question_of[order].astype(np.int64)
+        self.option_bit = bits[order]
+
+    def locate(self, option_ids):
+        # Positions into option_ids, and which of them belong to this quiz
+        option_ids = np.asarray(option_ids, dtype=np.int64)
+        if not len(self.option_ids):
+            return np.zeros(len(option_ids), dtype=np.int64), np.zeros(len(option_ids), dtype=bool)
+        positions = np.searchsorted(self.option_ids, option_ids).clip(max=len(self.option_ids) - 1)
+        return positions, self.option_ids[positions] == option_ids
+
+
+def compile_answer_key(quiz_id):
+    question_ids = Question.objects.filter(quiz_id=quiz_id).values_list('id', flat=True)
+    rows = Option.objects.filter(question__quiz_id=quiz_id).values_list('question_id', 'id', 'is_correct')
+    return AnswerKey(list(question_ids), list(rows))
+
+
+_keys = OrderedDict()
+_keys_lock = threading.Lock()
+
+
+def answer_key(quiz_id):
+    # Process memory first, then the shared cache, compiled from the database on a miss
+    cache_key = f'quiz:{quiz_id}:{quiz_version(quiz_id)}:answer_key'
+    key = _keys.get(cache_key)
+    if key is None:
+        key = cache.get(cache_key)
+        if key is None:
+            key = compile_answer_key(quiz_id)
+            cache.set(cache_key, key, QUIZ_CACHE_TIMEOUT)
+        with _keys_lock:
+            _keys[cache_key] = key
+            while len(_keys) > LOCAL_KEYS:
+                _keys.popitem(last=False)
+    return key
+
+
+def _option_id(value):
+    try:
+        option_id = int(value)
+    except (TypeError, ValueError, OverflowError):
+        raise ValueError('Answers must be option ids.')
+    # Anything past int64 could not be an option and would overflow the arrays
+    if not 0 < option_id < 2 ** 63:
+        raise ValueError('Some answers are not options of this quiz.')
+    return option_id
+
+
+def _chosen(answers):
+    # {question id: option id or [option ids]}, a flat list of option ids also works
+    values = answers.values() if isinstance(answers, dict) else [answers]
+    chosen = []
+    for value in values:
+        chosen += value if isinstance(value, (list, tuple)) else [value]
+    return [_option_id(option_id) for option_id in chosen]
+
+
+def grade_many(key, answer_sets):
+    # Returns (scores in percent, correctness matrix of attempts x key.question_ids).
+    # Options that are not part of the quiz are ignored, grade() rejects them.
+    chosen = [_chosen(answers) for answers in answer_sets]
+    attempt_of = np.repeat(np.arange(len(chosen)), [len(c) for c in chosen])
+    positions, valid = key.locate([option_id for c in chosen for option_id in c])
+    selected = np.zeros((len(chosen), len(key.question_ids)), dtype=np.uint64)
+    positions = positions[valid]
+    np.bitwise_or.at(selected, (attempt_of[valid], key.option_question[positions]), key.option_bit[positions])
+    # A question with no option marked correct (still being written) is never right,
+    # otherwise leaving it unanswered would match its empty mask
+    correct = (selected == key.correct_masks) & (key.correct_masks != 0)
+    if not len(key.question_ids):
+        return np.zeros(len(chosen)), correct
+    return np.round(correct.sum(axis=1) * 100 / len(key.question_ids), 2), correct
+
+
+def grade(quiz_id, answers):
+    # Returns (score, answers by question, correctness by question) for one attempt
+    key = answer_key(quiz_id)
+    chosen = _chosen(answers)
+    positions, valid = key.locate(chosen)
+    if not valid.all():
+        raise ValueError('Some answers are not options of this quiz.')
+    scores, correct = grade_many(key, [chosen])
+    by_question = {}
+    for option_id, q in zip(chosen, key.option_question[positions]):
+        by_question.setdefault(str(key.question_ids[q]), []).append(option_id)
+    return float(scores[0]), by_question, correctness(key, correct[0])
+
+
+def correctness(key, row):
+    return {str(question_id): bool(ok) for question_id, ok in zip(key.question_ids.tolist(), row.tolist())}
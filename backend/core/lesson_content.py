@@ -0,0 +1,74 @@
+import gzip
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+
+from .models import Lesson
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+# Lesson bodies are served by GET /api/lessons/<id>/content/ rather than in
+# lesson lists. Lesson.content_hash changes with the content, so each encoding
+# of a body is compressed once per revision and cached under the hash, and the
+# hash doubles as the strong ETag. Brotli is used when the package is installed.
+LESSON_CONTENT_CACHE_TIMEOUT = getattr(settings, 'LESSON_CONTENT_CACHE_TIMEOUT', 60 * 60 * 24)
+ENCODINGS = ('br', 'gzip') if brotli else ('gzip',)
+
+
+def content_hash(content):
+    return hashlib.sha256((content or '').encode()).hexdigest()
+
+
+def lesson_content_hash(lesson):
+    # Rows written without save() (bulk_create, update) get their hash here
+    if not lesson.content_hash:
+        lesson.content_hash = content_hash(lesson.content)
+        Lesson.objects.filter(pk=lesson.pk).update(content_hash=lesson.content_hash)
+    return lesson.content_hash
+
+
+def negotiate(accept_encoding):
+    # Best encoding we have that the client accepts, '' for the plain body
+    accepted = {}
+    for part in accept_encoding.split(','):
+        name, _, params = part.strip().partition(';')
+        try:
+            quality = float(params.strip()[2:]) if params.strip().startswith('q=') else 1.0
+        except ValueError:
+            quality = 0.0
+        accepted[name.strip().lower()] = quality
+    for encoding in ENCODINGS:
+        if accepted.get(encoding, accepted.get('*', 0)) > 0:
+            return encoding
+    return ''
+
+
+def _encode(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=11, mode=brotli.MODE_TEXT)
+    if encoding == 'gzip':
+        # mtime=0 so the bytes, like the ETag, only depend on the content
+        return gzip.compress(body, compresslevel=9, mtime=0)
+    return body
+
+
+def encoded_content(lesson, encoding=''):
+    # Returns (encoding, bytes). Compressing can make short bodies larger, those go out plain.
+    key = f'lesson:{lesson.pk}:{lesson_content_hash(lesson)}:{encoding or "identity"}'
+    cached = cache.get(key)
+    if cached is None:
+        body = (lesson.content or '').encode()
+        encoded = _encode(body, encoding)
+        cached = (encoding, encoded) if len(encoded) < len(body) else ('', body)
+        cache.set(key, cached, LESSON_CONTENT_CACHE_TIMEOUT)
+    return cached
+
+
+def etag(lesson, encoding):
+    # Strong validators, one per encoding since the bytes differ
+    digest = lesson_content_hash(lesson)[:32]
+    return f'"{digest}-{encoding}"' if encoding else f'"{digest}"'
@@ -0,0 +1,142 @@
+import asyncio
+import json
+import weakref
+
+import httpx
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.utils.module_loading import import_string
+
+from .upstream import RETRY_STATUSES, CircuitBreaker, UpstreamClient
+
+GEMINI_BASE_URL = 'https://generativelanguage.googleapis.com'
+
+
+class LLMError(Exception):
+    pass
+
+
+class LLMBackend:
+    # messages are (role, text) pairs, role being 'user' or 'model', the last one is the prompt
+    name = 'base'
+
+    def complete(self, messages):
+        raise NotImplementedError
+
+    async def stream(self, messages):
+        # Backends without streaming answer in one chunk
+        yield await asyncio.to_thread(self.complete, messages)
+
+    def metrics(self):
+        return {}
+
+
+class GeminiBackend(LLMBackend):
+    # Also talks to anything speaking the same API, such as `manage.py run_llm_stub`
+    name = 'gemini'
+
+    def __init__(self, base_url=None, api_key=None, model=None):
+        self.base_url = (base_url or getattr(settings, 'GEMINI_BASE_URL', GEMINI_BASE_URL)).rstrip('/')
+        self.api_key = settings.GEMINI_API_KEY if api_key is None else api_key
+        self.model = model or getattr(settings, 'GEMINI_MODEL', 'gemini-2.0-flash')
+        # Shared by the blocking and the streaming path, so either one seeing an outage makes both fail fast
+        self.breaker = CircuitBreaker(
+            failure_threshold=getattr(settings, 'GEMINI_BREAKER_THRESHOLD', 5),
+            reset_timeout=getattr(settings, 'GEMINI_BREAKER_RESET_SECONDS', 30),
+        )
+        self.client = UpstreamClient(
+            'Gemini',
+            max_concurrency=getattr(settings, 'GEMINI_MAX_CONCURRENCY', 8),
+            retries=getattr(settings, 'GEMINI_RETRIES', 2),
+            breaker=self.breaker,
+        )
+        # httpx clients are bound to the event loop that created them, keep one pooled client per loop
+        self.async_clients = weakref.WeakKeyDictionary()
+
+    def _url(self, method):
+        if not self.api_key and self.base_url == GEMINI_BASE_URL:
+            raise LLMError('GEMINI_API_KEY not set in environment.')
+        query = '?alt=sse&' if method == 'streamGenerateContent' else '?'
+        return f'{self.base_url}/v1/models/{self.model}:{method}{query}key={self.api_key}'
+
+    @staticmethod
+    def _body(messages):
+        return {'contents': [{'role': role, 'parts': [{'text': text}]} for role, text in messages]}
+
+    @staticmethod
+    def _text(result):
+        return result.get('candidates', [{}])[0].get('content', {}).get('parts', [{}])[0].get('text', '')
+
+    def complete(self, messages):
+        try:
+            response = self.client.post(self._url('generateContent'), json=self._body(messages))
+            response.raise_for_status()
+            return self._text(response.json())
+        except LLMError:
+            raise
+        except Exception as e:
+            raise LLMError(str(e)) from e
+
+    def async_client(self):
+        loop = asyncio.get_running_loop()
+        client = self.async_clients.get(loop)
+        if client is None:
+            client = httpx.AsyncClient(timeout=httpx.Timeout(30, connect=5))
+            self.async_clients[loop] = client
+        return client
+
+    async def stream(self, messages):
+        url = self._url('streamGenerateContent')
+        if not self.breaker.allow():
+            raise LLMError('Gemini is temporarily unavailable.')
+        try:
+            async with self.async_client().stream('POST', url, json=self._body(messages)) as response:
+                response.raise_for_status()
+                async for line in response.aiter_lines():
+                    if not line.startswith('data:'):
+                        continue
+                    text = self._text(json.loads(line[5:]))
+                    if text:
+                        yield text
+        except httpx.HTTPStatusError as e:
+            if e.response.status_code in RETRY_STATUSES:
+                self.breaker.record_failure()
+            else:
+                self.breaker.record_success()
+            raise LLMError(str(e)) from e
+        except (httpx.HTTPError, ValueError) as e:
+            self.breaker.record_failure()
+            raise LLMError(str(e)) from e
+        except BaseException:
+            # Client went away mid-stream
+            self.breaker.cancel()
+            raise
+        self.breaker.record_success()
+
+    def metrics(self):
+        return self.client.metrics()
+
+
+BACKENDS = {
+    'gemini': GeminiBackend,
+}
+_backend = None
+
+
+def get_backend():
+    # AI_BACKEND is a name from BACKENDS or the dotted path of an LLMBackend subclass
+    global _backend
+    if _backend is None:
+        name = getattr(settings, 'AI_BACKEND', 'gemini')
+        _backend = (BACKENDS[name] if name in BACKENDS else import_string(name))()
+    return _backend
+
+
+def _reset_backend(setting, **kwargs):
+    # So override_settings(AI_BACKEND=..., GEMINI_BASE_URL=...) takes effect
+    global _backend
+    if setting == 'AI_BACKEND' or setting.startswith('GEMINI_'):
+        _backend = None
+
+
+setting_changed.connect(_reset_backend)
@@ -0,0 +1,115 @@
+import io
+import math
+import os
+import tempfile
+import time
+
+from django.core.management.base import BaseCommand, CommandError
+from PIL import Image
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+from core.certificate_templates import DEFAULT_LAYOUT, PAGE_SIZE, TemplateSpec, template_spec
+from core.certificates import render_certificate_pdf
+from core.models import CertificateTemplate
+
+
+def branded_layout():
+    # Double border, a guilloche-like rosette of lines, a logo and a heading
+    background = [
+        {'type': 'rect', 'x': 20, 'y': 20, 'width': 572, 'height': 752, 'stroke': '#1f4e79', 'line_width': 6},
+        {'type': 'rect', 'x': 32, 'y': 32, 'width': 548, 'height': 728, 'stroke': '#c9a227', 'line_width': 2},
+    ]
+    for i in range(240):
+        angle = i * math.pi / 120
+        background.append({
+            'type': 'line', 'stroke': '#d9e2f3', 'line_width': 0.5,
+            'x1': 306 + 60 * math.cos(angle), 'y1': 330 + 60 * math.sin(angle),
+            'x2': 306 + 180 * math.cos(angle * 3), 'y2': 330 + 180 * math.sin(angle * 3),
+        })
+    background += [
+        {'type': 'logo', 'x': 256, 'y': 715, 'width': 100, 'height': 40},
+        {'type': 'text', 'text': 'Certificate of Completion', 'x': 306, 'y': 680, 'font': 'Times-Bold', 'size': 30, 'color': '#1f4e79'},
+        {'type': 'text', 'text': 'Hausasoft Academy', 'x': 306, 'y': 655, 'font': 'Helvetica-Oblique', 'size': 14},
+    ]
+    return {'background': background, 'fields': DEFAULT_LAYOUT['fields']}
+
+
+def write_logo(path):
+    image = Image.new('RGBA', (800, 320))
+    image.putdata([(x % 256, (x * y) % 256, y % 256, 255 if (x // 40 + y // 40) % 2 else 128) for y in range(320) for x in range(800)])
+    image.save(path)
+
+
+def _rgb(value):
+    value = value.lstrip('#')
+    return tuple(int(value[i:i + 2], 16) / 255 for i in (0, 2, 4))
+
+
+def redraw(layout, logo_path, values):
+    # Every element drawn with reportlab for each certificate, as before templates
+    buffer = io.BytesIO()
+    p = canvas.Canvas(buffer, pagesize=PAGE_SIZE)
+    for element in layout['background'] + [dict(f, text=f['text'].format_map(values)) for f in layout['fields']]:
+        kind = element.get('type', 'text')
+        if kind == 'text':
+            p.setFillColorRGB(*_rgb(element.get('color', '#000000')))
+            p.setFont(element.get('font', 'Helvetica'), element.get('size', 12))
+            p.drawCentredString(element['x'], element['y'], element['text'])
+        elif kind == 'logo':
+            p.drawImage(ImageReader(logo_path), element['x'], element['y'], element['width'], element['height'], mask='auto')
+        else:
+            p.setStrokeColorRGB(*_rgb(element.get('stroke', '#000000')))
+            p.setLineWidth(element.get('line_width', 1))
+            if kind == 'line':
+                p.line(element['x1'], element['y1'], element['x2'], element['y2'])
+            else:
+                p.rect(element['x'], element['y'], element['width'], element['height'])
+    p.showPage()
+    p.save()
+    return buffer.getvalue()
+
+
+class Command(BaseCommand):
+    help = 'Compare redrawing a whole certificate against overlaying text on the cached template layer.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--count', type=int, default=300)
+        parser.add_argument('--template', type=int, help='CertificateTemplate id, defaults to a generated branded template.')
+
+    def handle(self, *args, **options):
+        count = options['count']
+        with tempfile.TemporaryDirectory() as tmp:
+            if options['template']:
+                try:
+                    spec = template_spec(CertificateTemplate.objects.get(pk=options['template']))
+                except CertificateTemplate.DoesNotExist:
+                    raise CommandError('No such certificate template.')
+            else:
+                logo_path = os.path.join(tmp, 'logo.png')
+                write_logo(logo_path)
+                spec = TemplateSpec(('bench', time.time()), branded_layout(), logo_path)
+            values = [
+                {'name': f'Student {i}', 'course': 'Introduction to Python', 'date': '2026-01-31', 'verification': f'{i}-0123456789'}
+                for i in range(count)
+            ]
+            # Same order as render_certificate_pdf takes them
+            args = [(v['name'], v['course'], v['date'], v['verification']) for v in values]
+
+            start = time.perf_counter()
+            for v in values:
+                redraw(spec.layout, spec.logo_path, v)
+            redrawn = (time.perf_counter() - start) / count
+
+            start = time.perf_counter()
+            render_certificate_pdf(*args[0], spec=spec)
+            compiled = time.perf_counter() - start
+            start = time.perf_counter()
+            for a in args:
+                size = len(render_certificate_pdf(*a, spec=spec))
+            overlaid = (time.perf_counter() - start) / count
+
+        self.stdout.write(f'{"full redraw":<24} {redrawn * 1000:>9.3f} ms/certificate')
+        self.stdout.write(f'{"compile static layer":<24} {compiled * 1000:>9.3f} ms once per template version')
+        self.stdout.write(f'{"overlay on cached layer":<24} {overlaid * 1000:>9.3f} ms/certificate ({size} bytes)')
+        self.stdout.write(f'{"speedup":<24} {redrawn / overlaid:>9.1f}x')
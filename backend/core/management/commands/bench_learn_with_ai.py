@@ -0,0 +1,81 @@
+import random
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+import requests
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = 'Drive learn-with-ai at a fixed concurrency against a running server and report latency percentiles.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--url', default='http://127.0.0.1:8000/api', help='API root of the running server.')
+        parser.add_argument('--concurrency', type=int, default=32)
+        parser.add_argument('--requests', type=int, default=500)
+        parser.add_argument('--distinct', type=int, default=50, help='Distinct prompts; popular ones repeat, as in a class.')
+        parser.add_argument('--stream', action='store_true', help='Use the SSE endpoint and also report time to first token.')
+        parser.add_argument('--token', help='Bearer token, so the per-user rather than the anonymous rate limit applies.')
+        parser.add_argument('--timeout', type=float, default=60)
+        parser.add_argument('--seed', type=int, default=1)
+
+    def handle(self, *args, **options):
+        random.seed(options['seed'])
+        # Zipf-like popularity: the first prompt is asked far more often than the last
+        prompts = [f'Explain topic {i} in simple terms' for i in range(options['distinct'])]
+        weights = [1 / (rank + 1) for rank in range(len(prompts))]
+        asked = random.choices(prompts, weights=weights, k=options['requests'])
+        endpoint = options['url'].rstrip('/') + ('/learn-with-ai/stream/' if options['stream'] else '/learn-with-ai/')
+        headers = {'Authorization': f"Bearer {options['token']}"} if options['token'] else {}
+        local = threading.local()
+
+        def ask(prompt):
+            session = getattr(local, 'session', None)
+            if session is None:
+                session = local.session = requests.Session()
+            started = time.perf_counter()
+            first, cached = None, False
+            try:
+                response = session.get(endpoint, params={'prompt': prompt}, headers=headers,
+                                       timeout=options['timeout'], stream=options['stream'])
+                outcome = response.status_code
+                if response.ok and options['stream']:
+                    for line in response.iter_lines():
+                        if first is None and line.startswith(b'data: {"text"'):
+                            first = time.perf_counter() - started
+                        elif line.startswith(b'event: error'):
+                            outcome = 'upstream-error'
+                elif response.ok:
+                    data = response.json()
+                    cached = bool(data.get('cached'))
+                    if 'error' in data:
+                        outcome = 'upstream-error'
+            except requests.RequestException as e:
+                outcome = type(e).__name__
+            return outcome, time.perf_counter() - started, first, cached
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=options['concurrency']) as pool:
+            results = list(pool.map(ask, asked))
+        elapsed = time.perf_counter() - started
+
+        outcomes = Counter(outcome for outcome, _, _, _ in results)
+        ok = [result for result in results if result[0] == 200]
+        self.stdout.write(f"{len(results)} requests, concurrency {options['concurrency']}, {elapsed:.2f}s")
+        self.stdout.write(f'Throughput: {len(ok) / elapsed:.1f} successful requests/s')
+        self.stdout.write('Outcomes: ' + ', '.join(f'{outcome}={count}' for outcome, count in sorted(outcomes.items(), key=str)))
+        if not options['stream']:
+            self.stdout.write(f'Served from cache: {sum(1 for result in ok if result[3])}')
+        self.report('Latency', [latency for _, latency, _, _ in ok])
+        if options['stream']:
+            self.report('Time to first token', [first for _, _, first, _ in ok if first is not None])
+
+    def report(self, label, samples):
+        if not samples:
+            self.stdout.write(f'{label}: no successful samples')
+            return
+        p50, p95, p99 = np.percentile(np.array(samples) * 1000, [50, 95, 99])
+        self.stdout.write(f'{label} ms: p50={p50:.1f} p95={p95:.1f} p99={p99:.1f} max={max(samples) * 1000:.1f}')
@@ -0,0 +1,53 @@
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.test.utils import override_settings
+
+from core.models import Course, Enrollment, Lesson
+from core.notification_utils import FANOUT_CHUNK_SIZE, fan_out_lesson_release
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = 'Benchmark the lesson release fan-out at growing audience sizes. All data is rolled back.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', default='1000,5000,20000', help='Comma separated audience sizes.')
+        parser.add_argument('--chunk-size', type=int, default=FANOUT_CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        sizes = [int(s) for s in options['sizes'].split(',')]
+        self.stdout.write(f'{"students":>10} {"seconds":>10} {"us/student":>12}')
+        # Keep group sends in process so the numbers measure the fan-out, not Redis
+        with override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}):
+            for size in sizes:
+                elapsed = self.run_once(size, options['chunk_size'])
+                self.stdout.write(f'{size:>10} {elapsed:>10.3f} {elapsed / size * 1e6:>12.1f}')
+
+    def run_once(self, size, chunk_size):
+        User = get_user_model()
+        try:
+            with transaction.atomic():
+                instructor = User.objects.create(username='bench-instructor', email='bench-instructor@example.com', role='instructor')
+                course = Course.objects.bulk_create([Course(
+                    title='Bench course', description='', thumbnail='https://example.com/t.png', price=0,
+                    category='bench', level='beginner', duration='1h', instructor=instructor, status='published',
+                )])[0]
+                lesson = Lesson.objects.bulk_create([Lesson(course=course, title='Bench lesson', order=1)])[0]
+                students = User.objects.bulk_create([
+                    User(username=f'bench-{i}', email=f'bench-{i}@example.com', first_name=f'Student {i}')
+                    for i in range(size)
+                ], batch_size=2000)
+                Enrollment.objects.bulk_create([Enrollment(student=s, course=course) for s in students], batch_size=2000)
+                start = time.perf_counter()
+                fan_out_lesson_release(lesson, chunk_size=chunk_size)
+                elapsed = time.perf_counter() - start
+                raise Rollback
+        except Rollback:
+            pass
+        return elapsed
@@ -0,0 +1,20 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.retrieval import RETRIEVAL_INDEX_DIR, build_index
+
+
+class Command(BaseCommand):
+    help = 'Build or refresh the lesson retrieval index used to ground AI answers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--full', action='store_true', help='Re-tokenize every lesson, not only changed ones')
+        parser.add_argument('--dir', default=str(RETRIEVAL_INDEX_DIR))
+
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        passages, changed = build_index(options['dir'], full=options['full'])
+        self.stdout.write(
+            f'{passages} passages, {changed} sources re-indexed in {time.monotonic() - started:.2f}s'
+        )
@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.catalog_cache import is_shared_cache
+from core.progress import HEARTBEAT_FLUSH_SECONDS, flush_heartbeats
+
+
+class Command(BaseCommand):
+    help = 'Write the lesson heartbeats coalesced in the cache to Progress.last_accessed.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--once', action='store_true', help='Flush the finished periods and exit instead of running as a worker.')
+        parser.add_argument('--interval', type=float, default=HEARTBEAT_FLUSH_SECONDS, help='Seconds between flushes.')
+
+    def handle(self, *args, **options):
+        # Needs the cache the web workers use, so CACHE_REDIS_URL in production
+        if not is_shared_cache():
+            self.stderr.write('The cache is per process (no CACHE_REDIS_URL), web workers write heartbeats themselves.')
+            return
+        while True:
+            written = flush_heartbeats()
+            if written:
+                self.stdout.write(f'Wrote last access of {written} enrollment(s)')
+            if options['once']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,28 @@
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+from django.core.management.base import BaseCommand
+
+from core.certificates import CERTIFICATE_CHUNK_SIZE, process_certificate_jobs
+
+
+class Command(BaseCommand):
+    help = 'Render queued certificates across a pool of processes, save them and queue their emails.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=None, help='Rendering processes, defaults to one per core.')
+        parser.add_argument('--chunk-size', type=int, default=CERTIFICATE_CHUNK_SIZE)
+        parser.add_argument('--once', action='store_true', help='Run the queued jobs and exit instead of running as a worker.')
+        parser.add_argument('--idle-sleep', type=float, default=1.0, help='Seconds to wait when no job is queued.')
+
+    def handle(self, *args, **options):
+        # Pool processes only render PDFs, the database work stays in this process
+        with ProcessPoolExecutor(max_workers=options['workers']) as pool:
+            while True:
+                processed = process_certificate_jobs(pool, chunk_size=options['chunk_size'])
+                if processed:
+                    self.stdout.write(f'Ran {processed} certificate job(s)')
+                elif options['once']:
+                    return
+                else:
+                    time.sleep(options['idle_sleep'])
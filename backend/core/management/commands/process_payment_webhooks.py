@@ -0,0 +1,25 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.webhooks import WEBHOOK_BATCH_SIZE, apply_pending_events
+
+
+class Command(BaseCommand):
+    help = 'Apply stored payment provider webhooks to payments, in the order they arrived.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=WEBHOOK_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Apply what is stored and exit instead of running as a worker.')
+        parser.add_argument('--idle-sleep', type=float, default=0.5, help='Seconds to wait when there is nothing to apply.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            processed = apply_pending_events(batch_size)
+            if processed:
+                self.stdout.write(f'Applied {processed} webhook event(s)')
+            if processed < batch_size:
+                if options['once']:
+                    return
+                time.sleep(options['idle_sleep'])
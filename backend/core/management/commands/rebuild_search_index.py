@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from core.search import rebuild_index
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the course and lesson full-text search index from scratch.'
+
+    def handle(self, *args, **options):
+        rebuild_index()
+        self.stdout.write('Search index rebuilt')
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from core.catalog_cache import bump_catalog_version
+from core.course_stats import recompute_course_stats
+
+
+class Command(BaseCommand):
+    help = 'Recompute Course.students_count and rating aggregates from enrollments and ratings.'
+
+    def handle(self, *args, **options):
+        changed = recompute_course_stats()
+        if changed:
+            bump_catalog_version()
+        self.stdout.write(f'Updated {changed} course(s)')
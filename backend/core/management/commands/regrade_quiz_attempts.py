@@ -0,0 +1,41 @@
+from django.core.management.base import BaseCommand
+
+from core.grading import answer_key, correctness, grade_many
+from core.models import QuizAttempt
+
+
+class Command(BaseCommand):
+    help = 'Grade stored quiz attempts again against the current answer keys, for example after a correction.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--quiz', type=int, action='append', help='Quiz id, may be repeated. Defaults to every quiz.')
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+    def handle(self, *args, **options):
+        # Attempts from before server grading have no answers to grade
+        attempts = QuizAttempt.objects.exclude(answers={})
+        if options['quiz']:
+            attempts = attempts.filter(quiz_id__in=options['quiz'])
+        quiz_ids = attempts.order_by().values_list('quiz_id', flat=True).distinct()
+        total = changed = 0
+        for quiz_id in quiz_ids:
+            key = answer_key(quiz_id)
+            last_id = 0
+            while True:
+                batch = list(
+                    attempts.filter(quiz_id=quiz_id, id__gt=last_id).order_by('id').only('id', 'score', 'answers', 'correctness')[:options['batch_size']]
+                )
+                if not batch:
+                    break
+                last_id = batch[-1].id
+                scores, correct = grade_many(key, [attempt.answers for attempt in batch])
+                updated = []
+                for attempt, score, row in zip(batch, scores.tolist(), correct):
+                    row = correctness(key, row)
+                    if attempt.score != score or attempt.correctness != row:
+                        attempt.score, attempt.correctness = score, row
+                        updated.append(attempt)
+                QuizAttempt.objects.bulk_update(updated, ['score', 'correctness'], batch_size=1000)
+                total += len(batch)
+                changed += len(updated)
+        self.stdout.write(f'Regraded {total} attempt(s), {changed} changed')
@@ -0,0 +1,36 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from core.scheduler import LessonReleaseScheduler
+
+
+class Command(BaseCommand):
+    help = 'Release lessons and notify enrolled students when Lesson.release_date arrives.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--lookahead', type=int, default=600, help='Seconds of upcoming releases to keep in memory.')
+        parser.add_argument('--resync', type=float, default=10.0, help='Seconds between incremental syncs with the database.')
+        parser.add_argument('--once', action='store_true', help='Release what is due now and exit.')
+
+    def handle(self, *args, **options):
+        scheduler = LessonReleaseScheduler(lookahead=timedelta(seconds=options['lookahead']))
+        resync = options['resync']
+        next_sync = 0
+        while True:
+            if time.monotonic() >= next_sync:
+                scheduler.sync()
+                next_sync = time.monotonic() + resync
+            released = scheduler.release_due()
+            if released:
+                self.stdout.write(f'Released {released} lesson(s)')
+            if options['once']:
+                return
+            # Sleep until the next release or the next sync, whichever comes first
+            wait = resync
+            due = scheduler.next_due()
+            if due is not None:
+                wait = min(wait, max((due - timezone.now()).total_seconds(), 0))
+            time.sleep(max(min(wait, next_sync - time.monotonic()), 0.05))
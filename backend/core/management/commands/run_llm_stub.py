@@ -0,0 +1,106 @@
+import json
+import math
+import random
+import re
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from django.core.management.base import BaseCommand
+
+WORDS = (
+    'a variable holds a value that the program can read and change later while a loop repeats '
+    'the same steps for every item and a function groups steps under a name'
+).split()
+PATH_RE = re.compile(r'^/v1/models/[^/:]+:(generateContent|streamGenerateContent)$')
+
+
+def make_handler(options):
+    median = options['latency_ms'] / 1000
+
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = 'HTTP/1.1'
+
+        def log_message(self, format, *args):
+            if options['verbose']:
+                super().log_message(format, *args)
+
+        def latency(self):
+            # Log-normal around the median, like a real model's response times
+            return random.lognormvariate(math.log(median), options['latency_sigma']) if median else 0
+
+        def send_json(self, status, payload):
+            body = json.dumps(payload).encode()
+            self.send_response(status)
+            self.send_header('Content-Type', 'application/json')
+            self.send_header('Content-Length', str(len(body)))
+            if status == 429:
+                self.send_header('Retry-After', '1')
+            self.end_headers()
+            self.wfile.write(body)
+
+        def do_POST(self):
+            match = PATH_RE.match(self.path.split('?')[0])
+            self.rfile.read(int(self.headers.get('Content-Length') or 0))
+            if not match:
+                return self.send_json(404, {'error': {'message': 'Not found'}})
+            roll = random.random()
+            if roll < options['rate_limit_rate']:
+                return self.send_json(429, {'error': {'message': 'Resource exhausted'}})
+            if roll < options['rate_limit_rate'] + options['error_rate']:
+                time.sleep(self.latency())
+                return self.send_json(503, {'error': {'message': 'Service unavailable'}})
+            words = random.choices(WORDS, k=options['words'])
+            if match.group(1) == 'generateContent':
+                time.sleep(self.latency())
+                return self.send_json(200, candidate(' '.join(words)))
+            # First token after the usual latency, then a chunk every --chunk-ms
+            time.sleep(self.latency() * options['first_token_share'])
+            self.send_response(200)
+            self.send_header('Content-Type', 'text/event-stream')
+            self.send_header('Connection', 'close')
+            self.end_headers()
+            step = options['chunk_words']
+            for start in range(0, len(words), step):
+                if start:
+                    time.sleep(options['chunk_ms'] / 1000)
+                chunk = ' '.join(words[start:start + step]) + ' '
+                self.wfile.write(f'data: {json.dumps(candidate(chunk))}\r\n\r\n'.encode())
+                self.wfile.flush()
+            self.close_connection = True
+
+    return Handler
+
+
+def candidate(text):
+    return {'candidates': [{'content': {'role': 'model', 'parts': [{'text': text}]}}]}
+
+
+class Command(BaseCommand):
+    help = 'Serve a local stand-in for the Gemini API with configurable latency, streaming and errors.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8765)
+        parser.add_argument('--latency-ms', type=float, default=1500, help='Median time to a full answer.')
+        parser.add_argument('--latency-sigma', type=float, default=0.5, help='Spread of the log-normal latency.')
+        parser.add_argument('--first-token-share', type=float, default=0.2, help='Share of the latency spent before the first streamed chunk.')
+        parser.add_argument('--words', type=int, default=120, help='Words per answer.')
+        parser.add_argument('--chunk-words', type=int, default=8)
+        parser.add_argument('--chunk-ms', type=float, default=40, help='Delay between streamed chunks.')
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Share of requests answered with 503.')
+        parser.add_argument('--rate-limit-rate', type=float, default=0.0, help='Share of requests answered with 429.')
+        parser.add_argument('--verbose', action='store_true')
+
+    def handle(self, *args, **options):
+        server = ThreadingHTTPServer((options['host'], options['port']), make_handler(options))
+        server.daemon_threads = True
+        self.stdout.write(
+            f"LLM stub on http://{options['host']}:{options['port']}, "
+            f"run the app with GEMINI_BASE_URL=http://{options['host']}:{options['port']}"
+        )
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
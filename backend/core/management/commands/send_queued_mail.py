@@ -0,0 +1,27 @@
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.email_utils import OUTBOX_BATCH_SIZE, drain_outbox
+
+
+class Command(BaseCommand):
+    help = 'Deliver email queued in the outbox by the notification signal handlers.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=OUTBOX_BATCH_SIZE)
+        parser.add_argument('--once', action='store_true', help='Drain what is due and exit instead of running as a worker.')
+        parser.add_argument('--idle-sleep', type=float, default=2.0, help='Seconds to wait when the outbox is empty.')
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        while True:
+            sent, failed = drain_outbox(batch_size)
+            if sent or failed:
+                self.stdout.write(f'Sent {sent}, failed {failed}')
+            if options['once']:
+                if not (sent or failed):
+                    return
+                continue
+            if sent + failed < batch_size:
+                time.sleep(options['idle_sleep'])
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:26
+
+from django.db import migrations, models
+from django.db.models import F
+from django.utils import timezone
+
+
+def mark_past_releases(apps, schema_editor):
+    # Lessons already visible were announced by the old post_save handler
+    Lesson = apps.get_model('core', 'Lesson')
+    Lesson.objects.filter(release_date__lte=timezone.now()).update(released_at=F('release_date'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_emailoutbox'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='released_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['released_at', 'release_date'], name='core_lesson_release_e68d91_idx'),
+        ),
+        migrations.RunPython(mark_past_releases, migrations.RunPython.noop),
+    ]
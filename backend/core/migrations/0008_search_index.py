@@ -0,0 +1,40 @@
+from django.db import migrations
+
+
+def create_search_index(apps, schema_editor):
+    vendor = schema_editor.connection.vendor
+    if vendor == 'sqlite':
+        schema_editor.execute(
+            'CREATE VIRTUAL TABLE core_search_index USING fts5('
+            'kind UNINDEXED, object_id UNINDEXED, course_id UNINDEXED, title, body, '
+            "tokenize = 'unicode61 remove_diacritics 2', prefix = '2 3 4 5 6')"
+        )
+    elif vendor == 'postgresql':
+        schema_editor.execute(
+            'CREATE TABLE core_search_index ('
+            'id bigint PRIMARY KEY, kind varchar(10) NOT NULL, object_id bigint NOT NULL, course_id bigint NOT NULL, '
+            'title text NOT NULL, body text NOT NULL, document tsvector NOT NULL)'
+        )
+        schema_editor.execute('CREATE INDEX core_search_index_document ON core_search_index USING GIN (document)')
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor in ('sqlite', 'postgresql'):
+        schema_editor.execute('DROP TABLE IF EXISTS core_search_index')
+
+
+def populate_search_index(apps, schema_editor):
+    from core.search import rebuild_index
+    rebuild_index(course_model=apps.get_model('core', 'Course'), lesson_model=apps.get_model('core', 'Lesson'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_lesson_released_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+        migrations.RunPython(populate_search_index, migrations.RunPython.noop),
+    ]
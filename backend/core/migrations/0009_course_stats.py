@@ -0,0 +1,66 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:33
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+def backfill_course_stats(apps, schema_editor):
+    from core.course_stats import recompute_course_stats
+    recompute_course_stats(
+        course_model=apps.get_model('core', 'Course'),
+        enrollment_model=apps.get_model('core', 'Enrollment'),
+        rating_model=apps.get_model('core', 'CourseRating'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_search_index'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CourseRating',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveSmallIntegerField()),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='rating_sum',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['status', '-students_count', '-id'], name='core_course_status_efe6ed_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='course',
+            index=models.Index(fields=['status', '-rating', '-id'], name='core_course_status_c7da14_idx'),
+        ),
+        migrations.AddField(
+            model_name='courserating',
+            name='course',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ratings', to='core.course'),
+        ),
+        migrations.AddField(
+            model_name='courserating',
+            name='user',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_ratings', to=settings.AUTH_USER_MODEL),
+        ),
+        migrations.AlterUniqueTogether(
+            name='courserating',
+            unique_together={('user', 'course')},
+        ),
+        migrations.RunPython(backfill_course_stats, migrations.RunPython.noop),
+    ]
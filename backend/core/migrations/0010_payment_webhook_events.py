@@ -0,0 +1,39 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0009_course_stats'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentWebhookEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('provider', models.CharField(max_length=50)),
+                ('reference', models.CharField(max_length=100)),
+                ('event', models.CharField(max_length=50)),
+                ('payload', models.JSONField(default=dict)),
+                ('status', models.CharField(choices=[('received', 'Received'), ('applied', 'Applied'), ('ignored', 'Ignored')], default='received', max_length=10)),
+                ('error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['provider', 'reference'], name='core_paymen_provide_e3ca40_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='paymentwebhookevent',
+            index=models.Index(fields=['status', 'id'], name='core_paymen_status_1429a5_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='paymentwebhookevent',
+            constraint=models.UniqueConstraint(fields=('provider', 'reference', 'event'), name='unique_payment_webhook_event'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:54
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_certificate_jobs'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CertificateTemplate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100)),
+                ('layout', models.JSONField(blank=True, default=dict)),
+                ('logo', models.FileField(blank=True, null=True, upload_to='certificate_templates/')),
+                ('is_default', models.BooleanField(default=False)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+            ],
+        ),
+        migrations.AddField(
+            model_name='course',
+            name='certificate_template',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='courses', to='core.certificatetemplate'),
+        ),
+    ]
@@ -0,0 +1,31 @@
+# Generated by Django 5.2.18 on 2026-10-18 08:59
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_quiz_attempt_answers'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='SyncEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64)),
+                ('type', models.CharField(max_length=30)),
+                ('status', models.CharField(choices=[('applied', 'Applied'), ('rejected', 'Rejected')], max_length=10)),
+                ('error', models.CharField(blank=True, max_length=255)),
+                ('client_time', models.DateTimeField(blank=True, null=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='sync_events', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('user', 'key'), name='unique_sync_event')],
+            },
+        ),
+    ]
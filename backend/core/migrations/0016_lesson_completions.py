@@ -0,0 +1,32 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:01
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_sync_events'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='progress',
+            name='last_accessed',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.CreateModel(
+            name='LessonCompletion',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('completed_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('enrollment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='lesson_completions', to='core.enrollment')),
+                ('lesson', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='completions', to='core.lesson')),
+            ],
+            options={
+                'constraints': [models.UniqueConstraint(fields=('enrollment', 'lesson'), name='unique_lesson_completion')],
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:05
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def hash_contents(apps, schema_editor):
+    Lesson = apps.get_model('core', 'Lesson')
+    lessons = list(Lesson.objects.only('id', 'content'))
+    for lesson in lessons:
+        lesson.content_hash = hashlib.sha256((lesson.content or '').encode()).hexdigest()
+    Lesson.objects.bulk_update(lessons, ['content_hash'], batch_size=500)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_lesson_completions'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='lesson',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64),
+        ),
+        migrations.RunPython(hash_contents, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,36 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:17
+
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def requeue_missing_payments(apps, schema_editor):
+    # These were given up on at the first try, the payment may exist by now
+    PaymentWebhookEvent = apps.get_model('core', 'PaymentWebhookEvent')
+    PaymentWebhookEvent.objects.filter(status='ignored', error='Payment not found.').update(status='received', processed_at=None)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0017_lesson_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='paymentwebhookevent',
+            name='attempts',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='paymentwebhookevent',
+            name='next_attempt_at',
+            field=models.DateTimeField(default=django.utils.timezone.now),
+        ),
+        migrations.AlterField(
+            model_name='paymentwebhookevent',
+            name='status',
+            field=models.CharField(choices=[('received', 'Received'), ('applied', 'Applied'), ('ignored', 'Ignored'), ('dead', 'Dead')], default='received', max_length=10),
+        ),
+        migrations.RunPython(requeue_missing_payments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,26 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:20
+
+from django.db import migrations, models
+from django.db.models import F
+
+
+def start_leases(apps, schema_editor):
+    # Jobs already running count from when they started, so stuck ones are reclaimed
+    CertificateJob = apps.get_model('core', 'CertificateJob')
+    CertificateJob.objects.filter(status='running').update(heartbeat_at=F('started_at'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0018_webhook_event_retries'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='certificatejob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(start_leases, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,25 @@
+# Generated by Django 5.2.18 on 2026-10-18 09:35
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0019_certificate_job_heartbeat'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='lesson',
+            index=models.Index(fields=['course', 'order', 'id'], name='core_lesson_course__9536c2_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='option',
+            index=models.Index(fields=['question', 'id'], name='core_option_questio_0dde07_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='question',
+            index=models.Index(fields=['quiz', 'id'], name='core_questi_quiz_id_257556_idx'),
+        ),
+    ]
@@ -1,5 +1,7 @@
 from django.contrib.auth.models import AbstractUser
+from django.core.exceptions import ValidationError
 from django.db import models
+from django.utils import timezone
 
 class User(AbstractUser):
     ROLE_CHOICES = (
@@ -31,10 +33,19 @@ class Course(models.Model):
     duration = models.CharField(max_length=50)
     instructor = models.ForeignKey(User, on_delete=models.CASCADE, related_name='courses')
     rating = models.FloatField(default=0)
+    rating_sum = models.PositiveIntegerField(default=0)
+    rating_count = models.PositiveIntegerField(default=0)
     students_count = models.PositiveIntegerField(default=0)
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='pending')
+    certificate_template = models.ForeignKey('CertificateTemplate', on_delete=models.SET_NULL, null=True, blank=True, related_name='courses')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', '-students_count', '-id']),
+            models.Index(fields=['status', '-rating', '-id']),
+        ]
 
 class Enrollment(models.Model):
     student = models.ForeignKey(User, on_delete=models.CASCADE, related_name='enrollments')
@@ -43,10 +54,22 @@ class Enrollment(models.Model):
     progress = models.FloatField(default=0)
     completed = models.BooleanField(default=False)
 
+class CourseRating(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='course_ratings')
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='ratings')
+    score = models.PositiveSmallIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        unique_together = ('user', 'course')
+
 class Progress(models.Model):
     enrollment = models.OneToOneField(Enrollment, on_delete=models.CASCADE, related_name='progress_record')
+    # Derived from LessonCompletion by core.progress
     lessons_completed = models.PositiveIntegerField(default=0)
-    last_accessed = models.DateTimeField(auto_now=True)
+    # Heartbeats are coalesced in the cache and written by core.progress.flush_heartbeats
+    last_accessed = models.DateTimeField(default=timezone.now)
 
 class Achievement(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='achievements')
@@ -63,13 +86,30 @@ class Lesson(models.Model):
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='lessons')
     title = models.CharField(max_length=255)
     content = models.TextField(blank=True, null=True)
+    # sha256 of content, set on save, see core.lesson_content
+    content_hash = models.CharField(max_length=64, blank=True, editable=False)
     order = models.PositiveIntegerField()
     lesson_type = models.CharField(max_length=10, choices=LESSON_TYPE_CHOICES, default='video')
     duration = models.CharField(max_length=20, blank=True, null=True)
     release_date = models.DateTimeField(blank=True, null=True)
+    released_at = models.DateTimeField(blank=True, null=True)
 
     class Meta:
         ordering = ['order']
+        indexes = [
+            models.Index(fields=['released_at', 'release_date']),
+            # Course outline, and the keyset pages of GET /api/lessons/?course=
+            models.Index(fields=['course', 'order', 'id']),
+        ]
+
+class LessonCompletion(models.Model):
+    # Append-only, one row the first time a learner completes a lesson
+    enrollment = models.ForeignKey(Enrollment, on_delete=models.CASCADE, related_name='lesson_completions')
+    lesson = models.ForeignKey(Lesson, on_delete=models.CASCADE, related_name='completions')
+    completed_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['enrollment', 'lesson'], name='unique_lesson_completion')]
 
 class Quiz(models.Model):
     lesson = models.OneToOneField(Lesson, on_delete=models.CASCADE, related_name='quiz')
@@ -79,15 +119,26 @@ class Question(models.Model):
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='questions')
     text = models.CharField(max_length=512)
 
+    class Meta:
+        # Keyset pages of a quiz's questions
+        indexes = [models.Index(fields=['quiz', 'id'])]
+
 class Option(models.Model):
     question = models.ForeignKey(Question, on_delete=models.CASCADE, related_name='options')
     text = models.CharField(max_length=255)
     is_correct = models.BooleanField(default=False)
 
+    class Meta:
+        # Keyset pages of a question's options
+        indexes = [models.Index(fields=['question', 'id'])]
+
 class QuizAttempt(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='quiz_attempts')
     quiz = models.ForeignKey(Quiz, on_delete=models.CASCADE, related_name='attempts')
     score = models.FloatField(default=0)
+    # Chosen option ids by question id, and whether each question was answered correctly
+    answers = models.JSONField(default=dict, blank=True)
+    correctness = models.JSONField(default=dict, blank=True)
     completed_at = models.DateTimeField(auto_now_add=True)
 
 class Payment(models.Model):
@@ -106,12 +157,87 @@ class Payment(models.Model):
     reference = models.CharField(max_length=100, blank=True, null=True)
     webhook_payload = models.JSONField(blank=True, null=True)
 
+    class Meta:
+        indexes = [models.Index(fields=['provider', 'reference'])]
+
+class PaymentWebhookEvent(models.Model):
+    STATUS_CHOICES = (
+        ('received', 'Received'),
+        ('applied', 'Applied'),
+        ('ignored', 'Ignored'),
+        ('dead', 'Dead'),
+    )
+    provider = models.CharField(max_length=50)
+    reference = models.CharField(max_length=100)
+    event = models.CharField(max_length=50)
+    payload = models.JSONField(default=dict)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='received')
+    # Last error, kept while the event is retried
+    error = models.TextField(blank=True)
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'reference', 'event'], name='unique_payment_webhook_event'),
+        ]
+        indexes = [models.Index(fields=['status', 'id'])]
+
 class Certificate(models.Model):
     user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='certificates')
     course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='certificates')
     issued_at = models.DateTimeField(auto_now_add=True)
     file = models.FileField(upload_to='certificates/', blank=True, null=True)
 
+class CertificateTemplate(models.Model):
+    # Layout of static background elements and per-certificate text fields, see core.certificate_templates
+    name = models.CharField(max_length=100)
+    layout = models.JSONField(default=dict, blank=True)
+    logo = models.FileField(upload_to='certificate_templates/', blank=True, null=True)
+    # Used by courses without a template of their own
+    is_default = models.BooleanField(default=False)
+    # Bumped on every save, the compiled background is cached per version
+    version = models.PositiveIntegerField(default=1)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    def __str__(self):
+        return self.name
+
+    def clean(self):
+        from .certificate_templates import validate_layout
+        if self.layout:
+            try:
+                validate_layout(self.layout)
+            except ValueError as e:
+                raise ValidationError({'layout': str(e)})
+
+class CertificateJob(models.Model):
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+    course = models.ForeignKey(Course, on_delete=models.CASCADE, related_name='certificate_jobs')
+    requested_by = models.ForeignKey(User, on_delete=models.SET_NULL, null=True, blank=True, related_name='certificate_jobs')
+    # Students to issue for, rendered by `manage.py issue_certificates`
+    user_ids = models.JSONField(default=list)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    total = models.PositiveIntegerField(default=0)
+    issued = models.PositiveIntegerField(default=0)
+    failed = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(blank=True, null=True)
+    # Moved forward after every chunk, a running job that stops moving is claimed again
+    heartbeat_at = models.DateTimeField(blank=True, null=True)
+    finished_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'id'])]
+
 class Notification(models.Model):
     NOTIFICATION_TYPES = [
         ('info', 'Info'),
@@ -149,3 +275,65 @@ class TeamMember(models.Model):
     role = models.CharField(max_length=100)
     avatar = models.URLField()
     bio = models.TextField(blank=True)
+
+class EmailOutbox(models.Model):
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('sent', 'Sent'),
+        ('dead', 'Dead'),
+    )
+    subject = models.CharField(max_length=255)
+    body = models.TextField()
+    content_subtype = models.CharField(max_length=20, default='plain')
+    from_email = models.CharField(max_length=255)
+    recipients = models.JSONField(default=list)
+    attachments = models.JSONField(default=list, blank=True)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    next_attempt_at = models.DateTimeField(default=timezone.now)
+    last_error = models.TextField(blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    sent_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'next_attempt_at'])]
+
+class ChatSession(models.Model):
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='chat_sessions')
+    title = models.CharField(max_length=200, blank=True)
+    # Rolling summary of every message up to and including summarized_until
+    summary = models.TextField(blank=True)
+    summarized_until = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+class ChatMessage(models.Model):
+    ROLE_CHOICES = (
+        ('user', 'User'),
+        ('model', 'Model'),
+    )
+    session = models.ForeignKey(ChatSession, on_delete=models.CASCADE, related_name='messages')
+    role = models.CharField(max_length=10, choices=ROLE_CHOICES)
+    text = models.TextField()
+    tokens = models.PositiveIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['session', 'id'])]
+
+class SyncEvent(models.Model):
+    # Learner events sent in batches by offline clients, keyed so a resent batch is applied once
+    STATUS_CHOICES = (
+        ('applied', 'Applied'),
+        ('rejected', 'Rejected'),
+    )
+    user = models.ForeignKey(User, on_delete=models.CASCADE, related_name='sync_events')
+    key = models.CharField(max_length=64)
+    type = models.CharField(max_length=30)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES)
+    error = models.CharField(max_length=255, blank=True)
+    client_time = models.DateTimeField(blank=True, null=True)
+    received_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [models.UniqueConstraint(fields=['user', 'key'], name='unique_sync_event')]
@@ -0,0 +1,100 @@
+import asyncio
+import logging
+from functools import partial
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.template.loader import get_template
+
+from .email_utils import build_outbox_entry
+from .models import EmailOutbox, Notification
+from .serializers import NotificationSerializer
+
+logger = logging.getLogger(__name__)
+
+FANOUT_CHUNK_SIZE = getattr(settings, 'NOTIFICATION_FANOUT_CHUNK_SIZE', 1000)
+
+
+def _group_name(user_id):
+    return f'user_{user_id}_notifications'
+
+
+def broadcast_notification(user_id, notification):
+    broadcast_notifications([(user_id, notification)])
+
+
+# Push many notifications through the channel layer in one event-loop hop
+def broadcast_notifications(pairs):
+    channel_layer = get_channel_layer()
+    if channel_layer is None or not pairs:
+        return
+    # many=True builds the serializer fields once for the whole batch
+    payloads = NotificationSerializer([notification for _, notification in pairs], many=True).data
+    events = [
+        (_group_name(user_id), {'type': 'send_notification', 'notification': payload})
+        for (user_id, _), payload in zip(pairs, payloads)
+    ]
+
+    async def send_all():
+        await asyncio.gather(*(channel_layer.group_send(group, event) for group, event in events))
+
+    try:
+        async_to_sync(send_all)()
+    except Exception as e:
+        # Realtime push is best effort, the Notification rows are already stored
+        logger.warning("Could not broadcast %s notification(s): %s", len(events), e)
+
+
+def _display_name(first_name, last_name, email):
+    return f'{first_name} {last_name}'.strip() or email
+
+
+def _release_recipients(lesson, chunk_size):
+    # One streamed query over the enrolled students, deduplicated as it goes
+    rows = (
+        get_user_model().objects
+        .filter(enrollments__course_id=lesson.course_id)
+        .order_by('id')
+        .values_list('id', 'email', 'first_name', 'last_name')
+        .iterator(chunk_size=chunk_size)
+    )
+    chunk, last_id = [], None
+    for row in rows:
+        if row[0] == last_id:
+            continue
+        last_id = row[0]
+        chunk.append(row)
+        if len(chunk) >= chunk_size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+def fan_out_lesson_release(lesson, chunk_size=FANOUT_CHUNK_SIZE):
+    course = lesson.course
+    template = get_template('emails/lesson_release.html')
+    subject = f'New lesson released: {lesson.title}'
+    text = f'New lesson "{lesson.title}" has been released in {course.title}'
+    total = 0
+    for chunk in _release_recipients(lesson, chunk_size):
+        with transaction.atomic():
+            notifications = Notification.objects.bulk_create([
+                Notification(user_id=user_id, message=text, type='info') for user_id, _, _, _ in chunk
+            ])
+            EmailOutbox.objects.bulk_create([
+                build_outbox_entry(
+                    subject,
+                    template.render({'name': _display_name(first, last, email), 'lesson_title': lesson.title, 'course_title': course.title}),
+                    [email],
+                    content_subtype='html',
+                )
+                for _, email, first, last in chunk if email
+            ])
+        # Pushed once the rows are committed, by this chunk or by the caller's transaction
+        transaction.on_commit(partial(broadcast_notifications, [(n.user_id, n) for n in notifications]))
+        total += len(chunk)
+    return total
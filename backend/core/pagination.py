@@ -0,0 +1,16 @@
+from rest_framework.pagination import CursorPagination
+
+
+class KeysetPagination(CursorPagination):
+    # Keyset pagination on the primary key by default, so every page is an index
+    # range scan no matter how deep the client goes. Views can set `cursor_ordering`.
+    # Lists answer {"next", "previous", "results"}; clients follow the opaque next
+    # link instead of asking for page numbers, and there is no total count.
+    page_size = 50
+    page_size_query_param = 'page_size'
+    max_page_size = 200
+    ordering = '-id'
+
+    def get_ordering(self, request, queryset, view):
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        return super().get_ordering(request, queryset, view)
@@ -0,0 +1,170 @@
+import time
+from datetime import datetime, timezone as dt_timezone
+from functools import partial
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Round
+from django.utils import timezone
+
+from .catalog_cache import is_shared_cache
+from .models import Enrollment, Lesson, LessonCompletion, Progress
+
+# Course progress is derived, never counted up blindly: LessonCompletion logs
+# each lesson a learner completes once, and recompute() sets
+# Progress.lessons_completed and Enrollment.progress/completed from those rows.
+#
+# Heartbeats only move last_accessed, so with a shared cache they are kept
+# there and written in bulk. The first heartbeat of an enrollment in a bucket
+# of HEARTBEAT_FLUSH_SECONDS registers it, later ones just raise its cached
+# time. Buckets are written once they are over by the
+# `manage.py flush_progress_heartbeats` worker, never in a learner's request.
+# A per-process cache is invisible to that worker, so then each process writes
+# an enrollment's heartbeat directly, at most once per bucket length.
+HEARTBEAT_FLUSH_SECONDS = getattr(settings, 'HEARTBEAT_FLUSH_SECONDS', 60)
+HEARTBEAT_BUCKETS_KEPT = 10
+HEARTBEAT_TIMEOUT = HEARTBEAT_FLUSH_SECONDS * HEARTBEAT_BUCKETS_KEPT
+RECOMPUTE_CHUNK_SIZE = 2000
+
+
+def recompute(enrollment_ids):
+    # Fixed number of queries for any number of enrollments. A completed
+    # enrollment stays completed when lessons are added to its course later.
+    enrollments = list(Enrollment.objects.filter(id__in=enrollment_ids).only('id', 'course_id', 'student_id', 'progress', 'completed'))
+    if not enrollments:
+        return
+    totals = dict(
+        Lesson.objects.filter(course_id__in={e.course_id for e in enrollments})
+        .order_by().values('course_id').annotate(n=Count('id')).values_list('course_id', 'n')
+    )
+    done = dict(
+        LessonCompletion.objects.filter(enrollment_id__in=[e.id for e in enrollments])
+        .order_by().values('enrollment_id').annotate(n=Count('id')).values_list('enrollment_id', 'n')
+    )
+    records = {p.enrollment_id: p for p in Progress.objects.filter(enrollment_id__in=[e.id for e in enrollments])}
+    changed_progress, changed_enrollments = [], []
+    for enrollment in enrollments:
+        completed, total = done.get(enrollment.id, 0), totals.get(enrollment.course_id, 0)
+        record = records.get(enrollment.id)
+        if record is None:
+            records[enrollment.id] = Progress(enrollment_id=enrollment.id, lessons_completed=completed)
+        elif record.lessons_completed != completed:
+            record.lessons_completed = completed
+            changed_progress.append(record)
+        percent = round(min(completed, total) * 100 / total, 2) if total else 0
+        if total and completed >= total and not enrollment.completed:
+            # Saved on its own so the completion signals (instructor notice, entitlements) run
+            enrollment.progress, enrollment.completed = percent, True
+            enrollment.save(update_fields=['progress', 'completed'])
+        elif enrollment.progress != percent:
+            enrollment.progress = percent
+            changed_enrollments.append(enrollment)
+    Progress.objects.bulk_create([r for r in records.values() if r.pk is None], ignore_conflicts=True)
+    Progress.objects.bulk_update(changed_progress, ['lessons_completed'])
+    Enrollment.objects.bulk_update(changed_enrollments, ['progress'])
+
+
+def _completions(enrollment_field):
+    # Number of lessons completed in the enrollment the outer row points to
+    return Coalesce(Subquery(
+        LessonCompletion.objects.filter(enrollment_id=OuterRef(enrollment_field))
+        .order_by().values('enrollment_id').annotate(n=Count('id')).values('n')
+    ), 0)
+
+
+def recompute_course(course_id):
+    # After lessons are added to or removed from a course. A few set-based
+    # statements for any number of learners; only enrollments that reach the
+    # end go through recompute(), for their completion signals.
+    total = Lesson.objects.filter(course_id=course_id).count()
+    # Removed lessons take their completions with them
+    Progress.objects.filter(enrollment__course_id=course_id).update(lessons_completed=_completions('enrollment_id'))
+    enrollments = Enrollment.objects.filter(course_id=course_id)
+    if not total:
+        enrollments.update(progress=0)
+        return
+    finished = list(
+        enrollments.filter(completed=False, progress_record__lessons_completed__gte=total).values_list('id', flat=True)
+    )
+    for start in range(0, len(finished), RECOMPUTE_CHUNK_SIZE):
+        recompute(finished[start:start + RECOMPUTE_CHUNK_SIZE])
+    enrollments.update(progress=Round(_completions('pk') * 100.0 / total, 2))
+
+
+def recompute_course_on_commit(course_id):
+    # Lesson saves and deletes stay cheap, the course is updated once they are committed
+    transaction.on_commit(partial(recompute_course, course_id))
+
+
+def complete_lessons(completions):
+    # (enrollment_id, lesson_id, when) tuples, completing a lesson again changes nothing
+    LessonCompletion.objects.bulk_create(
+        [LessonCompletion(enrollment_id=e, lesson_id=l, completed_at=when) for e, l, when in completions],
+        ignore_conflicts=True,
+    )
+    recompute({e for e, _, _ in completions})
+
+
+def _last_key(bucket, enrollment_id):
+    return f'progress:last_accessed:{bucket}:{enrollment_id}'
+
+
+def _bucket_key(bucket):
+    return f'progress:touched:{bucket}'
+
+
+def _current_bucket():
+    return int(time.time()) // HEARTBEAT_FLUSH_SECONDS
+
+
+def touch(enrollment_id, when=None):
+    moment = (when or timezone.now()).timestamp()
+    bucket = _current_bucket()
+    key = _last_key(bucket, enrollment_id)
+    if not is_shared_cache():
+        if cache.add(key, moment, HEARTBEAT_FLUSH_SECONDS):
+            write_last_accessed({enrollment_id: moment})
+        return
+    if cache.add(key, moment, HEARTBEAT_TIMEOUT):
+        cache.add(_bucket_key(bucket), 0, HEARTBEAT_TIMEOUT)
+        n = cache.incr(_bucket_key(bucket))
+        cache.set(f'{_bucket_key(bucket)}:{n}', enrollment_id, HEARTBEAT_TIMEOUT)
+    elif (cache.get(key) or 0) < moment:
+        cache.set(key, moment, HEARTBEAT_TIMEOUT)
+
+
+def flush_heartbeats():
+    # Writes the buckets that are over, returns the number of enrollments written
+    current = _current_bucket()
+    written = 0
+    for bucket in range(current - HEARTBEAT_BUCKETS_KEPT, current):
+        count = cache.get(_bucket_key(bucket))
+        # Whoever adds the marker flushes the bucket
+        if not count or not cache.add(f'{_bucket_key(bucket)}:flushed', 1, HEARTBEAT_TIMEOUT):
+            continue
+        ids = list(cache.get_many([f'{_bucket_key(bucket)}:{n}' for n in range(1, count + 1)]).values())
+        # Heartbeats go to the current bucket, nothing writes to this one any more
+        keys = {_last_key(bucket, enrollment_id): enrollment_id for enrollment_id in ids}
+        stamps = {keys[key]: value for key, value in cache.get_many(list(keys)).items()}
+        written += write_last_accessed(stamps)
+    return written
+
+
+def write_last_accessed(stamps):
+    # {enrollment_id: unix time}, last_accessed only moves forward
+    records = {p.enrollment_id: p for p in Progress.objects.filter(enrollment_id__in=stamps).only('id', 'enrollment_id', 'last_accessed')}
+    changed = []
+    for enrollment_id, stamp in stamps.items():
+        moment = datetime.fromtimestamp(stamp, tz=dt_timezone.utc)
+        record = records.get(enrollment_id)
+        if record is not None and record.last_accessed < moment:
+            record.last_accessed = moment
+            changed.append(record)
+    missing = set(Enrollment.objects.filter(id__in=set(stamps) - set(records)).values_list('id', flat=True))
+    Progress.objects.bulk_create([
+        Progress(enrollment_id=e, last_accessed=datetime.fromtimestamp(stamps[e], tz=dt_timezone.utc)) for e in missing
+    ], ignore_conflicts=True)
+    Progress.objects.bulk_update(changed, ['last_accessed'])
+    return len(changed) + len(missing)
@@ -0,0 +1,55 @@
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Prefetch, prefetch_related_objects
+from rest_framework.renderers import JSONRenderer
+
+from .catalog_cache import cache_timeout
+from .models import Option, Question
+from .serializers import QuizDeliverySerializer
+
+# Delivered quizzes (questions and options, without the answers) are cached as
+# rendered JSON per quiz version. Any change to the quiz, one of its questions
+# or options bumps the version; with a shared cache the timeout only clears
+# out old versions, see catalog_cache.cache_timeout.
+QUIZ_CACHE_TIMEOUT = cache_timeout(getattr(settings, 'QUIZ_CACHE_TIMEOUT', 60 * 60 * 24))
+
+
+def _version_key(quiz_id):
+    return f'quiz:{quiz_id}:version'
+
+
+def quiz_version(quiz_id):
+    version = cache.get(_version_key(quiz_id))
+    if version is None:
+        # Clock based for the same reason as catalog_version
+        cache.add(_version_key(quiz_id), int(time.time() * 1000), None)
+        version = cache.get(_version_key(quiz_id))
+    return version
+
+
+def bump_quiz_version(quiz_id):
+    try:
+        cache.incr(_version_key(quiz_id))
+    except ValueError:
+        cache.add(_version_key(quiz_id), int(time.time() * 1000), None)
+
+
+DELIVERY_PREFETCH = Prefetch(
+    'questions',
+    queryset=Question.objects.order_by('id').prefetch_related(
+        Prefetch('options', queryset=Option.objects.order_by('id').only('id', 'text', 'question_id'))
+    ),
+)
+
+
+def delivery_content(quiz):
+    key = f'quiz:{quiz.pk}:{quiz_version(quiz.pk)}:delivery'
+    content = cache.get(key)
+    if content is None:
+        # Two queries however many questions and options there are
+        prefetch_related_objects([quiz], DELIVERY_PREFETCH)
+        content = JSONRenderer().render(QuizDeliverySerializer(quiz).data)
+        cache.set(key, content, QUIZ_CACHE_TIMEOUT)
+    return content
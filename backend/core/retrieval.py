@@ -0,0 +1,220 @@
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+import zlib
+from pathlib import Path
+
+import numpy as np
+from django.conf import settings
+from django.utils import timezone
+
+from .entitlements import get_entitlements
+from .models import Course, Lesson
+from .search import TOKEN_RE, normalize_text
+
+# Lesson and course text, split into passages and indexed as hashed TF-IDF
+# vectors. The index is built offline by build_retrieval_index and stored as
+# plain .npy files, workers memory-map it and reload when a new version lands.
+RETRIEVAL_INDEX_DIR = Path(getattr(settings, 'RETRIEVAL_INDEX_DIR', settings.BASE_DIR / 'retrieval_index'))
+RETRIEVAL_TOP_K = getattr(settings, 'RETRIEVAL_TOP_K', 3)
+RETRIEVAL_MIN_SCORE = getattr(settings, 'RETRIEVAL_MIN_SCORE', 0.1)
+HASH_BITS = 18
+HASH_DIM = 1 << HASH_BITS
+PASSAGE_WORDS = 120
+RELOAD_CHECK_SECONDS = 30
+KEEP_VERSIONS = 2
+
+
+def _term_ids(text):
+    # crc32 rather than hash(), which is salted per process
+    return [zlib.crc32(token.encode()) & (HASH_DIM - 1) for token in TOKEN_RE.findall(normalize_text(text))]
+
+
+def _counts(text):
+    terms, counts = np.unique(np.array(_term_ids(text), dtype=np.int32), return_counts=True)
+    return terms, counts.astype(np.float32)
+
+
+def _split(text):
+    words = (text or '').split()
+    return [' '.join(words[i:i + PASSAGE_WORDS]) for i in range(0, len(words), PASSAGE_WORDS)]
+
+
+def _sources():
+    # What learners can already read: published courses and their released lessons
+    courses = {
+        course.id: course
+        for course in Course.objects.filter(status='published').only('id', 'title', 'description')
+    }
+    for course in courses.values():
+        yield f'course:{course.id}', course.id, course.title, '', course.description
+    lessons = Lesson.objects.filter(course_id__in=courses, release_date__lte=timezone.now()).only(
+        'id', 'course_id', 'title', 'content'
+    )
+    for lesson in lessons.iterator(chunk_size=2000):
+        yield f'lesson:{lesson.id}', lesson.course_id, courses[lesson.course_id].title, lesson.title, lesson.content
+
+
+def _digest(*parts):
+    return hashlib.sha1('\x00'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _current_dir(index_dir):
+    try:
+        return index_dir / (index_dir / 'CURRENT').read_text().strip()
+    except FileNotFoundError:
+        return None
+
+
+def _load_previous(index_dir):
+    version_dir = _current_dir(index_dir)
+    if version_dir is None:
+        return {'version': 0, 'sources': {}, 'passages': []}, None
+    manifest = json.loads((version_dir / 'manifest.json').read_text())
+    counts = tuple(np.load(version_dir / f'{name}.npy') for name in ('count_ptr', 'count_terms', 'count_values'))
+    return manifest, counts
+
+
+def build_index(index_dir=RETRIEVAL_INDEX_DIR, full=False):
+    # Only sources whose content hash changed are re-tokenized, the term counts
+    # of the rest are carried over. Returns (passages, sources re-tokenized).
+    index_dir = Path(index_dir)
+    previous, previous_counts = ({'version': 0, 'sources': {}, 'passages': []}, None) if full else _load_previous(index_dir)
+    passages, rows, changed = [], [], 0
+    previous_rows = {}
+    for position, passage in enumerate(previous['passages']):
+        previous_rows.setdefault(passage['source'], []).append(position)
+    sources = {}
+    for source, course_id, course_title, lesson_title, text in _sources():
+        digest = sources[source] = _digest(course_title, lesson_title, text)
+        if previous_counts is not None and previous['sources'].get(source) == digest:
+            ptr, terms, values = previous_counts
+            for position in previous_rows.get(source, ()):
+                passages.append(previous['passages'][position])
+                rows.append((terms[ptr[position]:ptr[position + 1]], values[ptr[position]:ptr[position + 1]]))
+            continue
+        changed += 1
+        for chunk in _split(text):
+            passages.append({
+                'source': source, 'course_id': course_id, 'course_title': course_title,
+                'lesson_title': lesson_title, 'text': chunk,
+            })
+            # Titles count towards every passage of their lesson
+            rows.append(_counts(f'{course_title} {lesson_title} {chunk}'))
+    if previous_counts is not None and changed == 0 and sources.keys() == previous['sources'].keys():
+        return len(passages), 0
+
+    count_ptr = np.zeros(len(rows) + 1, dtype=np.int64)
+    np.cumsum([len(terms) for terms, _ in rows], out=count_ptr[1:])
+    count_terms = np.concatenate([terms for terms, _ in rows]) if rows else np.zeros(0, dtype=np.int32)
+    count_values = np.concatenate([values for _, values in rows]) if rows else np.zeros(0, dtype=np.float32)
+
+    # Sublinear tf, smoothed idf, rows scaled to unit length
+    passage_of = np.repeat(np.arange(len(rows), dtype=np.int32), np.diff(count_ptr))
+    df = np.bincount(count_terms, minlength=HASH_DIM)
+    idf = (np.log((len(rows) + 1) / (df + 1)) + 1).astype(np.float32)
+    weights = (1 + np.log(count_values)) * idf[count_terms]
+    norms = np.sqrt(np.bincount(passage_of, weights * weights, minlength=len(rows)))
+    weights = (weights / np.maximum(norms, 1e-12)[passage_of]).astype(np.float32)
+
+    # Transposed (term -> passages) for scoring: a query only touches its own terms' postings
+    order = np.argsort(count_terms, kind='stable')
+    term_ptr = np.zeros(HASH_DIM + 1, dtype=np.int64)
+    np.cumsum(np.bincount(count_terms, minlength=HASH_DIM), out=term_ptr[1:])
+
+    # Numbered past every existing version, a full rebuild never overwrites files a worker may have mapped
+    version = max([int(d.name[1:]) for d in index_dir.glob('v*') if d.name[1:].isdigit()], default=0) + 1
+    version_dir = index_dir / f'v{version}'
+    if version_dir.exists():
+        shutil.rmtree(version_dir)
+    version_dir.mkdir(parents=True)
+    arrays = {
+        'count_ptr': count_ptr, 'count_terms': count_terms, 'count_values': count_values,
+        'idf': idf, 'term_ptr': term_ptr, 'postings': passage_of[order], 'weights': weights[order],
+        'course_ids': np.array([passage['course_id'] for passage in passages], dtype=np.int64),
+        'is_lesson': np.array([passage['source'].startswith('lesson:') for passage in passages], dtype=bool),
+    }
+    for name, array in arrays.items():
+        np.save(version_dir / f'{name}.npy', array)
+    (version_dir / 'manifest.json').write_text(json.dumps({'version': version, 'sources': sources, 'passages': passages}))
+    # Readers switch over when CURRENT is replaced, which is atomic
+    (index_dir / 'CURRENT.tmp').write_text(version_dir.name)
+    os.replace(index_dir / 'CURRENT.tmp', index_dir / 'CURRENT')
+    for old in index_dir.glob('v*'):
+        if old.name[1:].isdigit() and int(old.name[1:]) <= version - KEEP_VERSIONS:
+            shutil.rmtree(old, ignore_errors=True)
+    return len(passages), changed
+
+
+class RetrievalIndex:
+    def __init__(self, version_dir):
+        self.version_dir = version_dir
+        self.passages = json.loads((version_dir / 'manifest.json').read_text())['passages']
+        self.idf = self._load('idf')
+        self.term_ptr = self._load('term_ptr')
+        self.postings = self._load('postings')
+        self.weights = self._load('weights')
+        self.course_ids = self._load('course_ids')
+        self.is_lesson = self._load('is_lesson')
+
+    def _load(self, name):
+        # Memory-mapped, pages are shared between worker processes through the OS cache
+        return np.load(self.version_dir / f'{name}.npy', mmap_mode='r')
+
+    def search(self, query, k=RETRIEVAL_TOP_K, course_ids=None, min_score=RETRIEVAL_MIN_SCORE):
+        # Cosine similarity against every passage, lesson passages limited to course_ids when given
+        terms, counts = _counts(query)
+        if not len(terms) or not self.passages:
+            return []
+        query_weights = (1 + np.log(counts)) * self.idf[terms]
+        query_weights /= max(float(np.sqrt(np.dot(query_weights, query_weights))), 1e-12)
+        starts, ends = self.term_ptr[terms], self.term_ptr[terms + 1]
+        postings = np.concatenate([self.postings[s:e] for s, e in zip(starts, ends)])
+        if not len(postings):
+            return []
+        weights = np.concatenate([self.weights[s:e] * w for s, e, w in zip(starts, ends, query_weights)])
+        scores = np.bincount(postings, weights, minlength=len(self.passages))
+        if course_ids is not None:
+            allowed = np.isin(self.course_ids, np.fromiter(course_ids, dtype=np.int64))
+            scores[self.is_lesson & ~allowed] = 0
+        top = np.argpartition(-scores, min(k, len(scores) - 1))[:k]
+        top = top[np.argsort(-scores[top])]
+        return [dict(self.passages[i], score=round(float(scores[i]), 4)) for i in top if scores[i] >= min_score]
+
+
+def load_index(index_dir=RETRIEVAL_INDEX_DIR):
+    version_dir = _current_dir(Path(index_dir))
+    return RetrievalIndex(version_dir) if version_dir is not None else None
+
+
+_loaded = {'index': None, 'checked': 0.0}
+_load_lock = threading.Lock()
+
+
+def get_index(index_dir=RETRIEVAL_INDEX_DIR):
+    # The loaded index is shared by all threads, CURRENT is re-read at most every RELOAD_CHECK_SECONDS
+    now = time.monotonic()
+    if _loaded['index'] is not None and now - _loaded['checked'] < RELOAD_CHECK_SECONDS:
+        return _loaded['index']
+    with _load_lock:
+        _loaded['checked'] = now
+        version_dir = _current_dir(Path(index_dir))
+        if version_dir is None:
+            _loaded['index'] = None
+        elif _loaded['index'] is None or _loaded['index'].version_dir != version_dir:
+            _loaded['index'] = RetrievalIndex(version_dir)
+    return _loaded['index']
+
+
+def retrieve(query, course_ids=None, k=RETRIEVAL_TOP_K):
+    index = get_index()
+    return index.search(query, k=k, course_ids=course_ids) if index is not None else []
+
+
+def ai_grounding(user, prompt):
+    # Lesson excerpts only come from courses the user is enrolled in or teaches,
+    # everyone can be pointed at published course descriptions
+    return retrieve(prompt, course_ids=get_entitlements(user).courses)
@@ -0,0 +1,84 @@
+import heapq
+import logging
+from datetime import timedelta
+
+from django.db import transaction
+from django.utils import timezone
+
+from .email_utils import backoff_delay
+from .models import Lesson
+from .notification_utils import fan_out_lesson_release
+
+logger = logging.getLogger(__name__)
+
+
+# Release a due lesson and notify its students. The row lock makes a second
+# scheduler wait and then find the lesson released; marking it in the same
+# transaction as the fan-out leaves it due again if the fan-out fails.
+def release_lesson(lesson_id, now=None):
+    now = now or timezone.now()
+    with transaction.atomic():
+        lesson = (
+            Lesson.objects.select_for_update(of=('self',)).select_related('course')
+            .filter(pk=lesson_id, released_at__isnull=True, release_date__lte=now)
+            .first()
+        )
+        if lesson is None:
+            return False
+        fan_out_lesson_release(lesson)
+        Lesson.objects.filter(pk=lesson_id).update(released_at=now)
+    return True
+
+
+class LessonReleaseScheduler:
+    # Min-heap of (release_date, lesson_id) for unreleased lessons due within the
+    # lookahead window. Each resync is an index range scan over that window only.
+    # A release that fails is retried with exponential backoff, not on every tick.
+
+    def __init__(self, lookahead=timedelta(minutes=10)):
+        self.lookahead = lookahead
+        self.heap = []
+        self.scheduled = {}
+        # lesson_id: failed attempts, for lessons waiting for their retry
+        self.failures = {}
+
+    def sync(self, now=None):
+        now = now or timezone.now()
+        rows = Lesson.objects.filter(
+            released_at__isnull=True, release_date__lte=now + self.lookahead
+        ).values_list('id', 'release_date')
+        added = 0
+        for lesson_id, release_date in rows.iterator(chunk_size=2000):
+            if lesson_id in self.failures:
+                # Scheduled at its retry time instead
+                continue
+            if self.scheduled.get(lesson_id) != release_date:
+                # A moved release date leaves a stale heap entry that is skipped on pop
+                self.scheduled[lesson_id] = release_date
+                heapq.heappush(self.heap, (release_date, lesson_id))
+                added += 1
+        return added
+
+    def next_due(self):
+        return self.heap[0][0] if self.heap else None
+
+    def release_due(self, now=None):
+        now = now or timezone.now()
+        released = 0
+        while self.heap and self.heap[0][0] <= now:
+            release_date, lesson_id = heapq.heappop(self.heap)
+            if self.scheduled.get(lesson_id) != release_date:
+                continue
+            del self.scheduled[lesson_id]
+            attempts = self.failures.pop(lesson_id, 0)
+            try:
+                if release_lesson(lesson_id, now):
+                    released += 1
+            except Exception as e:
+                attempts += 1
+                retry_at = now + backoff_delay(attempts)
+                logger.error("Error releasing lesson %s (attempt %s, retrying at %s): %s", lesson_id, attempts, retry_at, e, exc_info=True)
+                self.failures[lesson_id] = attempts
+                self.scheduled[lesson_id] = retry_at
+                heapq.heappush(self.heap, (retry_at, lesson_id))
+        return released
@@ -0,0 +1,171 @@
+import re
+import unicodedata
+
+from django.db import connection
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Course, Lesson
+
+SEARCH_TABLE = 'core_search_index'
+
+# Hausa hooked letters and the glottal apostrophe are folded away on both sides,
+# so a learner typing on a plain keyboard ("kasa", "ya") still finds "ƙasa", "ʼya"
+HAUSA_FOLD = str.maketrans({
+    'ɓ': 'b', 'Ɓ': 'b', 'ɗ': 'd', 'Ɗ': 'd', 'ƙ': 'k', 'Ƙ': 'k', 'ƴ': 'y', 'Ƴ': 'y',
+    'ʼ': '', '’': '', '‘': '', "'": '',
+})
+TOKEN_RE = re.compile(r'\w+')
+
+
+def normalize_text(text):
+    return unicodedata.normalize('NFKC', text or '').translate(HAUSA_FOLD).lower()
+
+
+def query_tokens(query):
+    return TOKEN_RE.findall(normalize_text(query))[:10]
+
+
+# Rows are keyed by an encoded rowid so every incremental update is a primary key write
+def _row_id(kind, object_id):
+    return object_id * 2 + (1 if kind == 'lesson' else 0)
+
+
+def _upsert(kind, object_id, course_id, title, body):
+    row = [_row_id(kind, object_id), kind, object_id, course_id, normalize_text(title), normalize_text(body)]
+    with connection.cursor() as cursor:
+        if connection.vendor == 'sqlite':
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE rowid = %s', [row[0]])
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (rowid, kind, object_id, course_id, title, body) VALUES (%s, %s, %s, %s, %s, %s)', row
+            )
+        elif connection.vendor == 'postgresql':
+            cursor.execute(
+                f'INSERT INTO {SEARCH_TABLE} (id, kind, object_id, course_id, title, body, document) '
+                "VALUES (%s, %s, %s, %s, %s, %s, setweight(to_tsvector('simple', %s), 'A') || setweight(to_tsvector('simple', %s), 'B')) "
+                'ON CONFLICT (id) DO UPDATE SET course_id = EXCLUDED.course_id, title = EXCLUDED.title, '
+                'body = EXCLUDED.body, document = EXCLUDED.document',
+                row + [row[4], row[5]],
+            )
+
+
+def _delete(kind, object_id):
+    column = 'rowid' if connection.vendor == 'sqlite' else 'id'
+    if connection.vendor in ('sqlite', 'postgresql'):
+        with connection.cursor() as cursor:
+            cursor.execute(f'DELETE FROM {SEARCH_TABLE} WHERE {column} = %s', [_row_id(kind, object_id)])
+
+
+def index_course(course):
+    _upsert('course', course.id, course.id, course.title, f'{course.category} {course.description}')
+
+
+def index_lesson(lesson):
+    _upsert('lesson', lesson.id, lesson.course_id, lesson.title, lesson.content)
+
+
+def remove_course(course):
+    _delete('course', course.id)
+
+
+def remove_lesson(lesson):
+    _delete('lesson', lesson.id)
+
+
+# Migrations pass their historical models in
+def rebuild_index(batch_size=2000, course_model=Course, lesson_model=Lesson):
+    if connection.vendor not in ('sqlite', 'postgresql'):
+        return
+    with connection.cursor() as cursor:
+        cursor.execute(f'DELETE FROM {SEARCH_TABLE}')
+    for course in course_model.objects.only('id', 'title', 'category', 'description').iterator(chunk_size=batch_size):
+        index_course(course)
+    for lesson in lesson_model.objects.only('id', 'course_id', 'title', 'content').iterator(chunk_size=batch_size):
+        index_lesson(lesson)
+
+
+def _visible_sql(alias, now, lesson_courses):
+    # Only published courses and lessons whose release date has passed are searchable,
+    # and lessons only in the courses the caller may read. Returns (sql, params).
+    lesson_courses = sorted(lesson_courses)
+    readable = f"{alias}.course_id IN ({', '.join(['%s'] * len(lesson_courses))})" if lesson_courses else '1 = 0'
+    sql = (
+        f'JOIN core_course c ON c.id = {alias}.course_id '
+        f"LEFT JOIN core_lesson l ON {alias}.kind = 'lesson' AND l.id = {alias}.object_id "
+        f"WHERE c.status = 'published' AND ({alias}.kind = 'course' OR (l.release_date <= %s AND {readable}))"
+    )
+    return sql, [now, *lesson_courses]
+
+
+def search(query, limit=20, lesson_courses=()):
+    # lesson_courses are the courses whose lessons may be returned, snippets quote their bodies
+    tokens = query_tokens(query)
+    if not tokens:
+        return []
+    now = timezone.now()
+    if connection.vendor == 'sqlite':
+        # The last token is a prefix match (search as you type); title hits weigh 10x body hits
+        match = ' '.join(f'"{token}"' for token in tokens[:-1]) + f' "{tokens[-1]}"*'
+        # FTS5 functions and MATCH need the bare table name, so it is not aliased here
+        t = SEARCH_TABLE
+        visible, visible_params = _visible_sql(t, now, lesson_courses)
+        # Visibility and rank apply to every match before the limit, so the best
+        # published hits are found however many draft or unreleased rows also match
+        sql = (
+            f"SELECT {t}.kind, {t}.object_id, {t}.course_id, snippet({t}, 4, '[', ']', '…', 12), "
+            f'bm25({t}, 0, 0, 0, 10.0, 1.0) AS score '
+            f'FROM {t} {visible} AND {t} MATCH %s ORDER BY score LIMIT %s'
+        )
+        params = [*visible_params, match, limit]
+    elif connection.vendor == 'postgresql':
+        match = ' & '.join(tokens[:-1] + [f'{tokens[-1]}:*'])
+        visible, visible_params = _visible_sql('s', now, lesson_courses)
+        sql = (
+            "SELECT s.kind, s.object_id, s.course_id, ts_headline('simple', s.body, q, 'StartSel=[, StopSel=], MaxWords=12, MinWords=4'), "
+            '-ts_rank(s.document, q) AS score '
+            f"FROM {SEARCH_TABLE} s CROSS JOIN to_tsquery('simple', %s) q {visible} AND s.document @@ q "
+            'ORDER BY score LIMIT %s'
+        )
+        params = [match, *visible_params, limit]
+    else:
+        return _fallback_search(tokens, now, limit, lesson_courses)
+    with connection.cursor() as cursor:
+        cursor.execute(sql, params)
+        rows = cursor.fetchall()
+    return _with_titles(rows)
+
+
+def _fallback_search(tokens, now, limit, lesson_courses):
+    # Unranked substring search for databases without a full-text engine
+    course_filter, lesson_filter = Q(), Q()
+    for token in tokens:
+        course_filter &= Q(title__icontains=token) | Q(description__icontains=token)
+        lesson_filter &= Q(title__icontains=token) | Q(content__icontains=token)
+    rows = [('course', c.id, c.id, '', 0) for c in Course.objects.filter(course_filter, status='published')[:limit]]
+    rows += [
+        ('lesson', lesson.id, lesson.course_id, '', 0)
+        for lesson in Lesson.objects.filter(
+            lesson_filter, course__status='published', course_id__in=lesson_courses, release_date__lte=now,
+        )[:limit]
+    ]
+    return _with_titles(rows[:limit])
+
+
+def _with_titles(rows):
+    # Titles come from the models, the index only holds folded text
+    course_ids = {row[2] for row in rows}
+    lesson_ids = [row[1] for row in rows if row[0] == 'lesson']
+    courses = dict(Course.objects.filter(id__in=course_ids).values_list('id', 'title'))
+    lessons = dict(Lesson.objects.filter(id__in=lesson_ids).values_list('id', 'title'))
+    return [
+        {
+            'type': kind,
+            'id': object_id,
+            'course_id': course_id,
+            'course_title': courses.get(course_id, ''),
+            'title': courses.get(object_id, '') if kind == 'course' else lessons.get(object_id, ''),
+            'snippet': snippet,
+            'score': round(-score, 6),
+        }
+        for kind, object_id, course_id, snippet, score in rows
+    ]
@@ -1,86 +1,165 @@
 from rest_framework import serializers
-from .models import User, Course, Enrollment, Progress, Achievement, Lesson, Quiz, Question, Option, QuizAttempt, Payment, Certificate, Notification, SupportTicket, Service, TeamMember
+from .models import User, Course, Enrollment, Progress, Achievement, Lesson, Quiz, Question, Option, QuizAttempt, Payment, Certificate, CertificateJob, Notification, SupportTicket, Service, TeamMember, ChatSession, ChatMessage
 from django.contrib.auth import get_user_model
 
-class UserSerializer(serializers.ModelSerializer):
+class DynamicFieldsModelSerializer(serializers.ModelSerializer):
+    # Sparse fieldsets for GET requests on the top level serializer:
+    #   ?fields=id,title     only render these fields
+    #   ?expand=instructor   only nest the listed Meta.expandable_fields, the rest become ids
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        request = self.context.get('request')
+        if request is None or request.method != 'GET':
+            return
+        params = request.query_params
+        if 'expand' in params:
+            expand = set(filter(None, params['expand'].split(',')))
+            for name in getattr(self.Meta, 'expandable_fields', ()):
+                if name not in expand and name in self.fields:
+                    self.fields[name] = serializers.PrimaryKeyRelatedField(read_only=True)
+        if params.get('fields'):
+            allowed = set(params['fields'].split(','))
+            for name in set(self.fields) - allowed:
+                self.fields.pop(name)
+
+class UserSerializer(DynamicFieldsModelSerializer):
     name = serializers.CharField(source='first_name', required=False)
     class Meta:
         model = get_user_model()
         fields = ['id', 'username', 'email', 'role', 'avatar', 'language', 'name']
 
-class CourseSerializer(serializers.ModelSerializer):
+class CourseSerializer(DynamicFieldsModelSerializer):
     instructor = UserSerializer(read_only=True)
     class Meta:
         model = Course
         fields = '__all__'
+        read_only_fields = ('rating', 'rating_sum', 'rating_count', 'students_count')
+        expandable_fields = ('instructor',)
 
-class EnrollmentSerializer(serializers.ModelSerializer):
+class EnrollmentSerializer(DynamicFieldsModelSerializer):
     course = CourseSerializer(read_only=True)
     class Meta:
         model = Enrollment
         fields = '__all__'
+        expandable_fields = ('course',)
 
-class ProgressSerializer(serializers.ModelSerializer):
+class ProgressSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Progress
         fields = '__all__'
+        # Derived from lesson completions and heartbeats, see core.progress
+        read_only_fields = ['lessons_completed', 'last_accessed']
 
-class AchievementSerializer(serializers.ModelSerializer):
+class AchievementSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Achievement
         fields = '__all__'
 
-class LessonSerializer(serializers.ModelSerializer):
+class LessonSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Lesson
         fields = '__all__'
+        read_only_fields = ['content_hash']
 
-class QuizSerializer(serializers.ModelSerializer):
+class LessonOutlineSerializer(LessonSerializer):
+    # Lesson lists leave the body out, it comes from /lessons/<id>/content/
+    class Meta(LessonSerializer.Meta):
+        fields = None
+        exclude = ['content']
+
+class QuizSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Quiz
         fields = '__all__'
 
-class QuestionSerializer(serializers.ModelSerializer):
+class QuestionSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Question
         fields = '__all__'
 
-class OptionSerializer(serializers.ModelSerializer):
+class OptionSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Option
         fields = '__all__'
 
-class QuizAttemptSerializer(serializers.ModelSerializer):
+    def to_representation(self, instance):
+        data = super().to_representation(instance)
+        # context['answer_courses'] holds the courses whose answers the caller may see, None for all
+        answer_courses = self.context.get('answer_courses')
+        if answer_courses is not None and 'is_correct' in data:
+            course_id = getattr(instance, 'course_id', None) or instance.question.quiz.lesson.course_id
+            if course_id not in answer_courses:
+                del data['is_correct']
+        return data
+
+class OptionDeliverySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Option
+        fields = ['id', 'text']
+
+class QuestionDeliverySerializer(serializers.ModelSerializer):
+    options = OptionDeliverySerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Question
+        fields = ['id', 'text', 'options']
+
+# A quiz as learners take it, is_correct is left out
+class QuizDeliverySerializer(serializers.ModelSerializer):
+    questions = QuestionDeliverySerializer(many=True, read_only=True)
+
+    class Meta:
+        model = Quiz
+        fields = ['id', 'lesson', 'title', 'questions']
+
+class QuizAttemptSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = QuizAttempt
         fields = '__all__'
+        # Graded on the server from answers, see core.grading
+        read_only_fields = ['user', 'score', 'correctness']
 
-class PaymentSerializer(serializers.ModelSerializer):
+class PaymentSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Payment
         fields = '__all__'
 
-class CertificateSerializer(serializers.ModelSerializer):
+class CertificateSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Certificate
         fields = '__all__'
 
-class NotificationSerializer(serializers.ModelSerializer):
+class CertificateJobSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = CertificateJob
+        exclude = ['user_ids']
+
+class NotificationSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Notification
         fields = '__all__'
 
-class SupportTicketSerializer(serializers.ModelSerializer):
+class ChatSessionSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = ChatSession
+        fields = ('id', 'title', 'created_at', 'updated_at')
+
+class ChatMessageSerializer(DynamicFieldsModelSerializer):
+    class Meta:
+        model = ChatMessage
+        fields = ('id', 'role', 'text', 'created_at')
+
+class SupportTicketSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = SupportTicket
         fields = '__all__'
 
-class ServiceSerializer(serializers.ModelSerializer):
+class ServiceSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = Service
         fields = '__all__'
 
-class TeamMemberSerializer(serializers.ModelSerializer):
+class TeamMemberSerializer(DynamicFieldsModelSerializer):
     class Meta:
         model = TeamMember
         fields = '__all__' 
\ No newline at end of file
@@ -0,0 +1,181 @@
+import json
+import zlib
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.utils import timezone
+from django.utils.dateparse import parse_datetime
+
+from .entitlements import get_entitlements
+from .grading import grade
+from .models import Enrollment, Lesson, Quiz, QuizAttempt, SyncEvent
+from .progress import complete_lessons, touch
+
+# Offline clients queue learner events and send them in one (optionally gzipped)
+# POST to /api/sync/. Every event carries a client-made key "k", a type "t" and
+# the time "ts" it happened (epoch ms or ISO 8601):
+#   {"k": "...", "t": "lesson_completed", "ts": ..., "lesson": 12}
+#   {"k": "...", "t": "heartbeat", "ts": ..., "lesson": 12}   (or "course": 3)
+#   {"k": "...", "t": "quiz_answered", "ts": ..., "quiz": 4, "answers": {"7": [21]}}
+# Keys are stored per user, so a batch resent after a dropped response is
+# reported as duplicate instead of being applied again.
+SYNC_MAX_EVENTS = getattr(settings, 'SYNC_MAX_EVENTS', 500)
+SYNC_MAX_BYTES = getattr(settings, 'SYNC_MAX_BYTES', 1024 * 1024)
+EVENT_TYPES = ('lesson_completed', 'heartbeat', 'quiz_answered')
+
+
+class SyncError(Exception):
+    pass
+
+
+class Rejected(Exception):
+    pass
+
+
+def decode_batch(body, content_encoding=''):
+    if content_encoding == 'gzip':
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        try:
+            body = decompressor.decompress(body, SYNC_MAX_BYTES)
+        except zlib.error:
+            raise SyncError('Body is not valid gzip.')
+        if decompressor.unconsumed_tail:
+            raise SyncError('Batch is too large.')
+    elif content_encoding not in ('', 'identity'):
+        raise SyncError(f'Unsupported Content-Encoding: {content_encoding}.')
+    if len(body) > SYNC_MAX_BYTES:
+        raise SyncError('Batch is too large.')
+    try:
+        payload = json.loads(body)
+    except ValueError:
+        raise SyncError('Body is not valid JSON.')
+    events = payload.get('events') if isinstance(payload, dict) else payload
+    if not isinstance(events, list) or not all(isinstance(event, dict) for event in events):
+        raise SyncError('Expected a list of event objects.')
+    if len(events) > SYNC_MAX_EVENTS:
+        raise SyncError(f'At most {SYNC_MAX_EVENTS} events per batch.')
+    return events
+
+
+def _client_time(value, now):
+    if value is None:
+        return None
+    if isinstance(value, bool):
+        raise Rejected('Invalid ts.')
+    if isinstance(value, (int, float)):
+        try:
+            moment = datetime.fromtimestamp(value / 1000, tz=dt_timezone.utc)
+        except (OSError, OverflowError, ValueError):
+            # Out of the platform's range, or NaN
+            raise Rejected('Invalid ts.')
+    else:
+        moment = parse_datetime(str(value))
+        if moment is None:
+            raise Rejected('Invalid ts.')
+        if timezone.is_naive(moment):
+            moment = timezone.make_aware(moment, dt_timezone.utc)
+    # Client clocks drift, nothing is recorded as happening in the future
+    return min(moment, now)
+
+
+def _id(event, name):
+    try:
+        if isinstance(event[name], bool):
+            raise TypeError
+        return int(event[name])
+    except (KeyError, TypeError, ValueError, OverflowError):
+        raise Rejected(f'"{name}" must be an id.')
+
+
+def _key(event):
+    # Keys are client strings (or numbers), anything else counts as missing
+    key = event.get('k')
+    if isinstance(key, bool) or not isinstance(key, (str, int)):
+        return ''
+    return str(key)[:64]
+
+
+def apply_events(user, events):
+    # Everything in one transaction. Returns the compact result and the quiz attempts created.
+    now = timezone.now()
+    result = {'ok': [], 'dup': [], 'err': {}}
+    with transaction.atomic():
+        # Syncs of one learner run one at a time, so parallel resends cannot both apply an event
+        list(get_user_model().objects.select_for_update().filter(pk=user.pk).values_list('pk'))
+        keys = [_key(event) for event in events]
+        seen = set(SyncEvent.objects.filter(user=user, key__in=[k for k in keys if k]).values_list('key', flat=True))
+
+        lesson_ids, quiz_ids, course_ids = set(), set(), set()
+        for event in events:
+            for name, ids in (('lesson', lesson_ids), ('quiz', quiz_ids), ('course', course_ids)):
+                if isinstance(event.get(name), (int, str)) and str(event[name]).isdigit() and int(event[name]) < 2 ** 63:
+                    ids.add(int(event[name]))
+        lessons = {
+            lesson['id']: lesson
+            for lesson in Lesson.objects.filter(id__in=lesson_ids).values('id', 'course_id', 'release_date')
+        }
+        quizzes = dict(Quiz.objects.filter(id__in=quiz_ids).values_list('id', 'lesson__course_id'))
+        course_ids |= {lesson['course_id'] for lesson in lessons.values()}
+        enrollments = dict(
+            Enrollment.objects.filter(student=user, course_id__in=course_ids).order_by('id').values_list('course_id', 'id')
+        )
+        entitlements = get_entitlements(user)
+
+        completed, touched, attempts, records = [], {}, [], []
+        for index, (event, key) in enumerate(zip(events, keys)):
+            if not key:
+                result['err'][str(index)] = 'Missing key "k".'
+                continue
+            if key in seen:
+                result['dup'].append(key)
+                continue
+            seen.add(key)
+            kind = event.get('t')
+            try:
+                if kind not in EVENT_TYPES:
+                    raise Rejected(f'Unknown event type {kind!r}.')
+                client_time = _client_time(event.get('ts'), now)
+                if kind == 'quiz_answered':
+                    quiz_id = _id(event, 'quiz')
+                    if quiz_id not in quizzes:
+                        raise Rejected('Quiz not found.')
+                    # Same rule as POST /api/quiz-attempts/
+                    course_id = quizzes[quiz_id]
+                    if not (course_id in entitlements.active or course_id in entitlements.instructs or user.is_staff):
+                        raise Rejected('You must be enrolled in the course to attempt this quiz.')
+                    try:
+                        score, answers, correctness = grade(quiz_id, event.get('answers') or {})
+                    except (TypeError, ValueError, OverflowError) as e:
+                        raise Rejected(str(e))
+                    attempts.append(QuizAttempt(user=user, quiz_id=quiz_id, score=score, answers=answers, correctness=correctness))
+                else:
+                    if kind == 'heartbeat' and 'lesson' not in event:
+                        course_id = _id(event, 'course')
+                    else:
+                        lesson = lessons.get(_id(event, 'lesson'))
+                        if lesson is None or lesson['release_date'] is None or lesson['release_date'] > now:
+                            raise Rejected('Lesson not found.')
+                        course_id = lesson['course_id']
+                    enrollment_id = enrollments.get(course_id)
+                    if enrollment_id is None:
+                        raise Rejected('Not enrolled in this course.')
+                    moment = client_time or now
+                    if kind == 'lesson_completed':
+                        completed.append((enrollment_id, lesson['id'], moment))
+                    touched[enrollment_id] = max(touched.get(enrollment_id, moment), moment)
+            except Rejected as e:
+                result['err'][key] = str(e)
+                records.append(SyncEvent(user=user, key=key, type=str(kind)[:30], status='rejected', error=str(e)[:255]))
+                continue
+            result['ok'].append(key)
+            records.append(SyncEvent(user=user, key=key, type=kind, status='applied', client_time=client_time))
+
+        if completed:
+            complete_lessons(completed)
+        for enrollment_id, moment in touched.items():
+            touch(enrollment_id, moment)
+        attempts = QuizAttempt.objects.bulk_create(attempts)
+        SyncEvent.objects.bulk_create(records)
+    return result, attempts
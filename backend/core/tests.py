@@ -1,3 +1,1323 @@
-from django.test import TestCase
+import gzip
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import timedelta
+from unittest import mock
 
-# Create your tests here.
+import httpx
+import reportlab
+import requests
+from requests.adapters import BaseAdapter
+
+from django.core import mail
+from django.core.mail.backends import locmem
+
+from asgiref.sync import async_to_sync
+from channels.layers import get_channel_layer
+from django.core.cache import cache, caches
+from django.core.exceptions import ValidationError
+from django.db import connection
+from django.db.models import QuerySet
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+
+from . import admission, catalog_cache, certificates, email_utils, gemini_utils, grading, progress, search, webhooks
+from .ai_cache import cache_stats, local_cache, prompt_cache_key, stats_counter
+from .catalog_cache import cache_timeout
+from .certificate_templates import DEFAULT_SPEC, static_layer, template_spec
+from .certificates import process_certificate_jobs, render_certificate_pdf
+from .chat import CHAT_CONTEXT_TOKENS, estimate_tokens
+from .course_stats import adjust_students_count, recompute_course_stats
+from .entitlements import ENTITLEMENTS_TIMEOUT, get_entitlements, load_entitlements
+from .notification_utils import fan_out_lesson_release
+from .scheduler import LessonReleaseScheduler, release_lesson
+from .retrieval import build_index, load_index
+from .llm_backends import GeminiBackend, LLMBackend, get_backend
+from .upstream import UpstreamClient, UpstreamUnavailable
+from .models import User, Course, Enrollment, Progress, Lesson, Quiz, Question, Option, QuizAttempt, Payment, Certificate, CertificateJob, CertificateTemplate, Notification, ChatSession, EmailOutbox, CourseRating, PaymentWebhookEvent, SyncEvent
+
+# Query budgets per endpoint. They must not depend on the number of rows, so a
+# serializer that starts touching a relation lazily fails here at 100 and 1000 rows.
+LIST_BUDGET = {
+    'users': 1,
+    'courses': 1,
+    'enrollments': 1,
+    'progress': 1,
+    'lessons': 1,
+    'quizzes': 1,
+    'questions': 1,
+    'options': 1,
+    'quiz-attempts': 1,
+    'payments': 1,
+    'certificates': 1,
+    'notifications': 1,
+}
+STUDENT_LIST_BUDGET = {
+    'courses': 1,
+    'enrollments': 1,
+    'lessons': 1,
+    'quizzes': 1,
+    'quiz-attempts': 1,
+    'notifications': 1,
+}
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class QueryBudgetTests(TestCase):
+    rows = 10
+
+    @classmethod
+    def setUpTestData(cls):
+        # bulk_create skips the notification signals, only the rows under test are created
+        n = cls.rows
+        cls.admin = User.objects.create(username='admin', email='admin@example.com', role='admin', is_staff=True)
+        cls.student = User.objects.create(username='student', email='student@example.com')
+        instructors = User.objects.bulk_create([
+            User(username=f'instructor-{i}', email=f'instructor-{i}@example.com', role='instructor') for i in range(n)
+        ])
+        courses = Course.objects.bulk_create([
+            Course(title=f'Course {i}', description='', thumbnail='https://example.com/t.png', price=0, category='tech',
+                   level='beginner', duration='1h', instructor=instructors[i], status='published')
+            for i in range(n)
+        ])
+        enrollments = Enrollment.objects.bulk_create([Enrollment(student=cls.student, course=c) for c in courses])
+        Progress.objects.bulk_create([Progress(enrollment=e) for e in enrollments])
+        lessons = Lesson.objects.bulk_create([
+            Lesson(course=c, title=f'Lesson {i}', order=1, release_date=timezone.now()) for i, c in enumerate(courses)
+        ])
+        quizzes = Quiz.objects.bulk_create([Quiz(lesson=lesson, title=lesson.title) for lesson in lessons])
+        questions = Question.objects.bulk_create([Question(quiz=q, text='?') for q in quizzes])
+        Option.objects.bulk_create([Option(question=q, text='!', is_correct=True) for q in questions])
+        QuizAttempt.objects.bulk_create([QuizAttempt(user=cls.student, quiz=q, score=1) for q in quizzes])
+        Payment.objects.bulk_create([Payment(user=cls.student, course=c, amount=0, status='paid') for c in courses])
+        Certificate.objects.bulk_create([Certificate(user=cls.student, course=c) for c in courses])
+        Notification.objects.bulk_create([Notification(user=cls.student, message='hi') for _ in range(n)])
+        Notification.objects.bulk_create([Notification(user=cls.admin, message='hi') for _ in range(n)])
+
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+
+    def assertListBudget(self, user, budget):
+        # Budgets are for warm requests, entitlements are loaded once per user and cached
+        get_entitlements(user)
+        self.client.force_authenticate(user)
+        for endpoint, queries in budget.items():
+            for query in ('', '&expand=', '&fields=id'):
+                with self.subTest(endpoint=endpoint, query=query), self.assertNumQueries(queries):
+                    response = self.client.get(f'/api/{endpoint}/?page_size=200{query}')
+                    self.assertEqual(response.status_code, 200)
+                    self.assertGreaterEqual(len(response.json()['results']), min(self.rows, 200))
+
+    def test_admin_list_query_budget(self):
+        self.assertListBudget(self.admin, LIST_BUDGET)
+
+    def test_student_list_query_budget(self):
+        self.assertListBudget(self.student, STUDENT_LIST_BUDGET)
+
+    def test_detail_query_budget(self):
+        self.client.force_authenticate(self.admin)
+        for endpoint in LIST_BUDGET:
+            pk = self.client.get(f'/api/{endpoint}/?page_size=1').json()['results'][0]['id']
+            with self.subTest(endpoint=endpoint), self.assertNumQueries(1):
+                self.assertEqual(self.client.get(f'/api/{endpoint}/{pk}/').status_code, 200)
+
+
+class QueryBudget100Tests(QueryBudgetTests):
+    rows = 100
+
+
+class QueryBudget1000Tests(QueryBudgetTests):
+    rows = 1000
+
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class PaginationTests(TestCase):
+    def setUp(self):
+        self.admin = User.objects.create(username='admin', email='admin@example.com', role='admin', is_staff=True)
+        self.course = Course.objects.create(
+            title='Python', description='', thumbnail='https://example.com/t.png', price=0, category='tech',
+            level='beginner', duration='1h', instructor=self.admin, status='published',
+        )
+        # Written last to first, listed in outline order
+        for order in (5, 4, 3, 2, 1):
+            Lesson.objects.create(course=self.course, title=f'Lesson {order}', order=order)
+        Enrollment.objects.create(student=self.admin, course=self.course)
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def titles(self, url):
+        titles = []
+        while url:
+            page = self.client.get(url).json()
+            self.assertLessEqual(len(page['results']), 2)
+            titles += [lesson['title'] for lesson in page['results']]
+            url = page['next']
+        return titles
+
+    def test_cursor_pages_follow_the_view_ordering(self):
+        other = Course.objects.create(
+            title='Go', description='', thumbnail='https://example.com/t.png', price=0, category='tech',
+            level='beginner', duration='1h', instructor=self.admin, status='published',
+        )
+        Lesson.objects.create(course=other, title='Go 1', order=1)
+        # A course's outline, in order
+        self.assertEqual(self.titles(f'/api/lessons/?course={self.course.id}&page_size=2'), [f'Lesson {order}' for order in range(1, 6)])
+        # All courses by primary key, so no page sorts the whole table
+        self.assertEqual(self.titles('/api/lessons/?page_size=2'), [f'Lesson {order}' for order in range(5, 0, -1)] + ['Go 1'])
+        page = self.client.get('/api/courses/?page_size=1').json()
+        self.assertEqual(set(page), {'next', 'previous', 'results'})
+
+    def test_sparse_fields_and_expand(self):
+        course = self.client.get('/api/courses/?fields=id,title').json()['results'][0]
+        self.assertEqual(set(course), {'id', 'title'})
+        # Without ?expand everything nests, with it only the listed relations do
+        enrollment = self.client.get('/api/enrollments/').json()['results'][0]
+        self.assertEqual(enrollment['course']['instructor']['id'], self.admin.id)
+        enrollment = self.client.get('/api/enrollments/?expand=').json()['results'][0]
+        self.assertEqual(enrollment['course'], self.course.id)
+        enrollment = self.client.get('/api/enrollments/?expand=course').json()['results'][0]
+        self.assertEqual(enrollment['course']['title'], 'Python')
+        self.assertEqual(enrollment['course']['instructor']['id'], self.admin.id)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class CatalogCacheTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        self.course = Course.objects.create(
+            title='Python', description='', thumbnail='https://example.com/t.png', price=0, category='tech',
+            level='beginner', duration='1h', instructor=self.instructor, status='published',
+        )
+
+    def test_warm_catalog_reads_skip_the_database(self):
+        self.client.get('/api/courses/')
+        self.client.get(f'/api/courses/{self.course.id}/')
+        with self.assertNumQueries(0):
+            self.assertEqual(self.client.get('/api/courses/').json()['results'][0]['title'], 'Python')
+            self.assertEqual(self.client.get(f'/api/courses/{self.course.id}/').json()['title'], 'Python')
+
+    def test_course_and_instructor_changes_invalidate_the_catalog(self):
+        self.client.get('/api/courses/')
+        self.course.title = 'Python 101'
+        self.course.save()
+        self.assertEqual(self.client.get('/api/courses/').json()['results'][0]['title'], 'Python 101')
+        self.instructor.first_name = 'Amina'
+        self.instructor.save()
+        self.assertEqual(self.client.get('/api/courses/').json()['results'][0]['instructor']['name'], 'Amina')
+
+    def test_local_memory_cache_only_keeps_payloads_briefly(self):
+        self.assertEqual(cache_timeout(86400), catalog_cache.LOCAL_CACHE_TIMEOUT)
+        redis = {'default': {'BACKEND': 'django.core.cache.backends.redis.RedisCache', 'LOCATION': 'redis://127.0.0.1:6379'}}
+        with override_settings(CACHES=redis):
+            self.assertEqual(cache_timeout(86400), 86400)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class CourseStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        self.course = Course.objects.create(
+            title='Python', description='', thumbnail='https://example.com/t.png', price=0, category='tech',
+            level='beginner', duration='1h', instructor=instructor, status='published',
+        )
+        self.students = [User.objects.create(username=f's{i}', email=f's{i}@example.com') for i in range(3)]
+        self.enrollments = [Enrollment.objects.create(student=s, course=self.course) for s in self.students]
+        self.client = APIClient()
+
+    def stats(self):
+        self.course.refresh_from_db()
+        return self.course.students_count, self.course.rating_sum, self.course.rating_count, self.course.rating
+
+    def rate(self, student, score):
+        self.client.force_authenticate(student)
+        return self.client.post(f'/api/courses/{self.course.id}/rate/', {'score': score})
+
+    def test_counters_follow_enrollments_and_ratings(self):
+        self.assertEqual(self.stats(), (3, 0, 0, 0))
+        self.enrollments[2].delete()
+        adjust_students_count(self.course.id, -5)
+        self.assertEqual(self.stats()[0], 0)
+        self.assertEqual(self.rate(self.students[0], 4).data, {'rating': 4.0, 'rating_count': 1})
+        # Rating again replaces the score instead of adding one
+        self.assertEqual(self.rate(self.students[0], 2).data, {'rating': 2.0, 'rating_count': 1})
+        self.assertEqual(self.rate(self.students[1], 5).data, {'rating': 3.5, 'rating_count': 2})
+        self.assertEqual(self.rate(self.students[2], 5).status_code, 403)
+        self.assertEqual(self.rate(self.students[1], 6).status_code, 400)
+        CourseRating.objects.get(user=self.students[1]).delete()
+        self.assertEqual(self.stats()[1:], (2, 1, 2.0))
+
+    def test_a_lost_race_on_the_first_rating_becomes_an_update(self):
+        self.rate(self.students[0], 4)
+        first = QuerySet.first
+        calls = []
+
+        def missed_the_concurrent_insert(queryset):
+            if queryset.model is CourseRating:
+                calls.append(queryset)
+                if len(calls) == 1:
+                    return None
+            return first(queryset)
+
+        with mock.patch.object(QuerySet, 'first', missed_the_concurrent_insert):
+            self.assertEqual(self.rate(self.students[0], 2).data, {'rating': 2.0, 'rating_count': 1})
+        self.assertEqual(self.stats()[1:], (2, 1, 2.0))
+
+    def test_recompute_repairs_drift(self):
+        self.rate(self.students[0], 4)
+        Course.objects.filter(pk=self.course.pk).update(students_count=99, rating_sum=7, rating_count=3, rating=1.0)
+        self.assertEqual(recompute_course_stats(), 1)
+        self.assertEqual(self.stats(), (3, 4, 1, 4.0))
+        self.assertEqual(recompute_course_stats(), 0)
+
+    def test_enrollment_bumps_are_spread_out(self):
+        version = catalog_cache.catalog_version()
+        Enrollment.objects.create(student=self.students[0], course=self.course)
+        Enrollment.objects.create(student=self.students[1], course=self.course)
+        # Both land in the window opened by setUp's enrollments
+        self.assertEqual(catalog_cache.catalog_version(), version)
+        cache.delete(catalog_cache.COUNTS_THROTTLE_KEY)
+        self.assertEqual(catalog_cache.catalog_version(), version + 1)
+        self.assertEqual(catalog_cache.catalog_version(), version + 1)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class QuizDeliveryTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        course = Course.objects.create(
+            title='Python', description='Learn Python', thumbnail='https://example.com/t.png', price=0, is_free=True,
+            category='tech', level='beginner', duration='1h', instructor=instructor, status='published',
+        )
+        lesson = Lesson.objects.create(course=course, title='Quiz', order=1, lesson_type='quiz')
+        self.quiz = Quiz.objects.create(lesson=lesson, title='Basics')
+        for q in range(5):
+            question = Question.objects.create(quiz=self.quiz, text=f'Question {q}')
+            Option.objects.bulk_create([Option(question=question, text=f'Option {o}', is_correct=o == 0) for o in range(4)])
+        self.student = User.objects.create(username='student', email='student@example.com')
+        Enrollment.objects.create(student=self.student, course=course)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        self.url = f'/api/quizzes/{self.quiz.id}/deliver/'
+
+    def test_quiz_is_delivered_in_one_response_without_answers(self):
+        get_entitlements(self.student)
+        with self.assertNumQueries(3):
+            # Quiz lookup, questions and options
+            data = self.client.get(self.url).json()
+        self.assertEqual([len(q['options']) for q in data['questions']], [4] * 5)
+        self.assertNotIn('is_correct', json.dumps(data))
+        with self.assertNumQueries(1):
+            self.client.get(self.url)
+
+    def test_editing_an_option_serves_a_new_version(self):
+        self.client.get(self.url)
+        option = Option.objects.filter(question__quiz=self.quiz).first()
+        option.text = 'Changed'
+        option.save()
+        self.assertEqual(self.client.get(self.url).json()['questions'][0]['options'][0]['text'], 'Changed')
+        self.assertEqual(len(self.client.get('/api/options/', {'quiz': self.quiz.id}).json()['results']), 20)
+
+    def test_option_answers_are_only_listed_for_the_instructor(self):
+        self.assertEqual(APIClient().get('/api/options/', {'quiz': self.quiz.id}).json()['results'], [])
+        options = self.client.get('/api/options/', {'quiz': self.quiz.id}).json()['results']
+        self.assertEqual(len(options), 20)
+        self.assertNotIn('is_correct', options[0])
+        self.assertNotIn('is_correct', self.client.get(f'/api/options/{options[0]["id"]}/').json())
+        self.client.force_authenticate(self.quiz.lesson.course.instructor)
+        self.assertEqual(sum(o['is_correct'] for o in self.client.get('/api/options/', {'quiz': self.quiz.id}).json()['results']), 5)
+
+    def test_attempts_are_graded_on_the_server(self):
+        answers = {}
+        for i, question in enumerate(self.quiz.questions.order_by('id')):
+            options = list(question.options.order_by('id'))
+            answers[str(question.id)] = [options[0].id if i < 3 else options[1].id]
+        response = self.client.post('/api/quiz-attempts/', {'quiz': self.quiz.id, 'score': 100, 'answers': answers}, format='json')
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(response.data['score'], 60)
+        self.assertEqual(list(response.data['correctness'].values()), [True] * 3 + [False] * 2)
+        foreign = Option.objects.create(question=Question.objects.create(quiz=Quiz.objects.create(
+            lesson=Lesson.objects.create(course=self.quiz.lesson.course, title='Other', order=2), title='Other'), text='?'), text='x')
+        response = self.client.post('/api/quiz-attempts/', {'quiz': self.quiz.id, 'answers': {'1': [foreign.id]}}, format='json')
+        self.assertEqual(response.status_code, 400)
+
+    def test_questions_without_a_correct_option_are_never_right(self):
+        quiz = Quiz.objects.create(lesson=Lesson.objects.create(course=self.quiz.lesson.course, title='Draft', order=2), title='Draft')
+        Question.objects.create(quiz=quiz, text='Unfinished')
+        Option.objects.create(question=Question.objects.create(quiz=quiz, text='No answer yet'), text='Maybe')
+        # Left unanswered, they would match their empty answer key
+        score, _, correctness = grading.grade(quiz.id, {})
+        self.assertEqual(score, 0)
+        self.assertEqual(list(correctness.values()), [False, False])
+
+    def test_submitted_attempts_cannot_be_changed_by_learners(self):
+        question = self.quiz.questions.order_by('id').first()
+        wrong = question.options.order_by('id')[1]
+        response = self.client.post('/api/quiz-attempts/', {'quiz': self.quiz.id, 'answers': {str(question.id): [wrong.id]}}, format='json')
+        self.assertEqual(response.status_code, 201)
+        right = question.options.order_by('id')[0]
+        response = self.client.patch(f'/api/quiz-attempts/{response.data["id"]}/', {'answers': {str(question.id): [right.id]}}, format='json')
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(QuizAttempt.objects.get().score, 0)
+
+    def test_out_of_range_option_ids_are_rejected(self):
+        for option_id in (2 ** 70, -1, 'nan', 1e300):
+            response = self.client.post('/api/quiz-attempts/', {'quiz': self.quiz.id, 'answers': {'1': [option_id]}}, format='json')
+            self.assertEqual(response.status_code, 400)
+
+    def test_grade_many_needs_exactly_the_correct_options(self):
+        key = grading.answer_key(self.quiz.id)
+        question = self.quiz.questions.order_by('id').first()
+        right, wrong = question.options.order_by('id')[:2]
+        scores, correct = grading.grade_many(key, [[right.id], [right.id, wrong.id], [], [wrong.id, 10 ** 9]])
+        self.assertEqual(scores.tolist(), [20, 0, 0, 0])
+        self.assertEqual(correct[:, 0].tolist(), [True, False, False, False])
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class LessonContentTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        course = Course.objects.create(
+            title='Python', description='Learn Python', thumbnail='https://example.com/t.png', price=0, is_free=True,
+            category='tech', level='beginner', duration='1h', instructor=instructor, status='published',
+        )
+        released = timezone.now() - timedelta(days=1)
+        self.lesson = Lesson.objects.create(
+            course=course, title='Variables', order=1, lesson_type='text', release_date=released,
+            content='Variables name values. ' * 500,
+        )
+        self.student = User.objects.create(username='student', email='student@example.com')
+        Enrollment.objects.create(student=self.student, course=course)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+        self.url = f'/api/lessons/{self.lesson.id}/content/'
+
+    def test_lists_leave_the_body_out(self):
+        lesson = self.client.get('/api/lessons/').json()['results'][0]
+        self.assertEqual(lesson['title'], 'Variables')
+        self.assertNotIn('content', lesson)
+        self.assertIn('content', self.client.get(f'/api/lessons/{self.lesson.id}/').json())
+
+    def test_content_is_precompressed_and_revalidated(self):
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip, deflate')
+        self.assertEqual(response['Content-Encoding'], 'gzip')
+        self.assertEqual(gzip.decompress(response.content).decode(), self.lesson.content)
+        self.assertIn('Accept-Encoding', response['Vary'])
+        tag = response['ETag']
+        get_entitlements(self.student)
+        with self.assertNumQueries(1):
+            # Only the lesson lookup, the body comes compressed from the cache
+            response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 304)
+        plain = self.client.get(self.url, HTTP_ACCEPT_ENCODING='identity')
+        self.assertNotIn('Content-Encoding', plain)
+        self.assertNotEqual(plain['ETag'], tag)
+
+        self.lesson.content = 'Loops repeat. ' * 500
+        self.lesson.save()
+        response = self.client.get(self.url, HTTP_ACCEPT_ENCODING='gzip', HTTP_IF_NONE_MATCH=tag)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(gzip.decompress(response.content).decode(), self.lesson.content)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class SyncTests(TestCase):
+    def setUp(self):
+        instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        self.course = Course.objects.create(
+            title='Python', description='Learn Python', thumbnail='https://example.com/t.png', price=0, is_free=True,
+            category='tech', level='beginner', duration='1h', instructor=instructor, status='published',
+        )
+        past = timezone.now() - timedelta(days=1)
+        self.lessons = [Lesson.objects.create(course=self.course, title=f'Lesson {i}', order=i, release_date=past) for i in range(3)]
+        self.student = User.objects.create(username='student', email='student@example.com')
+        self.enrollment = Enrollment.objects.create(student=self.student, course=self.course)
+        self.client = APIClient()
+        self.client.force_authenticate(self.student)
+
+    def sync(self, events):
+        body = gzip.compress(json.dumps({'events': events}).encode())
+        return self.client.post('/api/sync/', body, content_type='application/json', HTTP_CONTENT_ENCODING='gzip')
+
+    def test_batch_is_applied_once(self):
+        events = [
+            {'k': 'a', 't': 'lesson_completed', 'ts': 1700000000000, 'lesson': self.lessons[0].id},
+            {'k': 'b', 't': 'lesson_completed', 'ts': '2023-11-14T22:14:00Z', 'lesson': self.lessons[1].id},
+            {'k': 'c', 't': 'heartbeat', 'course': self.course.id},
+            {'k': 'd', 't': 'lesson_completed', 'lesson': 10 ** 9},
+            {'t': 'heartbeat'},
+        ]
+        get_entitlements(self.student)
+        with self.assertNumQueries(15):
+            # Including the heartbeat written directly, the test cache being per process
+            response = self.sync(events)
+        self.assertEqual(response.json(), {
+            'ok': ['a', 'b', 'c'], 'dup': [], 'err': {'d': 'Lesson not found.', '4': 'Missing key "k".'},
+        })
+        self.assertEqual(Progress.objects.get(enrollment=self.enrollment).lessons_completed, 2)
+        self.assertEqual(Enrollment.objects.get(pk=self.enrollment.pk).progress, 66.67)
+        # Resent after a lost response
+        self.assertEqual(self.sync(events).json()['dup'], ['a', 'b', 'c', 'd'])
+        self.assertEqual(Progress.objects.get(enrollment=self.enrollment).lessons_completed, 2)
+
+    def test_completion_is_exact_and_heartbeats_are_coalesced(self):
+        cache.clear()
+        for lesson in self.lessons + self.lessons[:1]:
+            response = self.client.post(f'/api/lessons/{lesson.id}/complete/')
+        self.assertEqual(response.data, {'progress': 100, 'completed': True})
+        self.assertEqual(Progress.objects.get(enrollment=self.enrollment).lessons_completed, 3)
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.create(course=self.course, title='Extra', order=9)
+        self.assertEqual(Enrollment.objects.get(pk=self.enrollment.pk).progress, 75)
+
+        cache.clear()
+        before = Progress.objects.get(enrollment=self.enrollment).last_accessed
+        with mock.patch('core.progress.is_shared_cache', return_value=True):
+            with mock.patch('core.progress._current_bucket', return_value=10):
+                with self.assertNumQueries(2):
+                    # The lesson and the enrollment, nothing is written
+                    self.client.post(f'/api/lessons/{self.lessons[0].id}/heartbeat/')
+                for _ in range(5):
+                    self.client.post(f'/api/lessons/{self.lessons[0].id}/heartbeat/')
+                self.assertEqual(progress.flush_heartbeats(), 0)
+            with mock.patch('core.progress._current_bucket', return_value=11):
+                # A heartbeat of the next bucket writes nothing either
+                with self.assertNumQueries(2):
+                    self.client.post(f'/api/lessons/{self.lessons[0].id}/heartbeat/')
+                self.assertEqual(progress.flush_heartbeats(), 1)
+                self.assertEqual(progress.flush_heartbeats(), 0)
+        self.assertGreater(Progress.objects.get(enrollment=self.enrollment).last_accessed, before)
+
+    def test_heartbeats_are_written_directly_without_a_shared_cache(self):
+        cache.clear()
+        url = f'/api/lessons/{self.lessons[0].id}/heartbeat/'
+        self.client.post(url)
+        first = Progress.objects.get(enrollment=self.enrollment).last_accessed
+        with self.assertNumQueries(2):
+            # Once per bucket length
+            self.client.post(url)
+        self.assertEqual(Progress.objects.get(enrollment=self.enrollment).last_accessed, first)
+        self.assertEqual(progress.flush_heartbeats(), 0)
+
+    def test_lesson_changes_update_the_course_in_set_based_statements(self):
+        others = [User.objects.create(username=f'learner{i}', email=f'learner{i}@example.com') for i in range(20)]
+        enrollments = [Enrollment.objects.create(student=u, course=self.course) for u in others]
+        progress.complete_lessons([(e.id, lesson.id, timezone.now()) for e in enrollments for lesson in self.lessons[:2]])
+        extra = Lesson.objects.create(course=self.course, title='Extra', order=9)
+        # Nothing runs before the commit
+        self.assertEqual(Enrollment.objects.get(pk=enrollments[0].pk).progress, 66.67)
+        with self.assertNumQueries(4):
+            # Lesson count, lessons_completed, enrollments reaching the end and progress
+            progress.recompute_course(self.course.id)
+        self.assertEqual(set(Enrollment.objects.filter(course=self.course).values_list('progress', flat=True)), {0, 50})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.lessons[2].delete()
+            extra.delete()
+        finished = Enrollment.objects.get(pk=enrollments[0].pk)
+        self.assertEqual((finished.progress, finished.completed), (100, True))
+        self.assertEqual(Progress.objects.get(enrollment=finished).lessons_completed, 2)
+        # Completion is sticky
+        with self.captureOnCommitCallbacks(execute=True):
+            Lesson.objects.create(course=self.course, title='Extra', order=9)
+        finished.refresh_from_db()
+        self.assertEqual((finished.progress, finished.completed), (66.67, True))
+
+    def test_malformed_events_are_rejected_one_by_one(self):
+        lesson = self.lessons[0].id
+        response = self.sync([
+            {'k': None, 't': 'heartbeat', 'lesson': lesson},
+            {'k': True, 't': 'heartbeat', 'lesson': lesson},
+            {'k': 'a', 't': 'heartbeat', 'ts': 1e300, 'lesson': lesson},
+            {'k': 'b', 't': 'heartbeat', 'ts': -1e300, 'lesson': lesson},
+            {'k': 'c', 't': 'lesson_completed', 'lesson': 2 ** 70},
+            {'k': 7, 't': 'heartbeat', 'lesson': lesson},
+        ])
+        self.assertEqual(response.json(), {
+            'ok': ['7'], 'dup': [],
+            'err': {'0': 'Missing key "k".', '1': 'Missing key "k".', 'a': 'Invalid ts.', 'b': 'Invalid ts.', 'c': 'Lesson not found.'},
+        })
+        self.assertFalse(SyncEvent.objects.filter(key__in=['None', 'True']).exists())
+
+    def test_quiz_answers_follow_the_quiz_attempt_rules(self):
+        quiz = Quiz.objects.create(lesson=self.lessons[0], title='Basics')
+        question = Question.objects.create(quiz=quiz, text='?')
+        right = Option.objects.create(question=question, text='yes', is_correct=True)
+        answered = {'t': 'quiz_answered', 'quiz': quiz.id, 'answers': {str(question.id): [right.id]}}
+        self.assertEqual(self.sync([dict(answered, k='a'), dict(answered, k='b', answers={'1': [2 ** 70]})]).json()['err'], {
+            'b': 'Some answers are not options of this quiz.',
+        })
+        # Like POST /api/quiz-attempts/, a finished course takes no more attempts
+        self.enrollment.completed = True
+        self.enrollment.save()
+        self.client.force_authenticate(User.objects.get(pk=self.student.pk))
+        self.assertEqual(self.sync([dict(answered, k='c')]).json()['err'], {
+            'c': 'You must be enrolled in the course to attempt this quiz.',
+        })
+        self.assertEqual(QuizAttempt.objects.filter(user=self.student).count(), 1)
+
+    def test_malformed_batches_are_refused(self):
+        self.assertEqual(self.client.post('/api/sync/', b'not gzip', content_type='application/json', HTTP_CONTENT_ENCODING='gzip').status_code, 400)
+        self.assertEqual(self.client.post('/api/sync/', {'events': 'x'}, format='json').status_code, 400)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class SearchTests(TestCase):
+    def setUp(self):
+        instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        self.course = Course.objects.create(
+            title='Koyon Python', description='Shirye-shirye na kwamfuta', thumbnail='https://example.com/t.png',
+            price=0, category='tech', level='beginner', duration='1h', instructor=instructor, status='published',
+        )
+        self.lesson = Lesson.objects.create(
+            course=self.course, title='Variables', content='A variable stores ƙima in ʼyan memory', order=1,
+            release_date=timezone.now(),
+        )
+        self.student = User.objects.create(username='student', email='student@example.com')
+        Enrollment.objects.create(student=self.student, course=self.course)
+
+    def search(self, q, user=None):
+        client = APIClient()
+        client.force_authenticate(user or self.student)
+        return [(r['type'], r['id']) for r in client.get('/api/search/', {'q': q}).json()['results']]
+
+    def test_lessons_are_only_found_in_courses_the_caller_can_read(self):
+        self.course.price = 20
+        self.course.save()
+        anonymous = APIClient().get('/api/search/', {'q': 'variable'}).json()['results']
+        self.assertEqual(anonymous, [])
+        outsider = User.objects.create(username='outsider', email='outsider@example.com')
+        self.assertEqual(self.search('python', user=outsider), [('course', self.course.id)])
+        self.assertEqual(self.search('variable'), [('lesson', self.lesson.id)])
+
+    def test_prefix_and_hausa_folding(self):
+        self.assertEqual(self.search('pyth'), [('course', self.course.id)])
+        self.assertEqual(self.search('kima yan'), [('lesson', self.lesson.id)])
+
+    def test_index_follows_saves_and_visibility(self):
+        self.lesson.title = 'Loops'
+        self.lesson.save()
+        self.assertEqual(self.search('loop'), [('lesson', self.lesson.id)])
+        self.lesson.release_date = timezone.now() + timedelta(days=1)
+        self.lesson.save()
+        self.assertEqual(self.search('loop'), [])
+        self.lesson.delete()
+        self.course.status = 'draft'
+        self.course.save()
+        self.assertEqual(self.search('python'), [])
+
+    def test_best_published_match_wins_over_many_newer_matches(self):
+        draft = Course.objects.create(
+            title='Draft', description='', thumbnail='https://example.com/t.png', price=0, category='tech',
+            level='beginner', duration='1h', instructor=self.course.instructor, status='draft',
+        )
+        # Readable, so only the draft status keeps its lessons out
+        Enrollment.objects.create(student=self.student, course=draft)
+        now = timezone.now()
+        Lesson.objects.bulk_create(
+            [Lesson(course=draft, title=f'Draft {i}', content='variable', order=i, release_date=now) for i in range(1200)]
+            + [Lesson(course=self.course, title=f'Extra {i}', content='a variable again', order=i + 2, release_date=now) for i in range(30)]
+        )
+        search.rebuild_index()
+        results = self.search('variable')
+        self.assertEqual(len(results), 20)
+        # The oldest row, but the only title hit, and no draft lessons
+        self.assertEqual(results[0], ('lesson', self.lesson.id))
+        self.assertFalse(Lesson.objects.filter(id__in=[i for _, i in results], course=draft).exists())
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class EntitlementTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        self.student = User.objects.create(username='student', email='student@example.com')
+        self.course = Course.objects.create(
+            title='Python', description='', thumbnail='https://example.com/t.png', price=10, category='tech',
+            level='beginner', duration='1h', instructor=self.instructor, status='published',
+        )
+
+    def entitlements(self, user):
+        # A fresh user object per call, like a new request
+        return get_entitlements(User.objects.get(pk=user.pk))
+
+    def test_saves_invalidate_cached_entitlements(self):
+        self.assertEqual(self.entitlements(self.instructor).role(self.course.id), 'instructor')
+        self.assertIsNone(self.entitlements(self.student).role(self.course.id))
+        Payment.objects.create(user=self.student, course=self.course, amount=10, status='paid')
+        self.assertIn(self.course.id, self.entitlements(self.student).paid)
+        enrollment = Enrollment.objects.create(student=self.student, course=self.course)
+        self.assertEqual(self.entitlements(self.student).role(self.course.id), 'student')
+        student = User.objects.get(pk=self.student.pk)
+        with self.assertNumQueries(0):
+            self.assertIn(self.course.id, get_entitlements(student).active)
+        enrollment.delete()
+        self.assertNotIn(self.course.id, self.entitlements(self.student).courses)
+
+    def test_entitlements_memoised_on_the_user_are_dropped_too(self):
+        self.assertNotIn(self.course.id, get_entitlements(self.student).active)
+        Enrollment.objects.create(student=self.student, course=self.course)
+        self.assertIn(self.course.id, get_entitlements(self.student).active)
+        # Other processes (the payment webhook worker) cannot reach a per-process cache
+        self.assertEqual(ENTITLEMENTS_TIMEOUT, catalog_cache.LOCAL_CACHE_TIMEOUT)
+
+    def test_entitlements_cached_before_the_commit_are_dropped_after_it(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Payment.objects.create(user=self.student, course=self.course, amount=10, status='paid')
+            # A concurrent request that still saw the old rows caches them again
+            cache.set('entitlements:%s' % self.student.pk, load_entitlements(self.instructor.pk))
+        self.assertIn(self.course.id, self.entitlements(self.student).paid)
+
+
+class AIResponseCacheTests(TestCase):
+    def setUp(self):
+        caches['ai'].clear()
+        local_cache.clear()
+        stats_counter.clear()
+
+    @mock.patch.object(gemini_utils, '_request_gemini_response', return_value={'text': 'A named value.'})
+    def test_local_hits_are_counted_without_touching_the_shared_cache(self, upstream):
+        gemini_utils.get_gemini_response('What is a variable?')
+        with mock.patch.object(caches['ai'], 'incr') as incr:
+            for _ in range(10):
+                gemini_utils.get_gemini_response('What is a variable?')
+        incr.assert_not_called()
+        stats = cache_stats()
+        self.assertEqual((stats['local_hits'], stats['misses']), (10, 1))
+
+    @mock.patch.object(gemini_utils, '_request_gemini_response', return_value={'text': 'A named value.'})
+    def test_repeated_prompts_are_answered_from_cache(self, upstream):
+        self.assertEqual(gemini_utils.get_gemini_response('What is a variable?')['text'], 'A named value.')
+        self.assertTrue(gemini_utils.get_gemini_response('  what is a   VARIABLE ')['cached'])
+        local_cache.clear()
+        self.assertTrue(gemini_utils.get_gemini_response('what is a variable')['cached'])
+        self.assertEqual(upstream.call_count, 1)
+        gemini_utils.get_gemini_response('What is a variable?', language='ha')
+        self.assertEqual(upstream.call_count, 2)
+        self.assertEqual(cache_stats()['misses'], 2)
+
+    def test_identical_prompts_in_flight_share_one_upstream_call(self):
+        def slow_upstream(prompt, history=(), context=()):
+            time.sleep(0.2)
+            return {'text': 'A named value.'}
+
+        with mock.patch.object(gemini_utils, '_request_gemini_response', side_effect=slow_upstream) as upstream:
+            results = []
+            threads = [
+                threading.Thread(target=lambda: results.append(gemini_utils.get_gemini_response('What is a variable?')))
+                for _ in range(8)
+            ]
+            for thread in threads:
+                thread.start()
+            for thread in threads:
+                thread.join()
+        self.assertEqual(upstream.call_count, 1)
+        self.assertEqual([result['text'] for result in results], ['A named value.'] * 8)
+
+    @mock.patch.object(gemini_utils, '_request_gemini_response')
+    def test_waits_for_another_worker_holding_the_lock(self, upstream):
+        key = prompt_cache_key('What is a loop?')
+        caches['ai'].add(f'{key}:lock', 'other-worker', 30)
+        threading.Timer(0.2, lambda: caches['ai'].set(key, {'text': 'Repetition.'})).start()
+        self.assertEqual(gemini_utils.get_gemini_response('What is a loop?')['text'], 'Repetition.')
+        upstream.assert_not_called()
+
+    @mock.patch.object(gemini_utils, '_request_gemini_response', return_value={'error': 'timeout'})
+    def test_errors_are_not_cached(self, upstream):
+        gemini_utils.get_gemini_response('What is a loop?')
+        gemini_utils.get_gemini_response('What is a loop?')
+        self.assertEqual(upstream.call_count, 2)
+
+
+def sse_gemini_client():
+    body = ''.join(
+        f'data: {json.dumps({"candidates": [{"content": {"parts": [{"text": text}]}}]})}\r\n\r\n' for text in ('Hel', 'lo')
+    )
+    return httpx.AsyncClient(transport=httpx.MockTransport(lambda request: httpx.Response(200, text=body)))
+
+
+@override_settings(GEMINI_API_KEY='test-key')
+@mock.patch.object(GeminiBackend, 'async_client', lambda backend: sse_gemini_client())
+class AIStreamTests(TestCase):
+    def setUp(self):
+        caches['ai'].clear()
+        local_cache.clear()
+
+    async def stream(self, prompt):
+        response = await self.async_client.get('/api/learn-with-ai/stream/', {'prompt': prompt})
+        self.assertEqual(response['Content-Type'], 'text/event-stream')
+        return b''.join([chunk async for chunk in response.streaming_content]).decode()
+
+    async def test_chunks_are_streamed_then_cached(self):
+        self.assertEqual(await self.stream('hi'), 'data: {"text": "Hel"}\n\ndata: {"text": "lo"}\n\nevent: done\ndata: {}\n\n')
+        self.assertEqual(await self.stream('HI'), 'data: {"text": "Hello"}\n\nevent: done\ndata: {}\n\n')
+
+
+class ScriptedAdapter(BaseAdapter):
+    # Answers each request with the next status code in `statuses`, or raises it if it is an exception
+    def __init__(self, statuses):
+        super().__init__()
+        self.statuses = list(statuses)
+        self.calls = 0
+
+    def send(self, request, **kwargs):
+        self.calls += 1
+        if isinstance(self.statuses[0], BaseException):
+            raise self.statuses.pop(0)
+        response = requests.Response()
+        response.status_code = self.statuses.pop(0)
+        response.request = request
+        return response
+
+    def close(self):
+        pass
+
+
+class UpstreamClientTests(TestCase):
+    def client_with(self, statuses, **kwargs):
+        client = UpstreamClient('Test', backoff=0, **kwargs)
+        adapter = ScriptedAdapter(statuses)
+        client.session.mount('https://', adapter)
+        return client, adapter
+
+    def test_retries_transient_errors(self):
+        client, adapter = self.client_with([503, 429, 200])
+        self.assertEqual(client.post('https://upstream.test/').status_code, 200)
+        self.assertEqual(adapter.calls, 3)
+        self.assertEqual(client.metrics()['retries'], 2)
+        self.assertEqual(client.metrics()['circuit'], 'closed')
+
+    def test_circuit_opens_and_fails_fast(self):
+        client, adapter = self.client_with([500] * 2, retries=0)
+        client.breaker.failure_threshold = 2
+        client.post('https://upstream.test/')
+        client.post('https://upstream.test/')
+        with self.assertRaises(UpstreamUnavailable):
+            client.post('https://upstream.test/')
+        self.assertEqual(adapter.calls, 2)
+        self.assertEqual(client.metrics()['short_circuited'], 1)
+
+    def test_half_open_probe_is_released_whatever_it_raises(self):
+        client, adapter = self.client_with([500, 500, 500, requests.exceptions.ChunkedEncodingError('cut off'), ValueError('bug'), 200], retries=2)
+        client.breaker.failure_threshold = 1
+        client.breaker.reset_timeout = 0
+        client.post('https://upstream.test/')
+        self.assertEqual(client.metrics()['circuit'], 'open')
+        # Not retried, but counted against the breaker
+        with self.assertRaises(requests.exceptions.ChunkedEncodingError):
+            client.post('https://upstream.test/')
+        self.assertEqual((adapter.calls, client.metrics()['circuit']), (4, 'open'))
+        with self.assertRaises(ValueError):
+            client.post('https://upstream.test/')
+        self.assertEqual(client.post('https://upstream.test/').status_code, 200)
+        self.assertEqual(client.metrics()['circuit'], 'closed')
+
+
+@mock.patch.object(gemini_utils, '_request_gemini_response', return_value={'text': 'Answer.'})
+class AdmissionTests(TestCase):
+    def setUp(self):
+        caches['ai'].clear()
+        local_cache.clear()
+        self.student = User.objects.create(username='student', email='student@example.com')
+
+    def ask(self, client=None):
+        return (client or self.client).get('/api/learn-with-ai/', {'prompt': 'What is a loop?'})
+
+    def test_callers_over_their_rate_get_429_with_retry_after(self, upstream):
+        for _ in range(admission.AI_RATE_BURST):
+            self.assertEqual(self.ask().status_code, 200)
+        response = self.ask()
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response['Retry-After']), 1)
+        # Authenticated users have their own bucket
+        self.client.force_login(self.student)
+        self.assertEqual(self.ask().status_code, 200)
+
+    @mock.patch.object(admission, 'AI_MAX_ACTIVE', 1)
+    @mock.patch.object(admission, 'AI_MAX_QUEUED', 0)
+    def test_callers_beyond_the_queue_are_turned_away(self, upstream):
+        lease = admission.acquire_slot()
+        try:
+            self.assertEqual(self.ask().status_code, 429)
+        finally:
+            admission.release_slot(lease)
+        self.assertEqual(self.ask().status_code, 200)
+
+    @mock.patch.object(admission, 'AI_MAX_ACTIVE', 2)
+    @mock.patch.object(admission, 'AI_MAX_QUEUED', 0)
+    def test_slots_are_leases_that_lapse_and_come_back(self, upstream):
+        shared = caches['ai']
+        leaked = admission.acquire_slot()
+        held = admission.acquire_slot()
+        with self.assertRaises(admission.Rejected):
+            admission.acquire_slot()
+        # Turned away callers do not keep a leaked slot alive, its lease simply lapses
+        shared.delete(leaked[0])
+        admission.release_slot(admission.acquire_slot())
+        admission.release_slot(held)
+        admission.release_slot(held)
+        self.assertEqual(len(shared.get_many([f'{admission.ACTIVE_PREFIX}:{n}' for n in range(2)])), 0)
+
+    @mock.patch.object(admission, 'AI_MAX_ACTIVE', 1)
+    @mock.patch.object(admission, 'AI_MAX_QUEUED', 0)
+    def test_streams_give_their_slot_back_however_they_end(self, upstream):
+        async def chunks():
+            yield 'a'
+            yield 'b'
+
+        async def read(stream):
+            return [chunk async for chunk in stream]
+
+        self.assertEqual(async_to_sync(read)(admission.LeasedStream(chunks(), admission.acquire_slot())), ['a', 'b'])
+        # A response closed before its body was read
+        admission.LeasedStream(chunks(), admission.acquire_slot()).close()
+        admission.release_slot(admission.acquire_slot())
+
+
+class ChatSessionTests(TestCase):
+    def setUp(self):
+        caches['ai'].clear()
+        local_cache.clear()
+        self.student = User.objects.create(username='student', email='student@example.com')
+        self.client.force_login(self.student)
+
+    def ask(self, prompt, session):
+        return self.client.get('/api/learn-with-ai/', {'prompt': prompt, 'session': session}).json()
+
+    @mock.patch.object(admission, 'AI_RATE_BURST', 1000)
+    def test_context_sent_upstream_stays_within_budget(self):
+        sent = []
+
+        def upstream(prompt, history=(), context=()):
+            sent.append(sum(estimate_tokens(text) for _, text in history))
+            return {'text': f'Answer to {prompt}. ' + 'Some explanation follows here. ' * 20}
+
+        with mock.patch.object(gemini_utils, '_request_gemini_response', side_effect=upstream):
+            session = self.ask('What is a variable?', 'new')['session']
+            for turn in range(40):
+                self.assertEqual(self.ask(f'And question {turn}?', session)['session'], session)
+        self.assertEqual(sent[0], 0)
+        # Allowing for the few words introducing the summary
+        self.assertLessEqual(max(sent), CHAT_CONTEXT_TOKENS + 15)
+        self.assertGreater(min(sent[10:]), CHAT_CONTEXT_TOKENS // 2)
+        chat = ChatSession.objects.get(pk=session)
+        self.assertEqual(chat.title, 'What is a variable?')
+        self.assertIn('Learner: And question', chat.summary)
+        self.assertEqual(chat.messages.count(), 82)
+
+    def test_session_ids_do_not_leak_through_cached_answers(self):
+        with mock.patch.object(gemini_utils, '_request_gemini_response', return_value={'text': 'A box for a value.'}):
+            self.assertIn('session', self.ask('What is a variable?', 'new'))
+            for _ in range(2):
+                # Once from the shared cache, once from process memory
+                answer = self.client.get('/api/learn-with-ai/', {'prompt': 'What is a variable?'}).json()
+                self.assertEqual(answer, {'text': 'A box for a value.', 'cached': True})
+
+    def test_sessions_are_private(self):
+        other = ChatSession.objects.create(user=User.objects.create(username='other', email='other@example.com'))
+        self.assertEqual(self.client.get('/api/learn-with-ai/', {'prompt': 'Hi', 'session': other.id}).status_code, 404)
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class RetrievalTests(TestCase):
+    def setUp(self):
+        instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        self.course = Course.objects.create(
+            title='Python', description='Learn Python from scratch', thumbnail='https://example.com/t.png', price=10,
+            category='tech', level='beginner', duration='1h', instructor=instructor, status='published',
+        )
+        past = timezone.now() - timedelta(days=1)
+        self.lessons = [
+            Lesson.objects.create(course=self.course, title=title, content=content, order=order, release_date=past)
+            for order, (title, content) in enumerate([
+                ('Variables', 'A variable stores a value under a name so it can be used later.'),
+                ('Loops', 'A for loop repeats a block of code for every item in a list.'),
+                ('Functions', 'A function groups code you want to call again.'),
+            ])
+        ]
+        self.index_dir = tempfile.mkdtemp()
+
+    def search(self, query, course_ids):
+        return [passage['lesson_title'] for passage in load_index(self.index_dir).search(query, course_ids=course_ids)]
+
+    def test_passages_are_ranked_and_limited_to_the_learners_courses(self):
+        self.assertEqual(build_index(self.index_dir), (4, 4))
+        self.assertEqual(self.search('how does a for loop repeat code', {self.course.id})[0], 'Loops')
+        self.assertEqual(self.search('what is a variable', {self.course.id})[0], 'Variables')
+        # Without access only the course description can be used
+        self.assertEqual(self.search('learn python loops', set()), [''])
+
+    def test_refresh_only_reindexes_changed_lessons(self):
+        build_index(self.index_dir)
+        self.assertEqual(build_index(self.index_dir), (4, 0))
+        Lesson.objects.filter(pk=self.lessons[2].pk).update(content='Recursion is a function calling itself.')
+        self.assertEqual(build_index(self.index_dir), (4, 1))
+        self.assertEqual(self.search('recursion', {self.course.id}), ['Functions'])
+
+
+class EchoBackend(LLMBackend):
+    name = 'echo'
+
+    def complete(self, messages):
+        return f'{len(messages)} message(s)'
+
+
+@override_settings(AI_BACKEND='core.tests.EchoBackend')
+class LLMBackendTests(TestCase):
+    def setUp(self):
+        caches['ai'].clear()
+        local_cache.clear()
+
+    def test_backend_is_chosen_by_setting(self):
+        self.assertEqual(get_backend().name, 'echo')
+        result = gemini_utils.get_gemini_response('Hi', history=[('user', 'Hello'), ('model', 'Hello!')])
+        self.assertEqual(result, {'text': '3 message(s)'})
+
+    async def test_backends_without_streaming_answer_in_one_chunk(self):
+        self.assertEqual([text async for text in gemini_utils.stream_gemini_response('Hi')], ['1 message(s)'])
+
+
+@override_settings(
+    CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}},
+    MEDIA_ROOT=tempfile.mkdtemp(),
+)
+class CertificateJobTests(TestCase):
+    def setUp(self):
+        self.instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        self.course = Course.objects.create(
+            title='Python', description='Learn Python', thumbnail='https://example.com/t.png', price=10,
+            category='tech', level='beginner', duration='1h', instructor=self.instructor,
+        )
+        self.students = [User.objects.create(username=f's{i}', email=f's{i}@example.com') for i in range(5)]
+        for i, student in enumerate(self.students):
+            Enrollment.objects.create(student=student, course=self.course, completed=i < 4)
+        self.client = APIClient()
+        EmailOutbox.objects.all().delete()
+
+    def run_jobs(self):
+        with ProcessPoolExecutor(max_workers=2) as pool:
+            return process_certificate_jobs(pool, chunk_size=3)
+
+    def test_generate_returns_a_job_and_the_worker_issues_it(self):
+        self.client.force_authenticate(self.students[0])
+        response = self.client.post('/api/certificates/generate/', {'course_id': self.course.id})
+        self.assertEqual(response.status_code, 202)
+        self.assertFalse(Certificate.objects.exists())
+        # A double click gets the job already queued
+        self.assertEqual(self.client.post('/api/certificates/generate/', {'course_id': self.course.id}).data['id'], response.data['id'])
+        self.client.force_authenticate(self.instructor)
+        bulk = self.client.post('/api/certificates/bulk-generate/', {'course_id': self.course.id}).data
+        self.assertEqual(sorted(CertificateJob.objects.get(pk=bulk['id']).user_ids), [s.id for s in self.students[1:4]])
+        self.client.force_authenticate(self.students[0])
+        self.assertEqual(self.run_jobs(), 2)
+        job = self.client.get(f'/api/certificates/jobs/{response.data["id"]}/').data
+        self.assertEqual((job['status'], job['issued'], job['failed']), ('done', 1, 0))
+        cert = Certificate.objects.get(user=self.students[0])
+        self.assertTrue(cert.file.read().startswith(b'%PDF'))
+        self.assertEqual(EmailOutbox.objects.filter(recipients=['s0@example.com']).count(), 1)
+        # Already issued, answered right away
+        self.assertEqual(self.client.post('/api/certificates/generate/', {'course_id': self.course.id}).status_code, 200)
+
+    def test_bulk_generate_covers_completed_enrollments_once(self):
+        self.client.force_authenticate(self.students[0])
+        self.assertEqual(self.client.post('/api/certificates/bulk-generate/', {'course_id': self.course.id}).status_code, 403)
+        self.client.force_authenticate(self.instructor)
+        response = self.client.post('/api/certificates/bulk-generate/', {'course_id': self.course.id})
+        self.assertEqual((response.status_code, response.data['total']), (202, 4))
+        self.run_jobs()
+        job = CertificateJob.objects.get(pk=response.data['id'])
+        self.assertEqual((job.status, job.issued, job.failed), ('done', 4, 0))
+        self.assertEqual(Certificate.objects.exclude(file='').count(), 4)
+        self.assertEqual(EmailOutbox.objects.count(), 4)
+        # Nobody left to issue for
+        self.assertEqual(self.client.post('/api/certificates/bulk-generate/', {'course_id': self.course.id}).data['total'], 0)
+
+    def test_job_of_a_dead_worker_is_claimed_again(self):
+        self.client.force_authenticate(self.instructor)
+        job_id = self.client.post('/api/certificates/bulk-generate/', {'course_id': self.course.id}).data['id']
+        # A worker claimed it, issued a chunk, wrote one more file and died before committing it
+        self.assertEqual(self.run_jobs(), 1)
+        Certificate.objects.filter(user=self.students[3]).update(file='')
+        stale = timezone.now() - timedelta(seconds=certificates.CERTIFICATE_JOB_LEASE_SECONDS + 1)
+        CertificateJob.objects.filter(pk=job_id).update(status='running', heartbeat_at=stale, issued=3)
+        self.assertEqual(self.run_jobs(), 1)
+        job = CertificateJob.objects.get(pk=job_id)
+        self.assertEqual((job.status, job.issued, job.failed), ('done', 4, 0))
+        cert = Certificate.objects.get(user=self.students[3])
+        self.assertEqual(cert.file.name, f'certificates/certificate_{self.students[3].id}_{self.course.id}.pdf')
+        # Running jobs within their lease are left alone
+        CertificateJob.objects.filter(pk=job_id).update(status='running', heartbeat_at=timezone.now())
+        self.assertEqual(self.run_jobs(), 0)
+
+    def test_template_background_is_compiled_once_per_version(self):
+        template = CertificateTemplate.objects.create(name='Brand', is_default=True, layout={
+            'background': [{'type': 'rect', 'x': 20, 'y': 20, 'width': 572, 'height': 752, 'stroke': '#1f4e79'}],
+            'fields': [{'text': 'Awarded to {name}', 'x': 306, 'y': 600, 'font': 'Times-Bold'}],
+        })
+        layer = static_layer(template_spec(template))
+        self.assertIs(static_layer(template_spec(template)), layer)
+        template.name = 'Brand 2'
+        template.save()
+        self.assertEqual(template.version, 2)
+        self.assertIsNot(static_layer(template_spec(template)), layer)
+        pdf = render_certificate_pdf('Ada (Lovelace)', 'Python', '2026-01-31', spec=template_spec(template))
+        self.assertIn(b'(Awarded to Ada \\(Lovelace\\)) Tj', pdf)
+        template.layout['fields'][0]['text'] = '{name.__class__}'
+        with self.assertRaises(ValidationError):
+            template.full_clean()
+
+    def test_logo_element_without_an_uploaded_logo_is_skipped(self):
+        template = CertificateTemplate.objects.create(name='Logo', layout={
+            'background': [{'type': 'logo', 'x': 256, 'y': 680, 'width': 100, 'height': 60}],
+            'fields': [{'text': '{name}', 'x': 306, 'y': 600}],
+        })
+        pdf = render_certificate_pdf('Ada', 'Python', '2026-01-31', spec=template_spec(template))
+        self.assertNotIn(b'/Logo', pdf)
+
+    def test_letters_the_standard_fonts_lack(self):
+        # Without a font they lose their hooks rather than printing as '?'
+        with self.assertLogs('core.certificate_templates', 'WARNING'):
+            pdf = render_certificate_pdf('Ɓello Ɗanƙwali', 'Python', '2026-01-31')
+        self.assertIn(b'(Awarded to: Bello Dankwali) Tj', pdf)
+        # With one, a subset of it is embedded in the certificates that need it
+        vera = os.path.join(os.path.dirname(reportlab.__file__), 'fonts', 'Vera.ttf')
+        spec = DEFAULT_SPEC._replace(key=('unicode', 1), font_path=vera)
+        pdf = render_certificate_pdf('Ayşe Doğan', 'Python', '2026-01-31', spec=spec)
+        self.assertIn(b'/FU 16 Tf', pdf)
+        self.assertIn(b'/FontFile2', pdf)
+        self.assertIn(b'(For completing the course: Python) Tj', pdf)
+        self.assertNotIn(b'/FontFile2', render_certificate_pdf('Ada', 'Python', '2026-01-31', spec=spec))
+
+
+class BouncingEmailBackend(locmem.EmailBackend):
+    # Refuses any batch holding a message to a bounce@ address, and every message when down
+    down = False
+
+    def open(self):
+        if self.down:
+            raise ConnectionRefusedError('Mail server unreachable')
+        return super().open()
+
+    def send_messages(self, messages):
+        if any(r.startswith('bounce@') for message in messages for r in message.to):
+            raise OSError('Mailbox unavailable')
+        return super().send_messages(messages)
+
+
+@override_settings(EMAIL_BACKEND='core.tests.BouncingEmailBackend')
+class EmailOutboxTests(TestCase):
+    def setUp(self):
+        BouncingEmailBackend.down = False
+        for recipient in ('a@example.com', 'bounce@example.com', 'b@example.com'):
+            email_utils.queue_email('Hello', 'Body', [recipient])
+
+    def test_batch_goes_out_and_a_bad_message_is_isolated(self):
+        self.assertEqual(email_utils.drain_outbox(), (2, 1))
+        self.assertEqual(sorted(m.to[0] for m in mail.outbox), ['a@example.com', 'b@example.com'])
+        bounced = EmailOutbox.objects.get(status='pending')
+        self.assertEqual((bounced.recipients, bounced.attempts), (['bounce@example.com'], 1))
+        self.assertIn('Mailbox unavailable', bounced.last_error)
+        self.assertGreater(bounced.next_attempt_at, timezone.now())
+        # Backing off, nothing is due yet
+        self.assertEqual(email_utils.drain_outbox(), (0, 0))
+
+    def test_unreachable_server_backs_off_the_whole_batch(self):
+        BouncingEmailBackend.down = True
+        self.assertEqual(email_utils.drain_outbox(), (0, 3))
+        self.assertEqual(len(mail.outbox), 0)
+        self.assertEqual(EmailOutbox.objects.filter(status='pending', attempts=1).count(), 3)
+
+    def test_rows_claimed_meanwhile_by_another_worker_are_left_to_it(self):
+        # Without skip_locked both workers read the same rows, the other one leases two first
+        calls, theirs, lease_duration = [], [], email_utils.lease_duration
+
+        def other_worker_claims_first(count):
+            calls.append(count)
+            if len(calls) == 1:
+                theirs.extend(email_utils._claim_batch(2))
+            return lease_duration(count)
+
+        with mock.patch.object(email_utils, 'lease_duration', side_effect=other_worker_claims_first):
+            ours = email_utils._claim_batch(10)
+        self.assertEqual((len(theirs), len(ours)), (2, 1))
+        self.assertFalse({e.id for e in theirs} & {e.id for e in ours})
+        # Leased for the whole batch at EMAIL_TIMEOUT per SMTP call
+        self.assertGreater(EmailOutbox.objects.get(pk=ours[0].pk).next_attempt_at, timezone.now() + timedelta(seconds=60))
+
+    def test_message_is_dead_lettered_after_the_last_attempt(self):
+        EmailOutbox.objects.filter(recipients=['bounce@example.com']).update(attempts=email_utils.OUTBOX_MAX_ATTEMPTS - 1)
+        email_utils.drain_outbox()
+        EmailOutbox.objects.update(next_attempt_at=timezone.now())
+        self.assertEqual(email_utils.drain_outbox(), (0, 0))
+        bounced = EmailOutbox.objects.get(recipients=['bounce@example.com'])
+        self.assertEqual((bounced.status, bounced.attempts), ('dead', email_utils.OUTBOX_MAX_ATTEMPTS))
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class LessonReleaseTests(TestCase):
+    def setUp(self):
+        instructor = User.objects.create(username='instructor', email='instructor@example.com', role='instructor')
+        self.course = Course.objects.create(
+            title='Python', description='Learn Python', thumbnail='https://example.com/t.png', price=0, is_free=True,
+            category='tech', level='beginner', duration='1h', instructor=instructor, status='published',
+        )
+        self.students = [User.objects.create(username=f's{i}', email=f's{i}@example.com' if i else '') for i in range(5)]
+        for student in self.students:
+            Enrollment.objects.create(student=student, course=self.course)
+        # Enrolled twice, notified once
+        Enrollment.objects.create(student=self.students[1], course=self.course)
+        self.lesson = Lesson.objects.create(course=self.course, title='Loops', order=1)
+        Notification.objects.all().delete()
+        EmailOutbox.objects.all().delete()
+
+    def test_fan_out_writes_in_chunks_and_pushes_to_each_learner(self):
+        layer = get_channel_layer()
+        channel = async_to_sync(layer.new_channel)()
+        async_to_sync(layer.group_add)(f'user_{self.students[3].id}_notifications', channel)
+        with self.captureOnCommitCallbacks(execute=True), CaptureQueriesContext(connection) as queries:
+            self.assertEqual(fan_out_lesson_release(self.lesson, chunk_size=2), 5)
+        inserts = [q['sql'] for q in queries.captured_queries if q['sql'].startswith('INSERT INTO "core_notification"')]
+        self.assertEqual(len(inserts), 3)
+        self.assertEqual(Notification.objects.count(), 5)
+        # The learner without an email address only gets the notification
+        self.assertEqual(sorted(e.recipients[0] for e in EmailOutbox.objects.all()), [f's{i}@example.com' for i in range(1, 5)])
+        self.assertEqual(EmailOutbox.objects.filter(content_subtype='html').count(), 4)
+        message = async_to_sync(layer.receive)(channel)
+        self.assertEqual(message['type'], 'send_notification')
+        self.assertIn('Loops', message['notification']['message'])
+
+    def test_release_is_claimed_once_and_retried_after_a_failed_fan_out(self):
+        now = timezone.now()
+        Lesson.objects.filter(pk=self.lesson.pk).update(release_date=now - timedelta(minutes=1))
+        with mock.patch('core.scheduler.fan_out_lesson_release', side_effect=RuntimeError('boom')):
+            with self.assertRaises(RuntimeError):
+                release_lesson(self.lesson.id, now)
+        self.lesson.refresh_from_db()
+        self.assertIsNone(self.lesson.released_at)
+        self.assertTrue(release_lesson(self.lesson.id, now))
+        self.assertFalse(release_lesson(self.lesson.id, now))
+        self.assertEqual(Notification.objects.count(), 5)
+
+    def test_failed_releases_are_retried_with_backoff(self):
+        now = timezone.now()
+        Lesson.objects.filter(pk=self.lesson.pk).update(release_date=now - timedelta(minutes=1))
+        scheduler = LessonReleaseScheduler()
+        scheduler.sync(now)
+        with mock.patch('core.scheduler.fan_out_lesson_release', side_effect=RuntimeError('boom')):
+            with self.assertLogs('core.scheduler', 'ERROR'):
+                self.assertEqual(scheduler.release_due(now), 0)
+        retry_at = scheduler.next_due()
+        self.assertGreater(retry_at, now + timedelta(seconds=10))
+        # Later ticks neither reschedule it nor try it again before its time
+        self.assertEqual(scheduler.sync(now), 0)
+        self.assertEqual(scheduler.release_due(now + timedelta(seconds=1)), 0)
+        self.assertEqual(scheduler.release_due(retry_at), 1)
+        self.assertEqual(scheduler.failures, {})
+
+    def test_scheduler_keeps_the_window_in_a_heap_and_skips_moved_lessons(self):
+        now = timezone.now()
+        Lesson.objects.filter(pk=self.lesson.pk).update(release_date=now - timedelta(minutes=1))
+        later = Lesson.objects.create(course=self.course, title='Functions', order=2, release_date=now + timedelta(minutes=5))
+        Lesson.objects.create(course=self.course, title='Classes', order=3, release_date=now + timedelta(hours=1))
+        scheduler = LessonReleaseScheduler(lookahead=timedelta(minutes=10))
+        self.assertEqual(scheduler.sync(now), 2)
+        self.assertEqual(scheduler.sync(now), 0)
+        self.assertEqual(scheduler.next_due(), now - timedelta(minutes=1))
+        self.assertEqual(scheduler.release_due(now), 1)
+        # Moved earlier: the old heap entry is stale and skipped
+        Lesson.objects.filter(pk=later.pk).update(release_date=now + timedelta(minutes=2))
+        self.assertEqual(scheduler.sync(now), 1)
+        self.assertEqual(scheduler.release_due(now + timedelta(minutes=6)), 1)
+        self.assertEqual(scheduler.heap, [])
+        self.assertEqual(set(Lesson.objects.filter(released_at__isnull=False).values_list('title', flat=True)), {'Loops', 'Functions'})
+
+
+@override_settings(CHANNEL_LAYERS={'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}})
+class PaymentWebhookTests(TestCase):
+    def setUp(self):
+        self.student = User.objects.create(username='student', email='student@example.com')
+        self.course = Course.objects.create(
+            title='Python', description='', thumbnail='https://example.com/t.png', price=10, category='tech',
+            level='beginner', duration='1h', instructor=self.student, status='published',
+        )
+        self.client = APIClient()
+
+    def post(self, reference, status):
+        return self.client.post('/api/payments/webhook/', {'provider': 'paystack', 'reference': reference, 'status': status}, format='json')
+
+    def pay(self, reference):
+        return Payment.objects.create(user=self.student, course=self.course, amount=10, provider='paystack', reference=reference)
+
+    def make_due(self):
+        PaymentWebhookEvent.objects.update(next_attempt_at=timezone.now())
+
+    def test_events_are_stored_once_and_applied_by_the_worker(self):
+        payment = self.pay('ref-1')
+        self.assertEqual(self.post('ref-1', 'paid').json(), {'success': True, 'duplicate': False})
+        self.assertEqual(self.post('ref-1', 'paid').json(), {'success': True, 'duplicate': True})
+        self.assertEqual(self.post('ref-1', 'failed').json()['duplicate'], False)
+        self.assertEqual(self.post('ref-1', '').status_code, 400)
+        self.assertEqual(webhooks.apply_pending_events(), 2)
+        payment.refresh_from_db()
+        # A late 'failed' cannot undo the confirmation
+        self.assertEqual(payment.status, 'paid')
+        self.assertEqual(list(PaymentWebhookEvent.objects.order_by('id').values_list('status', flat=True)), ['applied', 'ignored'])
+
+    def test_event_before_its_payment_is_retried(self):
+        self.post('ref-1', 'paid')
+        self.assertEqual(webhooks.apply_pending_events(), 1)
+        event = PaymentWebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts, event.error), ('received', 1, 'Payment not found.'))
+        self.assertGreater(event.next_attempt_at, timezone.now())
+        self.assertEqual(webhooks.apply_pending_events(), 0)
+        payment = self.pay('ref-1')
+        self.make_due()
+        webhooks.apply_pending_events()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'paid')
+
+    def test_unknown_payment_is_ignored_after_the_last_attempt(self):
+        self.post('ref-1', 'paid')
+        with self.assertLogs('core.webhooks', 'ERROR'):
+            for _ in range(webhooks.WEBHOOK_MAX_ATTEMPTS):
+                self.make_due()
+                webhooks.apply_pending_events()
+        event = PaymentWebhookEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('ignored', webhooks.WEBHOOK_MAX_ATTEMPTS))
+
+    def test_failing_event_does_not_block_other_payments(self):
+        self.pay('ref-1')
+        other = self.pay('ref-2')
+        self.post('ref-1', 'paid')
+        self.post('ref-1', 'failed')
+        self.post('ref-2', 'paid')
+        real_apply = webhooks._apply
+
+        def poisoned(event):
+            if event.reference == 'ref-1':
+                raise RuntimeError('boom')
+            return real_apply(event)
+
+        with mock.patch.object(webhooks, '_apply', poisoned), self.assertLogs('core.webhooks', 'WARNING'):
+            # The later ref-1 event waits behind the failing one, ref-2 goes through
+            self.assertEqual(webhooks.apply_pending_events(), 2)
+            other.refresh_from_db()
+            self.assertEqual(other.status, 'paid')
+            for _ in range(2 * webhooks.WEBHOOK_MAX_ATTEMPTS):
+                self.make_due()
+                webhooks.apply_pending_events()
+        first, second = PaymentWebhookEvent.objects.filter(reference='ref-1').order_by('id')
+        self.assertEqual((first.status, first.attempts, first.error), ('dead', webhooks.WEBHOOK_MAX_ATTEMPTS, 'boom'))
+        self.assertEqual(second.status, 'dead')
@@ -0,0 +1,160 @@
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class UpstreamUnavailable(Exception):
+    pass
+
+
+class CircuitBreaker:
+    # Opens after `failure_threshold` consecutive failures and fails fast for
+    # `reset_timeout` seconds, then lets a single probe request through
+    def __init__(self, failure_threshold=5, reset_timeout=30):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.state = 'closed'
+        self.failures = 0
+        self.opened_at = 0.0
+        self.probing = False
+        self.lock = threading.Lock()
+
+    def allow(self):
+        with self.lock:
+            if self.state == 'closed':
+                return True
+            if self.state == 'open' and time.monotonic() - self.opened_at >= self.reset_timeout:
+                self.state = 'half_open'
+            if self.state == 'half_open' and not self.probing:
+                self.probing = True
+                return True
+            return False
+
+    def cancel(self):
+        # The request never reached the upstream, so it tells us nothing
+        with self.lock:
+            self.probing = False
+
+    def record_success(self):
+        with self.lock:
+            self.state, self.failures, self.probing = 'closed', 0, False
+
+    def record_failure(self):
+        with self.lock:
+            self.failures += 1
+            self.probing = False
+            if self.state == 'half_open' or self.failures >= self.failure_threshold:
+                self.state = 'open'
+                self.opened_at = time.monotonic()
+
+
+class UpstreamClient:
+    # One keep-alive connection pool per process, at most `max_concurrency`
+    # requests in flight, jittered retries on 429/5xx within `deadline` seconds
+    def __init__(self, name, max_concurrency=8, retries=2, backoff=0.5, max_backoff=4.0,
+                 timeout=(5, 15), deadline=20, breaker=None):
+        self.name = name
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.timeout = timeout
+        self.deadline = deadline
+        self.breaker = breaker or CircuitBreaker()
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max_concurrency, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+        self.slots = threading.BoundedSemaphore(max_concurrency)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = dict.fromkeys(
+            ('requests', 'attempts', 'retries', 'successes', 'failures', 'short_circuited', 'busy'), 0
+        )
+        self.latency_total = 0.0
+
+    def _count(self, name, n=1):
+        with self.lock:
+            self.counters[name] += n
+
+    def _retry_delay(self, attempt, response):
+        # Full jitter; a Retry-After from the upstream is honoured up to max_backoff
+        delay = random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            delay = max(delay, min(int(retry_after), self.max_backoff))
+        return delay
+
+    def _attempt(self, method, url, kwargs):
+        # Slots are held per attempt, not across backoff sleeps
+        if not self.slots.acquire(timeout=self.timeout[0]):
+            self._count('busy')
+            raise UpstreamUnavailable(f'{self.name} is busy, try again shortly.')
+        with self.lock:
+            self.in_flight += 1
+            self.counters['attempts'] += 1
+        try:
+            return self.session.request(method, url, timeout=self.timeout, **kwargs)
+        finally:
+            with self.lock:
+                self.in_flight -= 1
+            self.slots.release()
+
+    def request(self, method, url, **kwargs):
+        self._count('requests')
+        if not self.breaker.allow():
+            self._count('short_circuited')
+            raise UpstreamUnavailable(f'{self.name} is temporarily unavailable.')
+        started = time.monotonic()
+        attempt = 0
+        while True:
+            response, error, retryable = None, None, True
+            try:
+                response = self._attempt(method, url, kwargs)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = e
+            except requests.RequestException as e:
+                # e.g. a body cut off mid-stream: the call failed, retrying will not help
+                error, retryable = e, False
+            except UpstreamUnavailable:
+                self.breaker.cancel()
+                raise
+            except BaseException:
+                # Not an upstream failure, but a half-open breaker must not keep waiting for this probe
+                self.breaker.cancel()
+                raise
+            failed = error is not None or response.status_code in RETRY_STATUSES
+            if failed and retryable and attempt < self.retries:
+                delay = self._retry_delay(attempt, response)
+                if time.monotonic() - started + delay < self.deadline:
+                    attempt += 1
+                    self._count('retries')
+                    time.sleep(delay)
+                    continue
+            break
+        with self.lock:
+            self.latency_total += time.monotonic() - started
+        if failed:
+            self._count('failures')
+            self.breaker.record_failure()
+        else:
+            self._count('successes')
+            self.breaker.record_success()
+        if error is not None:
+            raise error
+        return response
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def metrics(self):
+        with self.lock:
+            metrics = dict(self.counters, in_flight=self.in_flight)
+            completed = metrics['successes'] + metrics['failures']
+            metrics['avg_latency_ms'] = round(self.latency_total * 1000 / completed, 1) if completed else 0.0
+        metrics['circuit'] = self.breaker.state
+        return metrics
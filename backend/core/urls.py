@@ -1,6 +1,6 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import UserViewSet, CourseViewSet, EnrollmentViewSet, ProgressViewSet, AchievementViewSet, LessonViewSet, QuizViewSet, QuestionViewSet, OptionViewSet, QuizAttemptViewSet, PaymentViewSet, CertificateViewSet, payment_webhook, NotificationViewSet, SupportTicketViewSet, ServiceViewSet, TeamMemberViewSet, RegisterView, user_me, learn_with_ai
+from .views import UserViewSet, CourseViewSet, EnrollmentViewSet, ProgressViewSet, AchievementViewSet, LessonViewSet, QuizViewSet, QuestionViewSet, OptionViewSet, QuizAttemptViewSet, PaymentViewSet, CertificateViewSet, payment_webhook, NotificationViewSet, SupportTicketViewSet, ServiceViewSet, TeamMemberViewSet, ChatSessionViewSet, RegisterView, user_me, learn_with_ai, learn_with_ai_stream, ai_metrics, search_catalog, sync_events
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 
 router = DefaultRouter()
@@ -20,16 +20,22 @@ router.register(r'notifications', NotificationViewSet)
 router.register(r'support-tickets', SupportTicketViewSet)
 router.register(r'services', ServiceViewSet)
 router.register(r'team', TeamMemberViewSet)
+router.register(r'chat-sessions', ChatSessionViewSet)
 
 urlpatterns = [
     path('auth/token/', TokenObtainPairView.as_view(), name='token_obtain_pair'),
     path('auth/token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
     path('auth/register/', RegisterView.as_view(), name='register'),
     path('users/me/', user_me, name='user_me'),
-    path('', include(router.urls)),
+    # Before the router, whose payments/<pk>/ route would otherwise swallow this path
     path('payments/webhook/', payment_webhook, name='payment_webhook'),
+    path('', include(router.urls)),
     path('auth/', include('dj_rest_auth.urls')),
     path('auth/registration/', include('dj_rest_auth.registration.urls')),
     path('auth/social/', include('allauth.socialaccount.urls')),
     path("learn-with-ai/", learn_with_ai, name="learn_with_ai"),
+    path("learn-with-ai/stream/", learn_with_ai_stream, name="learn_with_ai_stream"),
+    path("ai/metrics/", ai_metrics, name="ai_metrics"),
+    path('search/', search_catalog, name='search'),
+    path('sync/', sync_events, name='sync'),
 ] 
\ No newline at end of file
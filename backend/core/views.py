@@ -1,21 +1,18 @@
 from django.shortcuts import render
 from rest_framework import viewsets, permissions
-from .models import User, Course, Enrollment, Progress, Achievement, Lesson, Quiz, Question, Option, QuizAttempt, Payment, Certificate, Notification, SupportTicket, Service, TeamMember
-from .serializers import UserSerializer, CourseSerializer, EnrollmentSerializer, ProgressSerializer, AchievementSerializer, LessonSerializer, QuizSerializer, QuestionSerializer, OptionSerializer, QuizAttemptSerializer, PaymentSerializer, CertificateSerializer, NotificationSerializer, SupportTicketSerializer, ServiceSerializer, TeamMemberSerializer
+from .models import User, Course, Enrollment, Progress, Achievement, Lesson, Quiz, Question, Option, QuizAttempt, Payment, Certificate, CertificateJob, CertificateTemplate, Notification, SupportTicket, Service, TeamMember, CourseRating, ChatSession
+from .serializers import UserSerializer, CourseSerializer, EnrollmentSerializer, ProgressSerializer, AchievementSerializer, LessonSerializer, LessonOutlineSerializer, QuizSerializer, QuestionSerializer, OptionSerializer, QuizAttemptSerializer, PaymentSerializer, CertificateSerializer, CertificateJobSerializer, NotificationSerializer, SupportTicketSerializer, ServiceSerializer, TeamMemberSerializer, ChatSessionSerializer, ChatMessageSerializer
 from rest_framework_simplejwt.views import TokenObtainPairView, TokenRefreshView
 from django.contrib.auth import get_user_model
-from rest_framework.exceptions import PermissionDenied
+from rest_framework.exceptions import PermissionDenied, ValidationError
 from rest_framework.decorators import action, api_view, permission_classes
 from rest_framework.response import Response
 from django.utils import timezone
-from django.core.mail import EmailMessage
 from django.conf import settings
-import io
-from reportlab.pdfgen import canvas
-from reportlab.lib.pagesizes import letter
-from django.core.files.base import ContentFile
 from django.dispatch import receiver
-from django.db.models.signals import post_save, pre_save
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import post_save, pre_save, post_delete
 from django.template.loader import render_to_string
 from rest_framework.views import APIView
 from rest_framework import status
@@ -23,9 +20,32 @@ from django.contrib.auth.hashers import make_password
 import re
 from django.core.cache import cache
 from datetime import timedelta
-from django.http import JsonResponse
-from .gemini_utils import get_gemini_response
+import json
+from django.http import JsonResponse, HttpResponse, StreamingHttpResponse
+from rest_framework.renderers import JSONRenderer
+from .gemini_utils import GeminiError, get_gemini_response, stream_gemini_response
+from .llm_backends import get_backend
+from .ai_cache import cache_stats
+from .admission import LeasedStream, Rejected, acquire_slot, admission_controlled, check_rate, client_identity, release_slot, request_user, too_many_requests
+from asgiref.sync import sync_to_async
+from .chat import build_history, open_session, record_turn
+from .retrieval import ai_grounding
+from .certificates import completed_students, queue_certificates
+from .email_utils import queue_email
+from .notification_utils import broadcast_notification
+from . import search
+from .course_stats import adjust_rating, adjust_students_count, rate_course
+from .entitlements import get_entitlements, invalidate_entitlements
+from .webhooks import record_event
+from .catalog_cache import CATALOG_CACHE_TIMEOUT, bump_catalog_counts, bump_catalog_version, catalog_cache_key, uses_public_catalog
+from .quiz_cache import bump_quiz_version, delivery_content
+from .grading import grade
+from .sync import SyncError, apply_events, decode_batch
+from .progress import complete_lessons, recompute_course_on_commit, touch
+from .lesson_content import content_hash, encoded_content, etag, negotiate
 from django.views.decorators.csrf import csrf_exempt
+from django.utils.http import parse_etags
+from django.utils.cache import patch_vary_headers
 
 # Create your views here.
 
@@ -45,16 +65,48 @@ class CourseViewSet(viewsets.ModelViewSet):
     queryset = Course.objects.all()
     serializer_class = CourseSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # ?sort= orderings, each backed by an index on Course. The cursor holds the
+    # position in the first field only (id just breaks ties), so a course whose
+    # students_count or rating changes while a client pages can be skipped or
+    # listed twice. Only 'newest' is stable across pages.
+    SORT_ORDERINGS = {
+        'newest': '-id',
+        'popular': ('-students_count', '-id'),
+        'rating': ('-rating', '-id'),
+    }
+
+    @property
+    def cursor_ordering(self):
+        return self.SORT_ORDERINGS.get(self.request.query_params.get('sort'), '-id')
 
     def get_queryset(self):
         user = self.request.user
+        courses = Course.objects.select_related('instructor')
         if user.is_staff or (hasattr(user, 'role') and user.role == 'admin'):
-            return Course.objects.all()
+            return courses
         elif hasattr(user, 'role') and user.role == 'instructor':
-            return Course.objects.filter(instructor=user)
+            return courses.filter(instructor=user)
         else:
             # Students see only published courses
-            return Course.objects.filter(status='published')
+            return courses.filter(status='published')
+
+    # Published catalog reads are served from a versioned cache, see core.catalog_cache
+    def list(self, request, *args, **kwargs):
+        return self.cached_catalog_response('list', super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.cached_catalog_response('detail', super().retrieve, request, *args, **kwargs)
+
+    def cached_catalog_response(self, kind, view, request, *args, **kwargs):
+        if not uses_public_catalog(request.user):
+            return view(request, *args, **kwargs)
+        key = catalog_cache_key(kind, request)
+        content = cache.get(key)
+        if content is None:
+            response = view(request, *args, **kwargs)
+            content = JSONRenderer().render(response.data)
+            cache.set(key, content, CATALOG_CACHE_TIMEOUT)
+        return HttpResponse(content, content_type='application/json')
 
     def perform_create(self, serializer):
         user = self.request.user
@@ -69,6 +121,22 @@ class CourseViewSet(viewsets.ModelViewSet):
             raise PermissionDenied('You do not have permission to edit this course.')
         serializer.save()
 
+    @action(detail=True, methods=['post'], permission_classes=[permissions.IsAuthenticated])
+    def rate(self, request, pk=None):
+        course = self.get_object()
+        try:
+            score = int(request.data.get('score'))
+        except (TypeError, ValueError):
+            score = 0
+        if not 1 <= score <= 5:
+            return Response({'error': 'Score must be a number from 1 to 5.'}, status=400)
+        if not course.enrollments.filter(student=request.user).exists():
+            raise PermissionDenied('You must be enrolled in the course to rate it.')
+        rate_course(request.user, course, score)
+        bump_catalog_version()
+        course.refresh_from_db(fields=['rating', 'rating_count'])
+        return Response({'rating': course.rating, 'rating_count': course.rating_count})
+
 class EnrollmentViewSet(viewsets.ModelViewSet):
     queryset = Enrollment.objects.all()
     serializer_class = EnrollmentSerializer
@@ -76,10 +144,13 @@ class EnrollmentViewSet(viewsets.ModelViewSet):
 
     def get_queryset(self):
         user = self.request.user
+        enrollments = Enrollment.objects.select_related('course__instructor')
         if user.is_staff or (hasattr(user, 'role') and user.role == 'admin'):
-            return Enrollment.objects.all()
-        return Enrollment.objects.filter(student=user)
+            return enrollments
+        return enrollments.filter(student=user)
 
+    # Atomic so the students_count increment commits or rolls back with the enrollment
+    @transaction.atomic
     def perform_create(self, serializer):
         user = self.request.user
         course = serializer.validated_data['course']
@@ -90,6 +161,10 @@ class EnrollmentViewSet(viewsets.ModelViewSet):
                 raise PermissionDenied('You must pay for this course before enrolling.')
             serializer.save(student=user)
 
+    @transaction.atomic
+    def perform_destroy(self, instance):
+        instance.delete()
+
 class ProgressViewSet(viewsets.ModelViewSet):
     queryset = Progress.objects.all()
     serializer_class = ProgressSerializer
@@ -111,18 +186,75 @@ class LessonViewSet(viewsets.ModelViewSet):
     serializer_class = LessonSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
 
+    @property
+    def cursor_ordering(self):
+        # A course's outline order, a range of the (course, order, id) index;
+        # lessons of all courses come by primary key, never sorting the table
+        return ('order', 'id') if self.request.query_params.get('course') else 'id'
+
     def get_queryset(self):
         user = self.request.user
         now = timezone.now()
+        lessons = Lesson.objects.all()
+        course_id = self.request.query_params.get('course')
+        if course_id:
+            lessons = lessons.filter(course_id=course_id)
+        if self.action in ('list', 'content'):
+            # The body is only read on a cache miss in content()
+            lessons = lessons.defer('content')
         if user.is_staff or (hasattr(user, 'role') and user.role == 'admin'):
-            return Lesson.objects.all()
+            return lessons
         if user.is_authenticated:
-            enrolled_courses = Course.objects.filter(enrollments__student=user)
-            instructs_courses = Course.objects.filter(instructor=user)
             # Only show released lessons for students
-            return Lesson.objects.filter(course__in=enrolled_courses | instructs_courses, release_date__lte=now)
+            return lessons.filter(course_id__in=get_entitlements(user).courses, release_date__lte=now)
         return Lesson.objects.none()
 
+    def get_serializer_class(self):
+        if self.action == 'list':
+            return LessonOutlineSerializer
+        return LessonSerializer
+
+    def learner_enrollment(self, lesson):
+        enrollment_id = Enrollment.objects.filter(student=self.request.user, course_id=lesson.course_id).values_list('id', flat=True).first()
+        if enrollment_id is None:
+            raise PermissionDenied('You must be enrolled in the course.')
+        return enrollment_id
+
+    @action(detail=True, methods=['post'])
+    def complete(self, request, pk=None):
+        lesson = self.get_object()
+        enrollment_id = self.learner_enrollment(lesson)
+        complete_lessons([(enrollment_id, lesson.id, timezone.now())])
+        touch(enrollment_id)
+        enrollment = Enrollment.objects.only('progress', 'completed').get(pk=enrollment_id)
+        return Response({'progress': enrollment.progress, 'completed': enrollment.completed})
+
+    @action(detail=True, methods=['post'])
+    def heartbeat(self, request, pk=None):
+        # Coalesced in the cache, see core.progress
+        touch(self.learner_enrollment(self.get_object()))
+        return Response(status=status.HTTP_204_NO_CONTENT)
+
+    @action(detail=True, methods=['get'])
+    def content(self, request, pk=None):
+        # The lesson body, precompressed and cached per revision, see core.lesson_content
+        lesson = self.get_object()
+        encoding = negotiate(request.headers.get('Accept-Encoding', ''))
+        encoding, body = encoded_content(lesson, encoding)
+        tag = etag(lesson, encoding)
+        if_none_match = request.headers.get('If-None-Match', '')
+        if if_none_match.strip() == '*' or tag in parse_etags(if_none_match):
+            response = HttpResponse(status=status.HTTP_304_NOT_MODIFIED)
+        else:
+            response = HttpResponse(body, content_type='text/plain; charset=utf-8')
+            if encoding:
+                response['Content-Encoding'] = encoding
+        response['ETag'] = tag
+        # Lessons are per learner, so only the browser keeps a copy and checks it each time
+        response['Cache-Control'] = 'private, no-cache'
+        patch_vary_headers(response, ['Accept-Encoding'])
+        return response
+
 class QuizViewSet(viewsets.ModelViewSet):
     queryset = Quiz.objects.all()
     serializer_class = QuizSerializer
@@ -133,20 +265,58 @@ class QuizViewSet(viewsets.ModelViewSet):
         if user.is_staff or (hasattr(user, 'role') and user.role == 'admin'):
             return Quiz.objects.all()
         if user.is_authenticated:
-            enrolled_courses = Course.objects.filter(enrollments__student=user)
-            instructs_courses = Course.objects.filter(instructor=user)
-            return Quiz.objects.filter(lesson__course__in=enrolled_courses | instructs_courses)
+            return Quiz.objects.filter(lesson__course_id__in=get_entitlements(user).courses)
         return Quiz.objects.none()
 
+    @action(detail=True, methods=['get'])
+    def deliver(self, request, pk=None):
+        # Quiz, questions and options in one response, answers stripped, cached per quiz version
+        return HttpResponse(delivery_content(self.get_object()), content_type='application/json')
+
 class QuestionViewSet(viewsets.ModelViewSet):
     queryset = Question.objects.all()
     serializer_class = QuestionSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # Oldest first, the order they were written in
+    cursor_ordering = 'id'
+
+    def get_queryset(self):
+        questions = Question.objects.all()
+        quiz_id = self.request.query_params.get('quiz')
+        if quiz_id:
+            questions = questions.filter(quiz_id=quiz_id)
+        return questions
 
 class OptionViewSet(viewsets.ModelViewSet):
     queryset = Option.objects.all()
     serializer_class = OptionSerializer
     permission_classes = [permissions.IsAuthenticatedOrReadOnly]
+    # Oldest first, the order they were written in
+    cursor_ordering = 'id'
+
+    def get_queryset(self):
+        user = self.request.user
+        # The course id comes with each row, the serializer checks it against answer_courses
+        options = Option.objects.annotate(course_id=F('question__quiz__lesson__course_id'))
+        if not (user.is_staff or (hasattr(user, 'role') and user.role == 'admin')):
+            if not user.is_authenticated:
+                return Option.objects.none()
+            options = options.filter(course_id__in=get_entitlements(user).courses)
+        quiz_id = self.request.query_params.get('quiz')
+        if quiz_id:
+            options = options.filter(question__quiz_id=quiz_id)
+        question_id = self.request.query_params.get('question')
+        if question_id:
+            options = options.filter(question_id=question_id)
+        return options
+
+    def get_serializer_context(self):
+        # Which option is correct is only shown to staff and to the course's instructor
+        context = super().get_serializer_context()
+        user = self.request.user
+        if not (user.is_staff or (hasattr(user, 'role') and user.role == 'admin')):
+            context['answer_courses'] = get_entitlements(user).instructs
+        return context
 
 class QuizAttemptViewSet(viewsets.ModelViewSet):
     queryset = QuizAttempt.objects.all()
@@ -163,9 +333,25 @@ class QuizAttemptViewSet(viewsets.ModelViewSet):
         user = self.request.user
         quiz = serializer.validated_data['quiz']
         course = quiz.lesson.course
-        if not (is_enrolled(user, course) or user == course.instructor or user.is_staff):
+        if not (is_enrolled(user, course) or course.id in get_entitlements(user).instructs or user.is_staff):
             raise PermissionDenied('You must be enrolled in the course to attempt this quiz.')
-        serializer.save(user=user)
+        serializer.save(user=user, **self.graded(quiz, serializer.validated_data.get('answers', {})))
+
+    def perform_update(self, serializer):
+        # Learners see the correctness of their attempt, so only staff may change one (to regrade it)
+        user = self.request.user
+        if not (user.is_staff or (hasattr(user, 'role') and user.role == 'admin')):
+            raise PermissionDenied('Quiz attempts cannot be changed once submitted.')
+        attempt = serializer.instance
+        quiz = serializer.validated_data.get('quiz', attempt.quiz)
+        serializer.save(**self.graded(quiz, serializer.validated_data.get('answers', attempt.answers)))
+
+    def graded(self, quiz, answers):
+        try:
+            score, answers, correctness = grade(quiz.id, answers)
+        except (TypeError, ValueError) as e:
+            raise ValidationError({'answers': str(e)})
+        return {'score': score, 'answers': answers, 'correctness': correctness}
 
 class PaymentViewSet(viewsets.ModelViewSet):
     queryset = Payment.objects.all()
@@ -192,69 +378,69 @@ class CertificateViewSet(viewsets.ModelViewSet):
         # Check if user completed the course
         if not Enrollment.objects.filter(student=user, course=course, completed=True).exists():
             return Response({'error': 'Course not completed.'}, status=400)
-        cert, created = Certificate.objects.get_or_create(user=user, course=course)
-        if not cert.file:
-            # Generate PDF
-            buffer = io.BytesIO()
-            p = canvas.Canvas(buffer, pagesize=letter)
-            p.setFont('Helvetica-Bold', 24)
-            p.drawCentredString(300, 700, 'Certificate of Completion')
-            p.setFont('Helvetica', 16)
-            p.drawCentredString(300, 650, f'Awarded to: {user.get_full_name() or user.email}')
-            p.drawCentredString(300, 620, f'For completing the course: {course.title}')
-            p.setFont('Helvetica', 12)
-            p.drawCentredString(300, 580, f'Date: {timezone.now().strftime("%Y-%m-%d")}')
-            p.showPage()
-            p.save()
-            buffer.seek(0)
-            cert.file.save(f'certificate_{user.id}_{course.id}.pdf', ContentFile(buffer.read()))
-            buffer.close()
-            # Send email with certificate
-            subject = f'Your Certificate for {course.title}'
-            message = f'Congratulations {user.get_full_name() or user.email}!\n\nAttached is your certificate for completing {course.title}.'
-            email = EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, [user.email])
-            cert.file.open('rb')
-            email.attach(cert.file.name, cert.file.read(), 'application/pdf')
-            cert.file.close()
-            email.send(fail_silently=True)
-        return Response(CertificateSerializer(cert).data)
+        cert = Certificate.objects.filter(user=user, course=course).exclude(file='').exclude(file=None).first()
+        if cert is not None:
+            return Response(CertificateSerializer(cert).data)
+        # Rendered and emailed by `manage.py issue_certificates`, poll the job for progress
+        job = queue_certificates(course, [user.id], requested_by=user)
+        return Response(CertificateJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'], url_path='bulk-generate')
+    def bulk_generate(self, request):
+        # Certificates for every completed enrollment of a course still without one
+        user = request.user
+        try:
+            course = Course.objects.get(id=request.data.get('course_id'))
+        except (Course.DoesNotExist, ValueError, TypeError):
+            return Response({'error': 'Course not found.'}, status=404)
+        if not (user.is_staff or (hasattr(user, 'role') and user.role == 'admin') or course.instructor_id == user.id):
+            raise PermissionDenied('Only the course instructor or an admin can issue certificates for a course.')
+        job = queue_certificates(course, completed_students(course), requested_by=user)
+        return Response(CertificateJobSerializer(job).data, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['get'], url_path=r'jobs/(?P<job_id>\d+)')
+    def job(self, request, job_id=None):
+        user = request.user
+        jobs = CertificateJob.objects.all()
+        if not (user.is_staff or (hasattr(user, 'role') and user.role == 'admin')):
+            jobs = jobs.filter(requested_by=user)
+        try:
+            job = jobs.get(pk=job_id)
+        except CertificateJob.DoesNotExist:
+            return Response({'error': 'Job not found.'}, status=404)
+        return Response(CertificateJobSerializer(job).data)
 
 @api_view(['POST'])
 @permission_classes([permissions.AllowAny])
 def payment_webhook(request):
     # This is a generic webhook endpoint for payment providers
     # You should add provider-specific validation here
-    provider = request.data.get('provider')
-    reference = request.data.get('reference')
-    status = request.data.get('status')
-    try:
-        payment = Payment.objects.get(reference=reference, provider=provider)
-        payment.status = status
-        payment.webhook_payload = request.data
-        payment.save()
-        return Response({'success': True})
-    except Payment.DoesNotExist:
-        return Response({'error': 'Payment not found.'}, status=404)
+    # Events are stored and acknowledged right away; `manage.py process_payment_webhooks` applies them
+    payload = request.data.dict() if hasattr(request.data, 'dict') else request.data
+    provider = payload.get('provider')
+    reference = payload.get('reference')
+    event = payload.get('event') or payload.get('status')
+    if not (provider and reference and event):
+        return Response({'error': 'provider, reference and status are required.'}, status=400)
+    created = record_event(str(provider)[:50], str(reference)[:100], str(event)[:50], payload)
+    return Response({'success': True, 'duplicate': not created})
 
 # Helper function to check enrollment
 
 def is_enrolled(user, course):
-    return course.enrollments.filter(student=user, completed=False).exists()
+    return course.id in get_entitlements(user).active
 
 def has_paid(user, course):
-    return course.payments.filter(user=user, status='paid').exists()
+    return course.id in get_entitlements(user).paid
 
 # Helper function to send emails with HTML templates
+# Emails are written to the outbox and delivered by `manage.py send_queued_mail`
 def send_notification_email(subject, message, recipient_list, template=None, context=None, attachments=None):
-    email = EmailMessage(subject, message, settings.DEFAULT_FROM_EMAIL, recipient_list)
+    content_subtype = 'plain'
     if template and context:
-        html_content = render_to_string(template, context)
-        email.content_subtype = 'html'
-        email.body = html_content
-    if attachments:
-        for name, content, mimetype in attachments:
-            email.attach(name, content, mimetype)
-    email.send(fail_silently=True)
+        message = render_to_string(template, context)
+        content_subtype = 'html'
+    queue_email(subject, message, recipient_list, content_subtype=content_subtype, attachments=attachments)
 
 # User registration email notification
 @receiver(post_save, sender=get_user_model())
@@ -301,8 +487,8 @@ def enrollment_created(sender, instance, created, **kwargs):
         context2 = {'instructor_name': instructor.get_full_name() or instructor.email, 'student_name': instance.student.get_full_name() or instance.student.email, 'course_title': instance.course.title}
         message2 = render_to_string('emails/student_enrolled_instructor.html', context2)
         send_notification_email(subject2, message2, [instructor.email], template='emails/student_enrolled_instructor.html', context=context2)
-        Notification.objects.create(user=instance.student, message=f'You have been enrolled in {instance.course.title}', type='info')
-        broadcast_notification(instance.student.id, instance)
+        notification = Notification.objects.create(user=instance.student, message=f'You have been enrolled in {instance.course.title}', type='info')
+        broadcast_notification(instance.student.id, notification)
 
 # Notify admins on new course submission
 @receiver(post_save, sender=Course)
@@ -314,8 +500,8 @@ def new_course_submitted(sender, instance, created, **kwargs):
         context = {'course_title': instance.title, 'instructor_name': instance.instructor.get_full_name() or instance.instructor.email}
         message = render_to_string('emails/new_course_submitted.html', context)
         send_notification_email(subject, message, admin_emails, template='emails/new_course_submitted.html', context=context)
-        Notification.objects.create(user=instance.instructor, message=f'New course "{instance.title}" has been submitted for approval', type='info')
-        broadcast_notification(instance.instructor.id, instance)
+        notification = Notification.objects.create(user=instance.instructor, message=f'New course "{instance.title}" has been submitted for approval', type='info')
+        broadcast_notification(instance.instructor.id, notification)
 
 # Notify instructor on course approval/rejection
 def course_status_changed(sender, instance, **kwargs):
@@ -331,32 +517,20 @@ def course_status_changed(sender, instance, **kwargs):
             context = {'name': instance.instructor.get_full_name() or instance.instructor.email, 'course_title': instance.title}
             message = render_to_string('emails/course_approval.html', context)
             send_notification_email(subject, message, [instance.instructor.email], template='emails/course_approval.html', context=context)
-            Notification.objects.create(user=instance.instructor, message=f'Your course "{instance.title}" has been approved!', type='success')
-            broadcast_notification(instance.instructor.id, instance)
+            notification = Notification.objects.create(user=instance.instructor, message=f'Your course "{instance.title}" has been approved!', type='success')
+            broadcast_notification(instance.instructor.id, notification)
         elif instance.status == 'rejected':
             subject = f'Your course "{instance.title}" was rejected.'
             context = {'name': instance.instructor.get_full_name() or instance.instructor.email, 'course_title': instance.title}
             message = render_to_string('emails/course_rejection.html', context)
             send_notification_email(subject, message, [instance.instructor.email], template='emails/course_rejection.html', context=context)
-            Notification.objects.create(user=instance.instructor, message=f'Your course "{instance.title}" was rejected.', type='error')
-            broadcast_notification(instance.instructor.id, instance)
+            notification = Notification.objects.create(user=instance.instructor, message=f'Your course "{instance.title}" was rejected.', type='error')
+            broadcast_notification(instance.instructor.id, notification)
 
 pre_save.connect(course_status_changed, sender=Course)
 
-# Lesson release notification (to enrolled students)
-@receiver(post_save, sender=Lesson)
-def lesson_released(sender, instance, created, **kwargs):
-    if not created and instance.release_date:
-        now = timezone.now()
-        if instance.release_date <= now:
-            enrolled_students = [enr.student for enr in instance.course.enrollments.all()]
-            for student in enrolled_students:
-                subject = f'New lesson released: {instance.title}'
-                context = {'name': student.get_full_name() or student.email, 'lesson_title': instance.title, 'course_title': instance.course.title}
-                message = render_to_string('emails/lesson_release.html', context)
-                send_notification_email(subject, message, [student.email], template='emails/lesson_release.html', context=context)
-                Notification.objects.create(user=student, message=f'New lesson "{instance.title}" has been released in {instance.course.title}', type='info')
-                broadcast_notification(student.id, instance)
+# Lesson release notification (to enrolled students) is sent once per lesson by
+# `manage.py run_lesson_scheduler` when release_date arrives, see core.scheduler
 
 # Quiz result notification (to student)
 @receiver(post_save, sender=QuizAttempt)
@@ -366,19 +540,25 @@ def quiz_result_notification(sender, instance, created, **kwargs):
         context = {'name': instance.user.get_full_name() or instance.user.email, 'score': instance.score, 'lesson_title': instance.quiz.lesson.title, 'course_title': instance.quiz.lesson.course.title}
         message = render_to_string('emails/quiz_result.html', context)
         send_notification_email(subject, message, [instance.user.email], template='emails/quiz_result.html', context=context)
-        Notification.objects.create(user=instance.user, message=f'Quiz results for {instance.quiz.lesson.title} in {instance.quiz.lesson.course.title} are out!', type='info')
-        broadcast_notification(instance.user.id, instance)
+        notification = Notification.objects.create(user=instance.user, message=f'Quiz results for {instance.quiz.lesson.title} in {instance.quiz.lesson.course.title} are out!', type='info')
+        broadcast_notification(instance.user.id, notification)
 
-# Payment confirmation notification (to student)
+@receiver(pre_save, sender=Payment)
+def remember_payment_status(sender, instance, **kwargs):
+    instance._previous_status = None
+    if instance.pk:
+        instance._previous_status = sender.objects.filter(pk=instance.pk).values_list('status', flat=True).first()
+
+# Payment confirmation notification (to student), sent once when the payment becomes paid
 @receiver(post_save, sender=Payment)
 def payment_confirmation_notification(sender, instance, created, **kwargs):
-    if instance.status == 'paid':
+    if instance.status == 'paid' and getattr(instance, '_previous_status', None) != 'paid':
         subject = f'Payment Received for {instance.course.title}'
         context = {'name': instance.user.get_full_name() or instance.user.email, 'course_title': instance.course.title}
         message = render_to_string('emails/payment_confirmation.html', context)
         send_notification_email(subject, message, [instance.user.email], template='emails/payment_confirmation.html', context=context)
-        Notification.objects.create(user=instance.user, message=f'Payment received for {instance.course.title}', type='info')
-        broadcast_notification(instance.user.id, instance)
+        notification = Notification.objects.create(user=instance.user, message=f'Payment received for {instance.course.title}', type='info')
+        broadcast_notification(instance.user.id, notification)
 
 # Notify instructor when a student completes their course
 @receiver(post_save, sender=Enrollment)
@@ -389,8 +569,129 @@ def student_completed_course(sender, instance, **kwargs):
         context = {'instructor_name': instructor.get_full_name() or instructor.email, 'student_name': instance.student.get_full_name() or instance.student.email, 'course_title': instance.course.title}
         message = render_to_string('emails/course_completed_instructor.html', context)
         send_notification_email(subject, message, [instructor.email], template='emails/course_completed_instructor.html', context=context)
-        Notification.objects.create(user=instructor, message=f'Student {instance.student.get_full_name()} has completed {instance.course.title}', type='info')
-        broadcast_notification(instructor.id, instance)
+        notification = Notification.objects.create(user=instructor, message=f'Student {instance.student.get_full_name()} has completed {instance.course.title}', type='info')
+        broadcast_notification(instructor.id, notification)
+
+# Course progress is a share of the course's lessons
+@receiver(post_save, sender=Lesson)
+def lesson_added(sender, instance, created, **kwargs):
+    if created:
+        recompute_course_on_commit(instance.course_id)
+
+@receiver(post_delete, sender=Lesson)
+def lesson_removed(sender, instance, **kwargs):
+    recompute_course_on_commit(instance.course_id)
+
+# Any change to what the public catalog renders invalidates every cached catalog payload
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+@receiver(post_save, sender=Lesson)
+@receiver(post_delete, sender=Lesson)
+def catalog_changed(sender, **kwargs):
+    bump_catalog_version()
+
+@receiver(post_save, sender=get_user_model())
+def instructor_profile_changed(sender, instance, created, update_fields=None, **kwargs):
+    if created or (update_fields and set(update_fields) <= {'last_login'}):
+        return
+    if instance.role == 'instructor' or instance.courses.exists():
+        bump_catalog_version()
+
+# Delivered quizzes are cached per version
+@receiver(post_save, sender=Quiz)
+@receiver(post_delete, sender=Quiz)
+def quiz_changed(sender, instance, **kwargs):
+    bump_quiz_version(instance.pk)
+
+@receiver(post_save, sender=Question)
+@receiver(post_delete, sender=Question)
+def question_changed(sender, instance, **kwargs):
+    bump_quiz_version(instance.quiz_id)
+
+@receiver(post_save, sender=Option)
+@receiver(post_delete, sender=Option)
+def option_changed(sender, instance, **kwargs):
+    quiz_id = Question.objects.filter(pk=instance.question_id).values_list('quiz_id', flat=True).first()
+    if quiz_id is not None:
+        bump_quiz_version(quiz_id)
+
+# Keep the full-text search index in step with courses and lessons
+@receiver(post_save, sender=Course)
+def index_course_for_search(sender, instance, **kwargs):
+    search.index_course(instance)
+
+@receiver(post_delete, sender=Course)
+def unindex_course_for_search(sender, instance, **kwargs):
+    search.remove_course(instance)
+
+@receiver(post_save, sender=Lesson)
+def index_lesson_for_search(sender, instance, **kwargs):
+    search.index_lesson(instance)
+
+@receiver(post_delete, sender=Lesson)
+def unindex_lesson_for_search(sender, instance, **kwargs):
+    search.remove_lesson(instance)
+
+# Keep Course.students_count and the rating aggregate current with atomic increments
+@receiver(post_save, sender=Enrollment)
+def count_enrollment(sender, instance, created, **kwargs):
+    if created:
+        adjust_students_count(instance.course_id, 1)
+        bump_catalog_counts()
+
+@receiver(post_delete, sender=Enrollment)
+def uncount_enrollment(sender, instance, **kwargs):
+    adjust_students_count(instance.course_id, -1)
+    bump_catalog_counts()
+
+@receiver(post_delete, sender=CourseRating)
+def uncount_rating(sender, instance, **kwargs):
+    adjust_rating(instance.course_id, -instance.score, -1)
+    bump_catalog_version()
+
+# Drop cached entitlements whenever the rows they are derived from change
+def _loaded_user(instance, field):
+    # The related user object when it is loaded (often request.user), else its id
+    return getattr(instance, field) if instance._meta.get_field(field).is_cached(instance) else getattr(instance, f'{field}_id')
+
+@receiver(post_save, sender=Enrollment)
+@receiver(post_delete, sender=Enrollment)
+def enrollment_entitlements_changed(sender, instance, **kwargs):
+    invalidate_entitlements(_loaded_user(instance, 'student'))
+
+@receiver(post_save, sender=Payment)
+@receiver(post_delete, sender=Payment)
+def payment_entitlements_changed(sender, instance, **kwargs):
+    invalidate_entitlements(_loaded_user(instance, 'user'))
+
+@receiver(pre_save, sender=Course)
+def course_instructor_changed(sender, instance, **kwargs):
+    if instance.pk:
+        old_instructor_id = Course.objects.filter(pk=instance.pk).values_list('instructor_id', flat=True).first()
+        if old_instructor_id != instance.instructor_id:
+            invalidate_entitlements(old_instructor_id)
+
+@receiver(post_save, sender=Course)
+@receiver(post_delete, sender=Course)
+def course_entitlements_changed(sender, instance, **kwargs):
+    invalidate_entitlements(_loaded_user(instance, 'instructor'))
+
+@receiver(pre_save, sender=Lesson)
+def lesson_content_changed(sender, instance, **kwargs):
+    # A new hash is a new revision, cached bodies and ETags follow it
+    update_fields = kwargs.get('update_fields')
+    if update_fields is not None and 'content' not in update_fields:
+        return
+    instance.content_hash = content_hash(instance.content)
+    if update_fields is not None and 'content_hash' not in update_fields:
+        Lesson.objects.filter(pk=instance.pk).update(content_hash=instance.content_hash)
+
+@receiver(pre_save, sender=CertificateTemplate)
+def certificate_template_changed(sender, instance, **kwargs):
+    # A new version makes every worker compile the background again
+    if instance.pk:
+        version = CertificateTemplate.objects.filter(pk=instance.pk).values_list('version', flat=True).first()
+        instance.version = (version or 0) + 1
 
 class NotificationViewSet(viewsets.ModelViewSet):
     queryset = Notification.objects.all()
@@ -407,15 +708,20 @@ class NotificationViewSet(viewsets.ModelViewSet):
         notification.save()
         return Response({'status': 'marked as read'})
 
-def broadcast_notification(user_id, notification):
-    channel_layer = get_channel_layer()
-    async_to_sync(channel_layer.group_send)(
-        f'user_{user_id}_notifications',
-        {
-            'type': 'send_notification',
-            'notification': NotificationSerializer(notification).data
-        }
-    )
+class ChatSessionViewSet(viewsets.ModelViewSet):
+    # Sessions are started through learn-with-ai, here they are listed, read back and deleted
+    queryset = ChatSession.objects.all()
+    serializer_class = ChatSessionSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    http_method_names = ['get', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        return ChatSession.objects.filter(user=self.request.user)
+
+    @action(detail=True, methods=['get'])
+    def messages(self, request, pk=None):
+        page = self.paginate_queryset(self.get_object().messages.all())
+        return self.get_paginated_response(ChatMessageSerializer(page, many=True, context={'request': request}).data)
 
 class SupportTicketViewSet(viewsets.ModelViewSet):
     queryset = SupportTicket.objects.all()
@@ -523,9 +829,115 @@ def user_me(request):
     return Response(UserSerializer(request.user).data)
 
 @csrf_exempt
+@admission_controlled
 def learn_with_ai(request):
     prompt = request.GET.get("prompt")
     if not prompt:
         return JsonResponse({"error": "No prompt provided."}, status=400)
-    result = get_gemini_response(prompt)
-    return JsonResponse(result)
+    language = request.GET.get("lang") or getattr(request.ai_user, "language", "en")
+    session = None
+    if request.GET.get("session"):
+        session, error = _chat_session(request.ai_user, request.GET["session"])
+        if error:
+            return error
+    history = build_history(session) if session else ()
+    result = get_gemini_response(prompt, language=language, history=history, context=ai_grounding(request.ai_user, prompt))
+    payload = dict(result)
+    if session:
+        if "error" not in result:
+            record_turn(session, prompt, result["text"])
+        payload["session"] = session.id
+    return JsonResponse(payload)
+
+def _chat_session(user, session_id):
+    # Conversations are kept for signed-in users only
+    if not user.is_authenticated:
+        return None, JsonResponse({"error": "Sign in to keep a conversation."}, status=401)
+    session = open_session(user, session_id)
+    if session is None:
+        return None, JsonResponse({"error": "Chat session not found."}, status=404)
+    return session, None
+
+def _sse(data, event=None):
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+# Async so a slow upstream holds no worker thread, served under ASGI
+async def learn_with_ai_stream(request):
+    prompt = request.GET.get("prompt")
+    if not prompt:
+        return JsonResponse({"error": "No prompt provided."}, status=400)
+    user = await sync_to_async(request_user)(request)
+    identity, rate = client_identity(user, request.META.get("REMOTE_ADDR", ""))
+    session, history = None, ()
+    if request.GET.get("session"):
+        session, error = await sync_to_async(_chat_session)(user, request.GET["session"])
+        if error:
+            return error
+        history = await sync_to_async(build_history)(session)
+    try:
+        # Off the shared sync thread, waiting in the queue must not block other views
+        await sync_to_async(check_rate, thread_sensitive=False)(identity, rate)
+        lease = await sync_to_async(acquire_slot, thread_sensitive=False)()
+    except Rejected as rejected:
+        return too_many_requests(rejected)
+    try:
+        language = request.GET.get("lang") or getattr(user, "language", "en")
+        context = await sync_to_async(ai_grounding)(user, prompt)
+    except BaseException:
+        await sync_to_async(release_slot, thread_sensitive=False)(lease)
+        raise
+
+    async def events():
+        parts = []
+        if session:
+            yield _sse({"session": session.id}, event="session")
+        try:
+            async for text in stream_gemini_response(prompt, language=language, history=history, context=context):
+                parts.append(text)
+                yield _sse({"text": text})
+        except GeminiError as e:
+            yield _sse({"error": str(e)}, event="error")
+            return
+        if session:
+            await sync_to_async(record_turn)(session, prompt, "".join(parts))
+        yield _sse({}, event="done")
+
+    # The slot is given back when the stream ends or the response is closed, even unread
+    response = StreamingHttpResponse(LeasedStream(events(), lease), content_type="text/event-stream")
+    response["Cache-Control"] = "no-cache"
+    response["X-Accel-Buffering"] = "no"
+    return response
+
+# Upstream client counters are per process, cache counters are shared
+@api_view(['GET'])
+@permission_classes([permissions.IsAdminUser])
+def ai_metrics(request):
+    return Response({'backend': get_backend().name, 'upstream': get_backend().metrics(), 'cache': cache_stats()})
+
+@api_view(['GET'])
+@permission_classes([permissions.AllowAny])
+def search_catalog(request):
+    query = request.query_params.get('q', '').strip()
+    if not query:
+        return Response({'error': 'No search query provided.'}, status=400)
+    try:
+        limit = min(max(int(request.query_params.get('limit', 20)), 1), 100)
+    except ValueError:
+        limit = 20
+    # Lesson hits quote lesson bodies, so they only come from courses the caller may read
+    return Response({'results': search.search(query, limit=limit, lesson_courses=get_entitlements(request.user).courses)})
+
+@api_view(['POST'])
+@permission_classes([permissions.IsAuthenticated])
+def sync_events(request):
+    # Batched learner events from offline clients, see core.sync for the format
+    try:
+        events = decode_batch(request.body, request.META.get('HTTP_CONTENT_ENCODING', '').strip().lower())
+    except SyncError as e:
+        return Response({'error': str(e)}, status=400)
+    result, attempts = apply_events(request.user, events)
+    # bulk_create skips post_save, results are announced the way a single attempt's are
+    for attempt in attempts:
+        quiz_result_notification(QuizAttempt, attempt, created=True)
+    return Response(result)
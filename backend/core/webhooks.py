@@ -0,0 +1,100 @@
+import logging
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from .email_utils import backoff_delay
+from .models import Payment, PaymentWebhookEvent
+
+logger = logging.getLogger(__name__)
+
+WEBHOOK_BATCH_SIZE = 100
+# Events for a payment that is not there yet, or that fail to apply, are retried
+# with the outbox backoff. After the last attempt the first kind is ignored and
+# the second dead-lettered.
+WEBHOOK_MAX_ATTEMPTS = getattr(settings, 'PAYMENT_WEBHOOK_MAX_ATTEMPTS', 8)
+
+# Status changes a webhook may apply. A payment that is paid stays paid, so a
+# late or replayed 'pending'/'failed' event cannot undo a confirmation.
+ALLOWED_TRANSITIONS = {
+    'pending': {'paid', 'failed'},
+    'failed': {'paid'},
+    'paid': set(),
+}
+
+
+def record_event(provider, reference, event, payload):
+    # One INSERT; the unique (provider, reference, event) constraint turns provider retries into no-ops
+    try:
+        with transaction.atomic():
+            PaymentWebhookEvent.objects.create(provider=provider, reference=reference, event=event, payload=payload)
+        return True
+    except IntegrityError:
+        return False
+
+
+class Retry(Exception):
+    pass
+
+
+def _apply(event):
+    status = event.payload.get('status')
+    payment = (
+        Payment.objects.select_for_update()
+        .filter(provider=event.provider, reference=event.reference)
+        .first()
+    )
+    if payment is None:
+        # The webhook can arrive before the request that created the payment commits
+        raise Retry('Payment not found.')
+    if status == payment.status:
+        return 'ignored', 'Payment already has this status.'
+    if status not in ALLOWED_TRANSITIONS.get(payment.status, ()):
+        return 'ignored', f'Cannot change payment from {payment.status} to {status}.'
+    payment.status = status
+    payment.webhook_payload = event.payload
+    payment.save(update_fields=['status', 'webhook_payload'])
+    return 'applied', ''
+
+
+def _defer(event, error, final_status):
+    event.attempts += 1
+    event.error = error
+    if event.attempts >= WEBHOOK_MAX_ATTEMPTS:
+        event.status = final_status
+        event.processed_at = timezone.now()
+        logger.error("Payment webhook %s marked %s after %s attempts: %s", event.id, final_status, event.attempts, error)
+    else:
+        event.next_attempt_at = timezone.now() + backoff_delay(event.attempts)
+    event.save(update_fields=['status', 'error', 'attempts', 'next_attempt_at', 'processed_at'])
+
+
+# Apply due events oldest first, returns the number processed. Events of a
+# payment wait while an earlier event of the same payment is being retried.
+def apply_pending_events(batch_size=WEBHOOK_BATCH_SIZE):
+    now = timezone.now()
+    waiting = set(
+        PaymentWebhookEvent.objects.filter(status='received', next_attempt_at__gt=now).values_list('provider', 'reference')
+    )
+    processed = 0
+    events = PaymentWebhookEvent.objects.filter(status='received', next_attempt_at__lte=now).order_by('id')[:batch_size]
+    for event in events:
+        payment = (event.provider, event.reference)
+        if payment in waiting:
+            continue
+        try:
+            with transaction.atomic():
+                event.status, event.error = _apply(event)
+                event.processed_at = timezone.now()
+                event.save(update_fields=['status', 'error', 'processed_at'])
+        except Retry as e:
+            _defer(event, str(e), 'ignored')
+        except Exception as e:
+            logger.warning("Error applying payment webhook %s: %s", event.id, e, exc_info=True)
+            event.status = 'received'
+            _defer(event, str(e), 'dead')
+        if event.status == 'received':
+            waiting.add(payment)
+        processed += 1
+    return processed
@@ -110,6 +110,78 @@ DATABASES = {
 }
 
 
+# Cache
+# Set CACHE_REDIS_URL in production so every worker shares the cached catalog;
+# the local memory cache is per process.
+
+if os.getenv('CACHE_REDIS_URL'):
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_REDIS_URL'),
+        },
+        # Size bound comes from the server's maxmemory with an allkeys-lru policy
+        'ai': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.getenv('CACHE_REDIS_URL'),
+            'KEY_PREFIX': 'ai',
+        },
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        },
+        'ai': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'LOCATION': 'ai',
+            'OPTIONS': {'MAX_ENTRIES': 5000},
+        },
+    }
+
+# Payloads cached per version are only invalidated across workers by a shared
+# cache; with the local memory cache they are kept LOCAL_CACHE_TIMEOUT seconds
+LOCAL_CACHE_TIMEOUT = 30
+CATALOG_CACHE_TIMEOUT = 60 * 60 * 24
+# Enrollment counts in the cached catalog may lag by this much
+CATALOG_COUNTS_BUMP_SECONDS = 60
+# Delivered quizzes, cached per quiz version
+QUIZ_CACHE_TIMEOUT = 60 * 60 * 24
+# Compressed lesson bodies, cached per content hash
+LESSON_CONTENT_CACHE_TIMEOUT = 60 * 60 * 24
+
+# Answers to repeated AI prompts
+AI_CACHE_ALIAS = 'ai'
+AI_CACHE_TIMEOUT = 60 * 60 * 24 * 7
+
+# Upstream AI client: concurrent requests per process, retries, circuit breaker
+GEMINI_MAX_CONCURRENCY = 8
+GEMINI_RETRIES = 2
+GEMINI_BREAKER_THRESHOLD = 5
+GEMINI_BREAKER_RESET_SECONDS = 30
+
+# Admission to the AI endpoints: (requests, seconds) per caller, burst size,
+# shared cap on answers in progress and on callers queued for one
+# (raise them through the environment for load tests)
+AI_USER_RATE = (int(os.getenv('AI_USER_RATE_PER_MINUTE', '20')), 60)
+AI_ANON_RATE = (int(os.getenv('AI_ANON_RATE_PER_MINUTE', '5')), 60)
+AI_RATE_BURST = int(os.getenv('AI_RATE_BURST', '5'))
+AI_MAX_ACTIVE = 32
+AI_MAX_QUEUED = 64
+AI_QUEUE_TIMEOUT = 10
+# A slot held longer than this without renewal, e.g. by a killed worker, is freed
+AI_SLOT_LEASE_SECONDS = 120
+
+# Estimated tokens of chat history sent with each prompt, of which the summary of older turns may use
+CHAT_CONTEXT_TOKENS = 2000
+CHAT_SUMMARY_TOKENS = 400
+
+# Lesson passages retrieved to ground AI answers, built by `manage.py build_retrieval_index`
+RETRIEVAL_INDEX_DIR = BASE_DIR / 'retrieval_index'
+RETRIEVAL_TOP_K = 3
+RETRIEVAL_MIN_SCORE = 0.1
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -160,6 +232,7 @@ REST_FRAMEWORK = {
     'DEFAULT_PERMISSION_CLASSES': (
         'rest_framework.permissions.IsAuthenticated',
     ),
+    'DEFAULT_PAGINATION_CLASS': 'core.pagination.KeysetPagination',
 }
 
 from datetime import timedelta
@@ -171,6 +244,30 @@ SIMPLE_JWT = {
 
 EMAIL_BACKEND = 'django.core.mail.backends.console.EmailBackend'
 DEFAULT_FROM_EMAIL = 'noreply@hausasoft.com'
+# Seconds an SMTP operation may block; the outbox leases claimed rows for the whole batch at this rate
+EMAIL_TIMEOUT = 10
+
+# Outgoing email is queued in core.EmailOutbox and sent by `manage.py send_queued_mail`
+EMAIL_OUTBOX_BATCH_SIZE = 200
+EMAIL_OUTBOX_MAX_ATTEMPTS = 6
+EMAIL_OUTBOX_BACKOFF_SECONDS = 30
+
+# Payment webhooks that cannot be applied yet are retried with the same backoff, then given up
+PAYMENT_WEBHOOK_MAX_ATTEMPTS = 8
+
+# Batched learner events from offline clients (POST /api/sync/)
+SYNC_MAX_EVENTS = 500
+SYNC_MAX_BYTES = 1024 * 1024
+
+# Progress heartbeats are held in the cache and written at most once per period per learner
+HEARTBEAT_FLUSH_SECONDS = 60
+
+# Certificates issued per transaction by `manage.py issue_certificates`
+CERTIFICATE_CHUNK_SIZE = 200
+# Running jobs that have not finished a chunk for this long are picked up by another worker
+CERTIFICATE_JOB_LEASE_SECONDS = 600
+# TrueType font embedded for certificate text the standard PDF fonts cannot show (Hausa ɓ ɗ ƙ ƴ)
+CERTIFICATE_FONT = ''
 
 # CORS settings
 CORS_ALLOW_ALL_ORIGINS = True  # For development only
@@ -220,4 +317,8 @@ SOCIALACCOUNT_PROVIDERS = {
 
 # Gemini AI Configuration
 GEMINI_API_KEY = os.getenv('GEMINI_API_KEY')
+# Point GEMINI_BASE_URL at `manage.py run_llm_stub` to load-test without a key or network
+AI_BACKEND = os.getenv('AI_BACKEND', 'gemini')
+GEMINI_BASE_URL = os.getenv('GEMINI_BASE_URL', 'https://generativelanguage.googleapis.com')
+GEMINI_MODEL = 'gemini-2.0-flash'
 
@@ -1,10 +1,11 @@
 import axios from 'axios';
-import { API_BASE_URL } from './config';
+import { API_BASE_URL, getHeaders } from './config';
 
 export const sendMessage = async (message: string) => {
   try {
     const response: any = await axios.get(`${API_BASE_URL}/learn-with-ai/`, {
       params: { prompt: message },
+      headers: getHeaders(),
     });
     return { response: response.data.text };
   } catch (error: any) {
@@ -13,4 +14,46 @@ export const sendMessage = async (message: string) => {
     }
     throw new Error('Network error occurred');
   }
-}; 
\ No newline at end of file
+}; 
+// Streams the answer over Server-Sent Events, onChunk receives text as it arrives.
+// Pass sessionId 'new' to start a conversation, onSession receives its id.
+export const streamMessage = async (
+  message: string,
+  onChunk: (text: string) => void,
+  sessionId?: string,
+  onSession?: (id: string) => void,
+) => {
+  const params = new URLSearchParams({ prompt: message, ...(sessionId ? { session: sessionId } : {}) });
+  let response: Response;
+  try {
+    response = await fetch(`${API_BASE_URL}/learn-with-ai/stream/?${params}`, { headers: getHeaders() });
+  } catch {
+    throw new Error('Network error occurred');
+  }
+  if (!response.ok || !response.body) {
+    const data = await response.json().catch(() => ({}));
+    throw new Error(data.error || 'Failed to get AI response');
+  }
+  const reader = response.body.getReader();
+  const decoder = new TextDecoder();
+  let buffer = '';
+  while (true) {
+    const { done, value } = await reader.read();
+    if (done) break;
+    buffer += decoder.decode(value, { stream: true });
+    const events = buffer.split('\n\n');
+    buffer = events.pop() || '';
+    for (const event of events) {
+      const lines = event.split('\n');
+      const type = lines.find(line => line.startsWith('event: '))?.slice(7);
+      const data = JSON.parse(lines.find(line => line.startsWith('data: '))?.slice(6) || '{}');
+      if (type === 'error') throw new Error(data.error || 'Failed to get AI response');
+      if (type === 'done') return;
+      if (type === 'session') {
+        onSession?.(String(data.session));
+        continue;
+      }
+      if (data.text) onChunk(data.text);
+    }
+  }
+};
@@ -1,5 +1,5 @@
 import React, { createContext, useContext, useState, ReactNode } from 'react';
-import { sendMessage } from '../api/aiChat';
+import { streamMessage } from '../api/aiChat';
 
 interface Message {
   id: string;
@@ -22,6 +22,8 @@ export const ChatProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
   const [messages, setMessages] = useState<Message[]>([]);
   const [isLoading, setIsLoading] = useState(false);
   const [error, setError] = useState<string | null>(null);
+  // The server keeps the conversation, signed-in users continue it by id
+  const [sessionId, setSessionId] = useState<string | null>(null);
 
   const handleSendMessage = async (text: string) => {
     try {
@@ -37,18 +39,18 @@ export const ChatProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
       };
       setMessages(prev => [...prev, userMessage]);
 
-      // Get AI response
-      const response = await sendMessage(text);
-      
-      // Add AI message
-      const aiMessage: Message = {
-        id: (Date.now() + 1).toString(),
-        text: response.response,
-        sender: 'ai',
-        timestamp: new Date(),
-      };
-      setMessages(prev => [...prev, aiMessage]);
+      // Add an empty AI message and fill it in as the answer streams
+      const aiMessageId = (Date.now() + 1).toString();
+      setMessages(prev => [...prev, { id: aiMessageId, text: '', sender: 'ai', timestamp: new Date() }]);
+      const signedIn = Boolean(localStorage.getItem('access'));
+      await streamMessage(text, chunk => {
+        setIsLoading(false);
+        setMessages(prev => prev.map(message => (
+          message.id === aiMessageId ? { ...message, text: message.text + chunk } : message
+        )));
+      }, signedIn ? sessionId || 'new' : undefined, setSessionId);
     } catch (err: any) {
+      setMessages(prev => prev.filter(message => message.sender === 'user' || message.text));
       setError(err.message);
     } finally {
       setIsLoading(false);
@@ -57,6 +59,7 @@ export const ChatProvider: React.FC<{ children: ReactNode }> = ({ children }) =>
 
   const clearChat = () => {
     setMessages([]);
+    setSessionId(null);
     setError(null);
   };
 